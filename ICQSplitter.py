@@ -13,7 +13,7 @@ all data reported from an observer, this program also filters from the data entr
 observation that were made with telescopes when the comet was too bright, etc...). A list of all criterion for why
 a observation is 'kept' or 'removed' can be found on 'reasons_data_were_removed.txt'. This code is set up such that
 if there is a reason included here for why a point is removed that you do not agree with then you can comment out that section
-in main().
+in sortingrules().
 
 There exists command line arguments --heliocentric and --phase that will pull ephemerides from JPL HORIZONS with
 Michael Mommert's CALLHORIZONS package as well as Dave Schleicher's Composite Dust Phase Function for Comets available 
@@ -30,6 +30,15 @@ post-perihelion data in range (y,z) ).
 The command line argument --plot will also plot any available data (i.e., any combination of raw magnitudes, mehlio, mphase, and 
 mshift Vs. heliocentric distance). (note at least one of --heliocentric and --phase must be used along with --plot to query JPL).
 
+The command line argument --append will only read the lines added to the input file since the last run with --append and add their
+kept and removed points to the ends of the output files, querying JPL HORIZONS only over the dates of the new points.
+
+The command line argument --catalogue will run all of the above on every comet of an input file with observations of many comets
+(e.g., a whole COBS export), several comets at a time, writing the outputs of each comet to its own directory in catalogue_directory.
+
+The command line argument --benchmark will time the two body ephemerides worked out from the orbital elements in elements_file (used
+with ephemeris_provider = 'elements' for runs without JPL HORIZONS) and report how far they are from the ephemerides of JPL HORIZONS.
+
 
 
 curtisa1 (at) mail.usf.edu, latest version: v3.1, 2018-08-02
@@ -39,6 +48,9 @@ Available command line arguments (type these into terminal when compiling progra
 --phase
 --stats
 --plot
+--catalogue
+--append
+--benchmark
 
 *    v1.0: Sorts problematic entries from data, performs heliocentric distance and phase angle corrections.
 *    v1.1: Added Input Argument CCD_Bool for people using only CCD Measurements.
@@ -55,14 +67,38 @@ Available command line arguments (type these into terminal when compiling progra
 ####### Input Arguments #######
 ###############################
 
-input_file = 'analysis_2020-07-10_1549.dat'            #Name of your input file
+input_file = 'analysis_2020-07-10_1549.dat'            #Name of your input file, or a directory or pattern (e.g., 'submissions/*.txt') of many input files to read in together
 target_nickname = 'NEOWISE'                        #Nickname of target for output file organization (for example, HB = Hale-Bopp)
 small_body_designation = 'C/2020 F3'            #Name of your small body ex) 'ceres' or 'eris'
-JPL_Time_Increment = 30                     #How much to increment JPL queries in minutes up to 60.
+JPL_Time_Increment = 30                     #How much to increment JPL queries in minutes.
+JPL_Query_Epochs = 10000                    #Largest number of epochs asked of JPL HORIZONS in one query (at most 100,000), longer date ranges are split into several queries
+JPL_Connections = 4                         #Number of queries made to JPL HORIZONS at once
+JPL_Retries = 3                             #Number of times a failed query to JPL HORIZONS is tried again, waiting 1, 2, 4, ... seconds in between
+JPL_Discrete_Epochs = 0                     #If 1 then JPL HORIZONS is only queried at the epochs nearest to the observations (every JPL_Time_Increment minutes) rather than at every epoch from the first observation to the last, best for sparse data
+JPL_Discrete_Query_Epochs = 100             #With JPL_Discrete_Epochs, number of epochs asked of JPL HORIZONS in one query
+JPL_Spline_Increment = 0                    #If not 0 then JPL HORIZONS is queried about every this many minutes (e.g., 1440 for daily) and r, delta and phase angle are interpolated to the exact time of each observation with cubic splines, querying more epochs where they change fastest (e.g., near perihelion)
+JPL_Spline_Tolerance = 0.001                #With JPL_Spline_Increment, largest error in magnitudes of the corrections made with the interpolated r, delta and phase angle
+JPL_Prefetch = 1                            #If 1 then the ephemerides of each batch of kept points are queried in the background while the rest of the input is still read and sorted (needs the ephemeris cache, see cache_directory)
 ouput_file_kept_points = 'keepers.csv'        #Name of output file for points that meet all sorting criterion
 output_file_rejected_points = 'removed.csv'    #Name of output file for points that were removed from the data
-perihelion = '2020/07/03'                    #Datetime of perihelion format YYYY/MM/DD
+perihelion = '2020/07/03'                    #Datetime of perihelion format YYYY/MM/DD, '' to take it from the ephemerides queried from JPL HORIZONS (the date r is smallest)
 CCD_Bool = 1                                #If 0 then user only has CCD measurements only, if 1 then user has visual magnitude measurements
+batch_size = 100000                         #Number of lines of the input file read in and sorted at a time, lower this if you run out of memory
+output_directory = ''                         #Directory the output files are written to, '' for the current directory
+catalogue_directory = 'catalogue'           #With --catalogue, directory the outputs of each comet are written to (one sub-directory per comet)
+perihelia_file = 'perihelia.txt'            #With --catalogue, file of 'designation YYYY/MM/DD' lines giving the perihelion of each comet (designation as in JPL HORIZONS, e.g. C/1995 O1), optionally followed by the name JPL HORIZONS knows the comet by when it is not that designation (see readperihelia), comets not in it take perihelion above (so all of them are found from their ephemerides if it is '')
+processes = 0                               #Number of processes used to read in many input files or, with --catalogue, comets processed at once (0 uses every CPU)
+cache_directory = '.icqcache'               #Directory sorted input files are cached in so that reruns on the same file skip reading and sorting it, '' to turn off caching
+cache_size = 1000                           #Largest size of the cache in MB, the least recently used files are deleted past this
+state_file = 'ICQSplitter_state.npz'        #With --append, file in output_directory the state of the last run is kept in so that the next run only reads the lines added since
+ephemeris_provider = 'horizons'             #Where ephemerides come from: 'horizons' queries JPL HORIZONS, 'file' reads ephemerides saved from JPL HORIZONS in ephemeris_directory (no network needed), 'elements' works them out from the orbital elements in elements_file (no network needed, see twobodyephemerides), 'mock' uses the arrays in mock_ephemerides (for testing)
+ephemeris_directory = 'ephemerides'         #With ephemeris_provider = 'file', directory of ephemerides saved from JPL HORIZONS, one file per object named after it with / and spaces as _ (e.g., C_1995_O1.txt), see readephemerisfile
+phase_models = ['schleicher']               #With --phase, phase functions the magnitudes are corrected with: 'schleicher' (Schleicher's composite dust phase function), 'marcus' (Marcus's compound Henyey-Greenstein dust phase function), 'henyey-greenstein' (of asymmetry phase_hg_g) or 'linear' (phase_linear_beta magnitudes per degree). The first gives mph, each other one an extra column mph_<name>
+phase_hg_g = 0.9                            #With the 'henyey-greenstein' phase model, its asymmetry parameter g (above 0 for dust scattering light forwards)
+phase_linear_beta = 0.035                   #With the 'linear' phase model, its phase coefficient in magnitudes per degree of phase angle
+phase_table_resolution = 0.01               #Step in degrees of phase angle of the tables the phase models are evaluated on once, then interpolated from
+phase_function_file = 'Schleicher_Composite_Phase_Function.txt'  #With --phase, file of Schleicher's composite phase function (phase angle in degrees and the function normalized to 0 degrees on each line), a relative path is taken from the directory of this script rather than the current directory
+elements_file = 'elements.txt'              #With ephemeris_provider = 'elements' or --benchmark, file of 'designation q e i node peri T' lines giving the osculating orbital elements of each object: perihelion distance (au), eccentricity, inclination, longitude of the ascending node and argument of perihelion (degrees, ecliptic J2000) and time of perihelion (Julian Date), e.g. 'C/1995 O1 0.9141 0.99510 89.43 282.47 130.59 2450539.63'
 
 ###############################
 ####### Input Arguments #######
@@ -73,6 +109,12 @@ try:
 except:
     print('Please install the callhorizons python package with pip install callhorizons')
 import os
+import mmap
+import glob
+import itertools
+import hashlib
+import contextlib
+import concurrent.futures
 import numpy as np
 import math
 import csv
@@ -83,6 +125,7 @@ import pylab as plt
 import statistics
 from scipy import stats
 from scipy import linalg
+from scipy.interpolate import CubicSpline
 from matplotlib.ticker import MultipleLocator
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from matplotlib.figure import Figure
@@ -91,395 +134,1287 @@ from datetime import datetime, timedelta
 import warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning) 
 
-#Deletes the i-th observation in the dataset after it failed a sorting criterion
-#Defined later, metalist is a list whose elements are each column (as lists) of the input file
-#see mainblock to know what each element of metalist is (e.g., metalist[23] == list of observer for each observation)
-#read as: for each colum in our data, start at the last point, work backwards and delete the specified point
-def deletearow(i):
-    for x in range (len(metalist)-1, -1, -1):
-        del metalist[x][i]
-
-#Adds the i-th deleted observation to the 'rejected.csv' file with y as a reason it was removed
-#removed_metalist is the same as metalist except for the rejected points during sorting
-def addToremoved(i,y):
-    for x in range (len(metalist)-1, -1, -1):
-        removed_metalist[x].append(metalist[x][i])
-    removed_metalist[24].append("REMOVED POINT")
-    removed_metalist[25].append(list_of_reasons_removed[y])
-
-#Removes a point from the dataset if there is more than one observation from the same observer at the same night
-#read as: for total number of points in a column (i.e., total number of observations), work backwards and delete necessary points
-#If observer, year, month, and day are the same then delete a point based on the focal lengths metalist[11] or observation method metalist[7]
-def deleteForDuplicatedDates(numdelforduplicatedate):
-    for k in range (len(metalist[2])-1, -1, -1):
-        if k == 0:
-            print("number deleted for duplicated observation dates by same person "+str(numdelforduplicatedate))
-            break
-        if (metalist[23][k]==metalist[23][k-1]) and (metalist[3][k] == metalist[3][k-1]) and (metalist[4][k] == metalist[4][k-1]) and (math.floor(float(metalist[5][k])) == math.floor(float(metalist[5][k-1]))):
-            if (float(metalist[11][k])<float(metalist[11][k-1])):
-                numdelforduplicatedate = numdelforduplicatedate +1
-                addToremoved(k-1,reasonForDelete)
-                deletearow(k-1)
-                continue
-            elif (metalist[7][k] == "S"):
-                numdelforduplicatedate = numdelforduplicatedate +1
-                addToremoved(k-1,reasonForDelete)
-                deletearow(k-1)
-                continue
-            elif (metalist[7][k-1] == "S"):
-                numdelforduplicatedate = numdelforduplicatedate +1
-                addToremoved(k,reasonForDelete)
-                deletearow(k)
-                continue
-            elif (metalist[7][k] == "M"):
-                numdelforduplicatedate = numdelforduplicatedate +1
-                addToremoved(k-1,reasonForDelete)
-                deletearow(k-1)
-                continue
-            elif (metalist[7][k-1] == "M"):
-                numdelforduplicatedate = numdelforduplicatedate +1
-                addToremoved(k,reasonForDelete)
-                deletearow(k)
-                continue
-            elif ((metalist[7][k] == "B") or (metalist[7][k] == "I")):
-                numdelforduplicatedate = numdelforduplicatedate +1
-                addToremoved(k-1,reasonForDelete)
-                deletearow(k)
-                continue
-            elif ((metalist[7][k-1] == "B") or (metalist[7][k-1] == "I")):
-                numdelforduplicatedate = numdelforduplicatedate +1
-                addToremoved(k-1,reasonForDelete)
-                deletearow(k-1)
+#Layout of the ICQ 80 column format (see 'input_columns_meaning.txt'), one entry per column of the input file.
+#Each entry is (field name, start, stop, NumPy type, output format, csv header) where line[start:stop] is the field in a line of input.
+#Magnitudes, apertures and decimal days are stored as floats (NaN when nothing was reported), years and months as small ints
+#and every code column as fixed width bytes. Output format is used to turn numeric fields back into text when writing csv files.
+ICQ_COLUMNS = [
+    ('shortperapparition', 0, 3, 'S3', None, 'col 1-3 : short period comet designation'),
+    ('designation', 3, 9, 'S6', None, 'col 4-9 : Standard comet designation'),
+    ('splitnuc', 9, 10, 'S1', None, 'col 10 : multiple nuclei present?'),
+    ('yearobs', 11, 15, 'i2', '%d', 'col 12-15 : year observed'),
+    ('monthobs', 16, 18, 'i1', '%02d', 'col 17-18 : month observed'),
+    ('dayobs', 19, 24, 'f8', '%05.2f', 'col 20-24'),
+    ('speicalnotes', 25, 26, 'S1', None, 'col 26 : special note / extinction note'),
+    ('magmethod', 26, 27, 'S1', None, 'col 27 : Magnitude collection method'),
+    ('mag', 28, 32, 'f8', '%.1f', 'col 28-32 : visual magnitude estimate'),
+    ('poorconditions', 32, 33, 'S1', None, 'col 33 : poor conditions?'),
+    ('referencecat', 33, 35, 'S2', None, 'col 34 - 35 : reference catalog'),
+    ('instaperture', 35, 40, 'f4', '%.1f', 'col 36-40 : instrument aperture in centimeters'),
+    ('insttype', 40, 41, 'S1', None, 'col 41 : instrument type'),
+    ('focalratio', 41, 43, 'S2', None, 'col 42 - 43 : focal ratio'),
+    ('magnification', 43, 47, 'S4', None, 'col 44-47 : magnification used'),
+    ('comadiamestimate', 48, 49, 'S1', None, 'col 49 : error estimate for coma diameter'),
+    ('comadiameter', 49, 54, 'S5', None, 'col 50 - 54 : coma diameter in arcminutes'),
+    ('centralcondensation', 54, 55, 'S1', None, 'col 55 : special note on central condensation of comet'),
+    ('degreeofcondensation', 55, 57, 'S2', None, 'col : 56 -57 : degree of condensation (note / means estimate)'),
+    ('taillength', 58, 63, 'S5', None, 'col 59 - 64 : error of tail approximation and tail approximation'),
+    ('positionangleoftail', 64, 67, 'S3', None, 'col 65 - 67 : direction tail is pointed'),
+    ('ICQPublication', 68, 74, 'S6', None, 'col 69-74 : ICQ reference publication'),
+    ('specialnotestwo', 74, 75, 'S1', None, 'col 75 : second special note / extinction note '),
+    ('obs', 75, 80, 'S5', None, 'col 76-80 : observer name'),
+]
+#Every row also holds linewidth, the number of columns of its line (not counting the line ending), which is not written out
+ICQ_DTYPE = np.dtype([(name, kind) for name, start, stop, kind, fmt, header in ICQ_COLUMNS] + [('linewidth', 'i4')])
+ICQ_HEADERS = [header for name, start, stop, kind, fmt, header in ICQ_COLUMNS]
+
+ICQ_WIDTH = 80
+
+#Reads the numbers in a fixed width numeric field of every line at once. chars is an (N, width) array of the bytes of the field.
+#Each number is read as an integer made of all of its digits divided by a power of ten for the digits after the decimal point,
+#which gives exactly the same value as float(text). Blank or unreadable fields (e.g., '-' for no magnitude) become NaN.
+def parsenumbers(chars):
+    width = chars.shape[1]
+    digits = (chars >= ord('0')) & (chars <= ord('9'))
+    points = chars == ord('.')
+    minus = chars == ord('-')
+    filled = chars != ord(' ')
+    #the characters of a number must be next to each other, with the minus sign (if any) first
+    first = np.where(filled.any(axis=1), filled.argmax(axis=1), width)
+    last = width - 1 - filled[:, ::-1].argmax(axis=1)
+    position = np.arange(width)
+    inside = (position >= first[:, None]) & (position <= last[:, None])
+    valid = ((digits | points | minus) == inside).all(axis=1) & digits.any(axis=1) & (points.sum(axis=1) <= 1)
+    valid = valid & ((minus.sum(axis=1) == 0) | ((minus.sum(axis=1) == 1) & minus[np.arange(len(chars)), np.minimum(first, width - 1)]))
+    #digits_to_the_right[i, j] is the number of digits after character j of line i, digits_after_point[i] is the number of decimal places
+    digits_to_the_right = np.cumsum(digits[:, ::-1], axis=1)[:, ::-1] - digits
+    digits_after_point = np.where(points.any(axis=1), (digits & (np.cumsum(points, axis=1) > 0)).sum(axis=1), 0)
+    mantissa = np.where(digits, (chars.astype(np.int64) - ord('0')) * 10 ** digits_to_the_right.astype(np.int64), 0).sum(axis=1)
+    values = mantissa / 10.0 ** digits_after_point
+    values = np.where(minus.any(axis=1), -values, values)
+    return np.where(valid, values, np.nan)
+
+#Finds every line in a memory mapped file, returning where each line starts and how many characters it has (not counting the line ending)
+#Lines are found block_size bytes at a time and yielded a block at a time so that the whole file is never scanned at once.
+def findlines(buf, block_size):
+    start = 0
+    while start < len(buf):
+        stop = min(start + block_size, len(buf))
+        newlines = start + np.flatnonzero(buf[start:stop] == ord('\n'))
+        if stop < len(buf):
+            if len(newlines) == 0:
+                block_size = block_size * 2
                 continue
+        elif (len(newlines) == 0) or (newlines[-1] != len(buf) - 1):
+            newlines = np.append(newlines, len(buf))    #last line of the file has no line ending
+        starts = np.append(start, newlines[:-1] + 1)
+        lengths = newlines - starts
+        #windows line endings
+        carriage_return = (lengths > 0) & (buf[np.maximum(newlines - 1, 0)] == ord('\r'))
+        lengths = lengths - carriage_return
+        yield starts, lengths
+        start = newlines[-1] + 1
+
+#Memory maps the input file in the 80 column format from ICQ or COBS data and yields it batch_size lines at a time as an (N, width) array of bytes
+#along with the number of columns of each line. If every line in a batch has the same length the array is just a view of the file itself,
+#otherwise (ragged lines or lines shorter than 80 columns) the first 80 columns of every line are copied out into one array, padded with
+#blank spaces past the end of short lines. Empty lines are skipped.
+#Only the lines from byte start up to byte stop of the file (the end of the file if stop is None) are read.
+def readrecords(file_name, batch_size, start=0, stop=None):
+    with open(file_name, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            buf = np.frombuffer(mapped, dtype=np.uint8)[start:stop]
+            for block_starts, block_lengths in findlines(buf, batch_size * (ICQ_WIDTH + 2)):
+                block_starts, block_lengths = block_starts[block_lengths > 0], block_lengths[block_lengths > 0]
+                for i in range(0, len(block_starts), batch_size):
+                    starts = block_starts[i:i + batch_size]
+                    lengths = block_lengths[i:i + batch_size]
+                    stride = np.diff(starts)
+                    if (len(starts) > 1) and (stride >= ICQ_WIDTH).all() and (stride == stride[0]).all() and (lengths >= ICQ_WIDTH).all() and (starts[0] + len(starts) * stride[0] <= len(buf)):
+                        yield buf[starts[0]:starts[0] + len(starts) * stride[0]].reshape(len(starts), stride[0]), lengths
+                    else:
+                        position = np.arange(ICQ_WIDTH)
+                        index = np.minimum(starts[:, None] + position, len(buf) - 1)
+                        yield np.where(position < lengths[:, None], buf[index], ord(' ')).astype(np.uint8), lengths
+        finally:
+            #the views of the file must be gone before it can be closed
+            buf = None
+            mapped.close()
+
+#Holds every observation of the input file as one row of a NumPy structured array with one typed field per ICQ column (see ICQ_COLUMNS)
+#Columns are read with table['mag'], table['obs'], etc... and rows are selected with an index, slice or boolean mask (table[mask])
+#which returns a new ObservationTable. Quantities derived later for each observation (r, delta, phase angle, corrected magnitudes, ...)
+#are kept in 'derived' as arrays of the same length so that they follow the rows around when the table is filtered or sorted.
+class ObservationTable:
+
+    def __init__(self, data, derived=None):
+        self.data = data
+        self.derived = {} if derived is None else derived
+
+    #Reads the fields of every line out of records, an (N, width) array of bytes of lines in the ICQ 80 column format (see readrecords).
+    #Each field is first taken as a view of its columns in records, numeric fields are then converted all at once.
+    #widths are the number of columns of each line (see readrecords)
+    @classmethod
+    def from_records(cls, records, widths):
+        data = np.zeros(len(records), dtype=ICQ_DTYPE)
+        data['linewidth'] = widths
+        for name, start, stop, kind, fmt, header in ICQ_COLUMNS:
+            if kind.startswith('f'):
+                data[name] = parsenumbers(records[:, start:stop])
+            elif kind.startswith('i'):
+                numbers = parsenumbers(records[:, start:stop])
+                data[name] = np.where(np.isnan(numbers), 0, numbers)
             else:
-                numdelforduplicatedate = numdelforduplicatedate +1
-                addToremoved(k,reasonForDelete)
-                deletearow(k-1)
+                field = np.ndarray(shape=(len(records),), dtype='S' + str(stop - start), buffer=records, offset=start, strides=(records.strides[0],))
+                data[name] = np.char.strip(field, b' ')
+        return cls(data)
+
+    #Joins tables back together in the order given, derived quantities are only kept if every table has them
+    @classmethod
+    def concatenate(cls, tables):
+        if len(tables) == 0:
+            return cls(np.zeros(0, dtype=ICQ_DTYPE))
+        derived = {}
+        for name in tables[0].derived:
+            if all(name in table.derived for table in tables):
+                derived[name] = np.concatenate([table.derived[name] for table in tables])
+        return cls(np.concatenate([table.data for table in tables]), derived)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in self.data.dtype.names:
+                return self.data[key]
+            return self.derived[key]
+        return ObservationTable(self.data[key], {name: values[key] for name, values in self.derived.items()})
+
+    def __contains__(self, name):
+        return (name in self.data.dtype.names) or (name in self.derived)
+
+    #Returns a new table with the given arrays added as derived quantities (e.g., table.with_columns(r=r, delta=delta))
+    def with_columns(self, **columns):
+        derived = dict(self.derived)
+        for name, values in columns.items():
+            values = np.asarray(values)
+            if len(values) != len(self.data):
+                raise ValueError('column ' + name + ' has ' + str(len(values)) + ' values for ' + str(len(self.data)) + ' observations')
+            derived[name] = values
+        return ObservationTable(self.data, derived)
+
+    #Column as a list of strings, the way it appears in the input file (stripped of blank spaces)
+    def text(self, name):
+        for field, start, stop, kind, fmt, header in ICQ_COLUMNS:
+            if field != name:
                 continue
+            if fmt is None:
+                return [value.decode('utf8', 'replace') for value in self.data[name].tolist()]
+            if kind.startswith('f'):
+                return ['' if math.isnan(value) else fmt % value for value in self.data[name].tolist()]
+            return [fmt % value for value in self.data[name].tolist()]
+        return [str(value) for value in self.derived[name].tolist()]
+
+    #Every ICQ column of every row as text, used by the csv writers
+    def rows(self):
+        return [list(row) for row in zip(*[self.text(name) for name, start, stop, kind, fmt, header in ICQ_COLUMNS])]
+
+#Observation dates as integers YYYYMMDD (the day rounded down) so that whole columns can be compared to the perihelion date
+def datekeys(table):
+    return table['yearobs'].astype(np.int64) * 10000 + table['monthobs'].astype(np.int64) * 100 + np.floor(table['dayobs']).astype(np.int64)
+
+def perihelionkey():
+    return int(datetime.strptime(perihelion, "%Y/%m/%d").strftime("%Y%m%d"))
+
+#Reasons an observation can be removed, each sorting rule below reports the position of its reason in this list
+list_of_reasons_removed = ["Two entries on the same date by same observer", "No magnitude reported", "Used reverse binocular observing method", "Poor Weather Reported", "Used a tier 3 or 4 Source Catalog", "Used a telescope under 5.5 magnitude", "Used binoculars under 3.3 magnitude", "Did not use a magnitude method reported by Green (i.e. column 27 not being S, B, M, I, or E), prioritizing S then M", "Bad Extinction Correction used", "Observer used SC Catalog for object dimmer than 8.1", "Could not read the date of observation (malformed line)", "Line shorter than 80 columns or without an observer (incomplete line)"]
+
+#Each sorting criterion below is a rule: rule(table, kept) returns a boolean mask over the whole table which is True for the observations
+#that fail the criterion. kept is True for the observations that have not been removed by an earlier rule, only rules that compare
+#observations with each other (i.e. deleteForDuplicatedDates) need it, every other rule looks at each observation on its own.
+
+#Removes a point from the dataset if there is more than one observation from the same observer at the same night
+#read as: sort the kept points by observer, year, month, and day (rounded down) so that every night of every observer is one group
+#of neighbouring points, then keep only the most preferred point of each group however many points it has.
+#Points are preferred by aperture (instaperture, smallest first), then by observation method (magmethod, S then M then any other
+#method, with B and I last), then by time of night (latest first) and lastly by their place in the input file (latest first).
+#Works on points in any order, sorting them takes O(n log n). The points are compared through their duplicatekeys only,
+#so that filterbatches can compare the points of every batch of a large input file at once.
+def deleteForDuplicatedDates(table, kept):
+    rows = np.flatnonzero(kept)
+    mask = np.zeros(len(table), dtype=bool)
+    mask[rows[duplicatedkeys(duplicatekeys(table, rows, rows))]] = True
+    return mask
+
+#What deleteForDuplicatedDates compares the points by, a few bytes per point rather than a whole row (see duplicatekeys)
+DUPLICATE_KEYS = np.dtype([('obs', 'S5'), ('night', 'i8'), ('instaperture', 'f4'), ('preference', 'i1'), ('dayobs', 'f8'), ('position', 'i8')])
+
+#The DUPLICATE_KEYS of the points of table at rows: observer, night (see datekeys), aperture, preference of the magnitude method
+#(0 for S, 1 for M, 3 for B and I, 2 for any other method), time and positions, their places in the input file
+def duplicatekeys(table, rows, positions):
+    keys = np.zeros(len(rows), dtype=DUPLICATE_KEYS)
+    keys['obs'] = table['obs'][rows]
+    keys['night'] = datekeys(table)[rows]
+    keys['instaperture'] = table['instaperture'][rows]
+    method = table['magmethod'][rows]
+    keys['preference'] = 2
+    keys['preference'][method == b"S"] = 0
+    keys['preference'][method == b"M"] = 1
+    keys['preference'][(method == b"B") | (method == b"I")] = 3
+    keys['dayobs'] = table['dayobs'][rows]
+    keys['position'] = positions
+    return keys
+
+#True for every point of keys (see duplicatekeys) but the most preferred of each observer and night (see deleteForDuplicatedDates)
+def duplicatedkeys(keys):
+    #np.lexsort sorts by the last key first
+    order = np.lexsort((-keys['position'], -keys['dayobs'], keys['preference'], keys['instaperture'], keys['night'], keys['obs']))
+    obs = keys['obs'][order]
+    nights = keys['night'][order]
+    #the first point of each group is the one kept
+    duplicate = np.zeros(len(keys), dtype=bool)
+    duplicate[1:] = (obs[1:] == obs[:-1]) & (nights[1:] == nights[:-1])
+    mask = np.zeros(len(keys), dtype=bool)
+    mask[order[duplicate]] = True
+    return mask
+
+#Removes points whose line is shorter than the 80 columns of the ICQ format (e.g., a line cut off part way) or that have no observer,
+#as every kept point must say who observed it and the blank columns of a short line would otherwise be read as nothing reported
+def incompleteline(table, kept):
+    return (table['linewidth'] < ICQ_WIDTH) | (table['obs'] == b'')
+
+#Removes points whose date could not be read from the line (e.g., a truncated or corrupted line),
+#every later step needs a real date to compare with perihelion and to query JPL HORIZONS at
+def malformeddate(table, kept):
+    day = table['dayobs']
+    return (table['yearobs'] == 0) | (table['monthobs'] < 1) | (table['monthobs'] > 12) | ~((day >= 1) & (day < 32))
+
+#Removes points if no magnitude (mag) is reported
+def nomagreported(table, kept):
+    return np.isnan(table['mag'])
+
+#Removes points if the reverse binocular method is used in the magnitude methods notes columns of ICQ Data (speicalnotes or specialnotestwo)
+def reversebinocular(table, kept):
+    return (table['speicalnotes'] == b'r') | (table['specialnotestwo'] == b'r')
+
+#Removes points if a bad extinction correction is used, denoted in magnitude methods notes columns of ICQ Data (speicalnotes or specialnotestwo)
+def badExtinctionCorrection(table, kept):
+    return (table['speicalnotes'] == b'&') | (table['specialnotestwo'] == b'&')
 
-#Removes points if no magnitude (metalist[8]) is reported
-def nomagreported(numdeltefornomagreported):
-    for k in range (len(metalist[2])-1,-1,-1):
-        if (metalist[8][k] == "") or (metalist[8][k] == '-'):
-            numdeltefornomagreported = numdeltefornomagreported +1
-            addToremoved(k-1,reasonForDelete)
-            deletearow(k)
-    print("number deleted for no magnitudereported "+ str(numdeltefornomagreported))
-
-#Removes points if the reverse binocular method is used in the magnitude methods notes columns of ICQ Data metalist[6] or metalist[22]
-def reversebinocular(numdeletedforreversebinocmethod):
-    for k in range (len(metalist[2])-1,-1,-1):
-        if ((metalist[6][k] == 'r' ) or (metalist[22][k] == 'r')):
-            numdeletedforreversebinocmethod = numdeletedforreversebinocmethod +1
-            addToremoved(k-1,reasonForDelete)
-            deletearow(k)
-    print("number deleted for using reverse binocular method "+ str(numdeletedforreversebinocmethod))
-
-#Removes points if a bad extinction correction is used, denoted in magnitude methods notes columns of ICQ Data metalist[6] or metalist[22]
-def badExtinctionCorrection(numdeletedforbadextinctioncorrection):
-    for k in range (len(metalist[2])-1,-1,-1):
-        if(metalist[6][k] == '&') or (metalist[22][k] == '&'):
-            numdeletedforbadextinctioncorrection = numdeletedforbadextinctioncorrection +1
-            addToremoved(k-1, reasonForDelete)
-            deletearow(k)
-    print("number deleted for a poor extinction correction " + str(numdeletedforbadextinctioncorrection))
-    
 #Removes points if poor weather is reported
-def poorweather(numdeletedforpoorweather):
-    for k in range (len(metalist[2])-1,-1,-1):
-        if (metalist[9][k] == ':'):
-            numdeletedforpoorweather = numdeletedforpoorweather +1
-            addToremoved(k-1,reasonForDelete)
-            deletearow(k)
-    print("number deleted for poor weather conditions " + str(numdeletedforpoorweather))
-    
+def poorweather(table, kept):
+    return table['poorconditions'] == b':'
+
 #Removes points if a telescope is used for mags brighter than 5.4 or binoculars brighter than 1.4
-#Please see ICQ webpage for meaning each letter in the Instrument column of ICQ data (metalist[12])
-def checkTelescopesandBinocMethods(numberremovedfortelescopeunder5_4, numberremovedforbinocularunder1_4):
-    telescopemethod = ['C','R','D','I','J','L','M','q','Q','r','S','T','U','W','Y']
-    binocularmethod = ['A','B','N','O']
-    for k in range (len(metalist[2])-1,-1,-1):
-        if (metalist[8][k] == ""):
-            continue
-        if ((metalist[12][k] in telescopemethod) and (float(metalist[8][k])<5.4)):
-            reasonForDelete = 5
-            addToremoved(k-1,reasonForDelete)
-            deletearow(k)
-            numberremovedfortelescopeunder5_4 = numberremovedfortelescopeunder5_4 +1
-        if ((metalist[12][k] in binocularmethod) and (float(metalist[8][k])<1.4)):
-            reasonForDelete = 6
-            addToremoved(k-1, reasonForDelete)
-            deletearow(k)
-            numberremovedforbinocularunder1_4 = numberremovedforbinocularunder1_4 +1
-    print("number deleted for using a telescope under m = 5.4 " + str(numberremovedfortelescopeunder5_4))
-    print("number deleted for using a binocular under m = 1.4 " + str(numberremovedforbinocularunder1_4))
+#Please see ICQ webpage for meaning each letter in the Instrument column of ICQ data (insttype)
+#Points without a magnitude are NaN and never compare as brighter
+def checkTelescopes(table, kept):
+    telescopemethod = [b'C',b'R',b'D',b'I',b'J',b'L',b'M',b'q',b'Q',b'r',b'S',b'T',b'U',b'W',b'Y']
+    return np.isin(table['insttype'], telescopemethod) & (table['mag'] < 5.4)
+
+def checkBinocMethods(table, kept):
+    binocularmethod = [b'A',b'B',b'N',b'O']
+    return np.isin(table['insttype'], binocularmethod) & (table['mag'] < 1.4)
 
 #Removes points for magnitude acquisition methods that are not ideal.
-def removeForMagMethod(numberremovedfornotspecifiedmagmethod):
-    allowedmagnitudemethod = ['S','B','M','I','E']
+def removeForMagMethod(table, kept):
+    allowedmagnitudemethod = [b'S',b'B',b'M',b'I',b'E']
     #ccdlist = ['C','c','g','H','k','r','u','Y','l']
-    for k in range (len(metalist[2])-1,-1,-1):
-        if (metalist[7][k] not in allowedmagnitudemethod):
-            addToremoved(k-1,reasonForDelete)
-            deletearow(k)
-            numberremovedfornotspecifiedmagmethod = numberremovedfornotspecifiedmagmethod +1
-    print("number deleted for using a method not specified by green (i.e. column 27 not being S, B, M, I, or E), prioritizing S then M " + str(numberremovedfornotspecifiedmagmethod))
+    return ~np.isin(table['magmethod'], allowedmagnitudemethod)
 
 #Some catalogs reported in ICQ's Recommended or Condemned start magnitude catalogs have requirements on when they can be used.
 #For instance, the SC catalog which appears in the test data should only be used when the comet is brighter than 8.1
 #TODO: add all checks for all catalogs with such requirements.
-def checkSCcatalog(numberremovedforSCcatalog):
-    for k in range(len(metalist[2])-1,-1,-1):
-        if (metalist[10][k] == "SC"):
-            if(float(metalist[8][k]) > 8.1):
-                addToremoved(k-1,reasonForDelete)
-                deletearow(k)
-                numberremovedforSCcatalog = numberremovedforSCcatalog +1
-    print("number deleted for SC catalog being used on object dimmer than 8.1 ", numberremovedforSCcatalog)
-    
-#This functions will take a decimal date as reported in ICQ and convert it to YYYY:MM:DD HH:MM:SS format.
-#That is, for each date in the data (metalist[3], metalist[4], and metalist[5]) it will convert it to the above format.
-#For example if metalist[3][0] == 1996, metalist[4][0] == 04, and metalist[5][0] == 30.50 
-#then it will append to the output list 1996:04:30 12:00:00
-#These dates are then used to compare to the result of the JPL HORIZONS Ephemerides query to find the nearest time in the query
-def decimaldate2hhmmss():
-    global date_compare_to_JPL
-    date_compare_to_JPL = []
-    for i in range(0, len(metalist[3])):
-        tmp_date = ""
-        tmp_decimal = ""
-        past_decimal = 0
-        for j in range(0, len(metalist[5][i])):
-            if (metalist[5][i][j] != ".") and (past_decimal == 0):
-                tmp_date = tmp_date + metalist[5][i][j]
-            if metalist[5][i][j] == ".":
-                past_decimal = 1
-            if (past_decimal ==1):
-                tmp_decimal = tmp_decimal + metalist[5][i][j]
-        tmp_hours = str(float(tmp_decimal) * 24)
-        past_decimal = 0
-        hours = ""
-        tmp_decimal2 = ""
-        for j in range(0, len(tmp_hours)):
-            if (tmp_hours[j] != ".") and (past_decimal == 0):
-                hours = hours + tmp_hours[j]
-            if tmp_hours[j] == ".":
-                past_decimal = 1
-            if (past_decimal ==1):
-                tmp_decimal2 = tmp_decimal2 + tmp_hours[j]
-        tmp_minutes = str(float(tmp_decimal2) * 60)
-        past_decimal = 0
-        minutes = ""
-        tmp_decimal3 = ""
-        for j in range(0, len(tmp_minutes)):
-            if (tmp_minutes[j] != ".") and (past_decimal == 0):
-                minutes = minutes + tmp_minutes[j]
-            if tmp_minutes[j] == ".":
-                past_decimal = 1
-            if (past_decimal == 1):
-                tmp_decimal3 = tmp_decimal3 + tmp_minutes[j]
-        tmp_seconds = str(float(tmp_decimal3) * 60)
-        seconds = ""
-        for j in range(0, len(tmp_seconds)):
-            if (tmp_seconds[j] != "."):
-                seconds = seconds + tmp_seconds[j]
-            if (tmp_seconds[j] == "."):
-                break
-        date_compare_to_JPL.append(metalist[3][i] + "-"+metalist[4][i] + "-" + tmp_date + " " + str("%02d"%(float(hours),)) + ":"+str("%02d"%(float(minutes),))+":"+ str("%02d"%(float(seconds),)))
+def checkSCcatalog(table, kept):
+    return (table['referencecat'] == b"SC") & (table['mag'] > 8.1)
+
+#The sorting rules used on the data, in the order they are applied, as (rule, reason, message printed with the number of points it removed)
+#reason is the position in list_of_reasons_removed. If there is a reason here for why a point is removed that you do not agree with
+#then you can comment out that rule.
+def sortingrules():
+    rules = []
+    rules.append((incompleteline, 11, "number deleted for a line shorter than 80 columns or without an observer "))
+    rules.append((malformeddate, 10, "number deleted for a date that could not be read "))
+    rules.append((nomagreported, 1, "number deleted for no magnitudereported "))
+    rules.append((reversebinocular, 2, "number deleted for using reverse binocular method "))
+    rules.append((poorweather, 3, "number deleted for poor weather conditions "))
+    rules.append((badExtinctionCorrection, 8, "number deleted for a poor extinction correction "))
+    rules.append((checkTelescopes, 5, "number deleted for using a telescope under m = 5.4 "))
+    rules.append((checkBinocMethods, 6, "number deleted for using a binocular under m = 1.4 "))
+    if CCD_Bool == 1:
+        rules.append((removeForMagMethod, 7, "number deleted for using a method not specified by green (i.e. column 27 not being S, B, M, I, or E), prioritizing S then M "))
+        rules.append((checkSCcatalog, 9, "number deleted for SC catalog being used on object dimmer than 8.1  "))
+    rules.append((deleteForDuplicatedDates, 0, "number deleted for duplicated observation dates by same person "))
+    return rules
+
+#Applies every rule to the whole table in a single pass. Each observation is given the reason of the first rule it fails
+#(-1 if it passes every rule) so that the kept and removed observations can each be gathered out of the table at once.
+def rulereasons(table, rules):
+    reasons = np.full(len(table), -1, dtype=np.int8)
+    for rule, reason, message in rules:
+        kept = reasons == -1
+        reasons[rule(table, kept) & kept] = reason
+    return reasons
+
+#Reads in the 80 column format from ICQ or COBS data batch_size lines at a time, yielding each batch as an ObservationTable
+#so that only one batch of lines is parsed at once, however large the input file is (see readrecords for start and stop).
+def readbatches(file_name, batch_size, start=0, stop=None):
+    for records, widths in readrecords(file_name, batch_size, start, stop):
+        table = ObservationTable.from_records(records, widths)
+        del records
+        yield table
+
+#Rules that compare observations with each other rather than looking at each observation on its own (see sortingrules, where they come last)
+comparing_rules = [deleteForDuplicatedDates]
+
+#Applies the sorting rules to every batch of observations given by readagain() (e.g., readbatches of the input file) in two passes.
+#The first pass applies the rules that look at each observation on its own to each batch, and keeps only the duplicatekeys of the points
+#that pass them. deleteForDuplicatedDates is then applied to the keys of every batch at once, as the points of the same observer and night
+#can be anywhere in the input file (e.g., COBS exports are in order of date with the observers mixed together). The second pass reads
+#the batches again and yields the kept observations, the removed observations and the reason each removed observation was removed,
+#batch by batch. The kept and removed points are the same for any batch_size and any order of the input file, and only one batch
+#and the keys are kept in memory at once however large the input file is.
+#With --append, earlier are the duplicatekeys of the points kept from the lines read by earlier runs (see appendrun): a new point
+#may be from the same observer and night as any of them, so they are compared along with the keys of the new points (which come after them
+#in the input file) and only the groups that a new point falls in can change. If pending is a list then the keys of every point kept,
+#the earlier points that are still kept first and then the new points in the order they are yielded, are added to it.
+def filterbatches(readagain, rules, pending=None, earlier=None):
+    single_rules = [rule for rule in rules if rule[0] not in comparing_rules]
+    duplicate_reason = dict((rule, reason) for rule, reason, message in rules).get(deleteForDuplicatedDates, -1)
+    if earlier is None:
+        earlier = np.zeros(0, dtype=DUPLICATE_KEYS)
+    first = earlier['position'].max() + 1 if len(earlier) != 0 else 0
+    keys = [earlier]
+    position = first
+    for batch in readagain():
+        passed = np.flatnonzero(rulereasons(batch, single_rules) == -1)
+        keys.append(duplicatekeys(batch, passed, position + passed))
+        position = position + len(batch)
+    keys = np.concatenate(keys)
+    duplicated = np.zeros(len(keys), dtype=bool)
+    if duplicate_reason != -1:
+        duplicated = duplicatedkeys(keys)
+    duplicates = np.sort(keys['position'][duplicated])
+    if pending is not None:
+        pending.append(keys[~duplicated])
+    del keys
+    position = first
+    for batch in readagain():
+        reasons = rulereasons(batch, single_rules)
+        reasons[duplicates[np.searchsorted(duplicates, position):np.searchsorted(duplicates, position + len(batch))] - position] = duplicate_reason
+        position = position + len(batch)
+        kept = reasons == -1
+        yield batch[kept], batch[~kept], reasons[~kept]
+
+#Names of the input files given by input_file: every file in it if it is a directory, every file matching it if it is
+#a pattern (e.g., 'submissions/*.txt'), or else just input_file itself.
+def inputfiles(pattern):
+    if os.path.isdir(pattern):
+        return sorted(os.path.join(pattern, f) for f in os.listdir(pattern) if os.path.isfile(os.path.join(pattern, f)))
+    if glob.has_magic(pattern):
+        return sorted(f for f in glob.glob(pattern) if os.path.isfile(f))
+    return [pattern]
+
+#Reads in a whole input file as one ObservationTable (see readbatches)
+def readfile(file_name):
+    return ObservationTable.concatenate(list(readbatches(file_name, batch_size)))
+
+#Removes exact duplicates of a record (e.g., the same observation sent in with two different submissions), keeping the first one.
+#Each record is hashed to a 64 bit number from its bytes (FNV-1a) and only records whose hashes are the same are compared in full.
+#Lines are compared only up to column 80, so that a record is still a duplicate when one copy has trailing blanks or text past column 80.
+def dropduplicaterecords(table):
+    data = table.data.copy()
+    data['linewidth'] = np.minimum(data['linewidth'], ICQ_WIDTH)
+    record_bytes = data.view(np.uint8).reshape(len(table), ICQ_DTYPE.itemsize)
+    hashes = np.full(len(table), 14695981039346656037, dtype=np.uint64)
+    for j in range(0, ICQ_DTYPE.itemsize):
+        hashes = (hashes ^ record_bytes[:, j]) * np.uint64(1099511628211)
+    order = np.argsort(hashes, kind='stable')
+    #records that share their hash with at least one other record
+    shared = np.zeros(len(table), dtype=bool)
+    shared[1:] = hashes[order][1:] == hashes[order][:-1]
+    shared[:-1] = shared[:-1] | shared[1:]
+    candidates = np.sort(order[shared])
+    records = np.ascontiguousarray(data[candidates]).view(np.dtype((np.void, ICQ_DTYPE.itemsize)))
+    unique, first = np.unique(records, return_index=True)
+    keep = np.ones(len(table), dtype=bool)
+    keep[candidates] = False
+    keep[candidates[first]] = True
+    return table[keep]
+
+#Reads in many input files at once, each in its own process, and merges them into one ObservationTable.
+#Exact duplicate records are removed (see dropduplicaterecords) and the observations are sorted by night, then observer and then time
+#so that the output files are in order of date whatever order the input files are read in.
+def readinputs(file_names):
+    workers = processes or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        tables = list(pool.map(readfile, file_names, chunksize=max(1, len(file_names) // (4 * workers))))
+    table = ObservationTable.concatenate(tables)
+    number_read = len(table)
+    table = dropduplicaterecords(table)
+    print(number_read, 'observations read in from', len(file_names), 'files,', number_read - len(table), 'exact duplicates removed')
+    order = np.lexsort((np.arange(len(table)), table['dayobs'], table['obs'], datekeys(table)))
+    return table[order]
+
+#Name of the cache file for the input file sorted with rules. The name is a hash of everything that the sorted data depend on:
+#the contents of the input file, CCD_Bool, the layout of the columns and the code of every rule used along with its reason.
+#batch_size is left out as the points kept and removed, and their order, are the same for any batch_size (see filterbatches).
+def cachefile(file_name, rules):
+    key = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            key.update(block)
+    key.update(rulesdigest(rules).encode())
+    return os.path.join(cache_directory, key.hexdigest() + '.npz')
+
+#Hash of CCD_Bool, the layout of the columns and the code of every rule in rules along with its reason
+def rulesdigest(rules):
+    key = hashlib.sha256()
+    key.update(repr((CCD_Bool, ICQ_COLUMNS)).encode())
+    for rule, reason, message in rules:
+        key.update(repr((rule.__name__, rule.__code__.co_code, rule.__code__.co_consts, reason)).encode())
+    return key.hexdigest()
+
+#Deletes the least recently used files in the cache until it is no larger than cache_size
+#Files still being written (see cachedbatches) are skipped, as are files another run deletes first (e.g., with --catalogue)
+def trimcache():
+    files = []
+    for f in os.listdir(cache_directory):
+        if f.endswith(('.npz', '.npy')) and ('.tmp.' not in f):
+            try:
+                files.append((os.path.getmtime(os.path.join(cache_directory, f)), os.path.getsize(os.path.join(cache_directory, f)), f))
+            except FileNotFoundError:
+                continue
+    files.sort()
+    total = sum(size for used, size, f in files)
+    for used, size, f in files:
+        if total <= cache_size * 2**20:
+            break
+        total = total - size
+        try:
+            os.remove(os.path.join(cache_directory, f))
+        except FileNotFoundError:
+            continue
+
+#Same as filterbatches of readbatches(file_name, batch_size) with rules but the sorted data are saved in cache_directory as a .npz file.
+#If the same file was already sorted with the same rules then the sorted data are loaded from the cache all at once instead,
+#skipping both reading in and sorting the input file. Using a cached file marks it as recently used (see trimcache).
+def cachedbatches(file_name, rules):
+    if cache_directory == '':
+        yield from filterbatches(lambda: readbatches(file_name, batch_size), rules)
+        return
+    cache_file = cachefile(file_name, rules)
+    if os.path.exists(cache_file):
+        print('Reading sorted data from cache ' + cache_file)
+        with np.load(cache_file) as cached:
+            kept, removed, reasons = ObservationTable(cached['kept']), ObservationTable(cached['removed']), cached['reasons']
+        os.utime(cache_file)
+        yield kept, removed, reasons
+        return
+    kept_batches = []
+    removed_batches = []
+    reasons_batches = []
+    for kept, removed, reasons in filterbatches(lambda: readbatches(file_name, batch_size), rules):
+        kept_batches.append(kept)
+        removed_batches.append(removed)
+        reasons_batches.append(reasons)
+        yield kept, removed, reasons
+    os.makedirs(cache_directory, exist_ok=True)
+    #written under a temporary name first so that an interrupted run never leaves a broken file in the cache
+    tmp_file = cache_file[:-len('.npz')] + '.tmp.' + str(os.getpid()) + '.npz'
+    np.savez(tmp_file, kept=ObservationTable.concatenate(kept_batches).data, removed=ObservationTable.concatenate(removed_batches).data, reasons=np.concatenate(reasons_batches + [np.zeros(0, dtype=np.int8)]))
+    os.replace(tmp_file, cache_file)
+    trimcache()
+
+#Hash of the first and last (up to) 4096 bytes of the first offset bytes of a file, used to check that the lines read by
+#the last --append run are still there without reading all of them again
+def edgeshash(file_name, offset):
+    with open(file_name, 'rb') as f:
+        head = f.read(min(offset, 4096))
+        f.seek(max(offset - 4096, 0))
+        return hashlib.sha256(head + f.read(offset - max(offset - 4096, 0))).hexdigest()
+
+#Position just after the last line ending of a file, --append only reads whole lines as the last line may still be being written
+def lastlineend(file_name):
+    with open(file_name, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        while end > 0:
+            f.seek(max(end - 65536, 0))
+            block = f.read(end - max(end - 65536, 0))
+            if b'\n' in block:
+                return max(end - 65536, 0) + block.rindex(b'\n') + 1
+            end = max(end - 65536, 0)
+    return 0
+
+#Everything the state of an --append run depends on other than the input file: the rules, the object and which corrections are made
+def statekey(rules):
+    return rulesdigest(rules) + repr((small_body_designation, JPL_Time_Increment, JPL_Spline_Increment, JPL_Spline_Tolerance, '--heliocentric' in sys.argv, '--phase' in sys.argv, phase_models, phase_hg_g, phase_linear_beta, phase_table_resolution))
+
+#Reads in the state of the last --append run on file_name (see appendrun) from state_file.
+#Returns None if there is no state or it cannot be used, i.e. the run was on another file, with other rules or corrections,
+#the lines it read have since been changed or the output files it wrote to have since been changed.
+def loadstate(file_name, rules):
+    state_path = os.path.join(output_directory, state_file)
+    if not os.path.exists(state_path):
+        return None
+    with np.load(state_path) as saved:
+        state = {name: saved[name] for name in saved.files}
+    offset = int(state['offset'])
+    usable = (str(state['input']) == os.path.abspath(file_name)) and (str(state['key']) == statekey(rules))
+    usable = usable and (os.path.getsize(file_name) >= offset) and (str(state['edges']) == edgeshash(file_name, offset))
+    for name, output in [('removed_offset', output_file_rejected_points), ('kept_offset', ouput_file_kept_points)]:
+        output = os.path.join(output_directory, output)
+        usable = usable and os.path.exists(output) and (os.path.getsize(output) >= int(state[name]))
+    if not usable:
+        print('Input file, settings or output files changed since the last run with --append, starting over')
+        return None
+    return state
+
+#Saves the state of an --append run to state_file, written under a temporary name first so that an interrupted run never leaves half a state
+def savestate(state):
+    state_path = os.path.join(output_directory, state_file)
+    tmp_file = state_path[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp_file, **state)
+    os.replace(tmp_file, state_path)
+
+#State of the current --append run (see appendrun), None when not appending
+appending = None
+
+#Optional command line argument --append for an input file that lines are added to the end of (e.g., during an active apparition).
+#Only the lines added since the last run with --append are read in and sorted, their kept and removed points are added to the ends
+#of the output files and JPL HORIZONS is only queried over their dates (the ephemerides of earlier points are in the ephemeris cache).
+#The last run's state (see loadstate) holds where it stopped reading the input file, the duplicatekeys of every point kept so far
+#(the one kept point of each observer and night, which a new line of the same observer and night is compared with, see filterbatches)
+#and every point written to ouput_file_kept_points with where its row starts and, when correcting, its corrections so that --stats
+#and --plot still use every point. Only the rows of kept points that a new point replaces are taken out of ouput_file_kept_points,
+#every other row stays as it is. Without a usable state the whole file is read.
+def appendrun(file_name, rules):
+    global appending
+    appending = loadstate(file_name, rules)
+    if appending is None:
+        appending = {'offset': 0, 'winners': np.zeros(0, dtype=DUPLICATE_KEYS), 'history': np.zeros(0, dtype=ICQ_DTYPE), 'derived_position': np.zeros(0, dtype=np.int64), 'rows': np.zeros(0, dtype=np.int64), 'removed_offset': -1, 'kept_offset': -1, 'number_of_points': 0, 'number_kept': 0, 'removed_per_reason': np.zeros(len(list_of_reasons_removed), dtype=np.int64)}
+    start = int(appending['offset'])
+    stop = lastlineend(file_name)
+    print('Reading in bytes', start, 'to', stop, 'of', file_name)
+    if stop < os.path.getsize(file_name):
+        print('The last line of ' + file_name + ' has no line ending yet, it is skipped until it has one')
+    pending = []
+    appending['pending'] = pending
+    lightcurve(filterbatches(lambda: readbatches(file_name, batch_size, start, stop), rules, pending, appending['winners']), rules)
+    del appending['pending']
+    appending['input'] = os.path.abspath(file_name)
+    appending['key'] = statekey(rules)
+    appending['offset'] = stop
+    appending['edges'] = edgeshash(file_name, stop)
+    savestate(appending)
+
+#Opens a csv file of observations to write to, returning the file and its csv writer (see opentable).
+#offset is where the rows written by the last --append run end, the file is cut off there (in case a run was interrupted)
+#and rows are added after it. Without an offset (-1) the file is started over with a header row.
+def opencsv(file_name, offset, headers):
+    if offset < 0:
+        f = open(file_name, 'w')
+        return f, opentable(f, headers)
+    f = open(file_name, 'r+')
+    f.seek(offset)
+    f.truncate()
+    return f, csv.writer(f, delimiter =',')
+
+#The points written to ouput_file_kept_points by earlier --append runs (see appendrun) with their corrections, if any
+def appendhistory():
+    return ObservationTable(appending['history'], {name[len('derived_'):]: appending[name] for name in appending if name.startswith('derived_')})
+
+#Writes out the kept (and corrected) observations in table to ouput_file_kept_points (see write_table).
+#With --append the rows of the points kept by earlier runs stay as they are, but for those of points no longer kept (i.e. a new point
+#of the same observer and night replaced them): the file is cut off at the first of those and the rows after it that are still kept
+#are copied back as they were, then the rows of table are added. Where each row starts is kept for the next run.
+def write_keepers(table, headers, columns):
+    file_name = os.path.join(output_directory, ouput_file_kept_points)
+    if appending is None:
+        write_table(file_name, table, headers, columns)
+        return
+    history = appendhistory()
+    rows = appending['rows']
+    end = int(appending['kept_offset'])
+    moved = ~np.isin(history['position'], appending['winners']['position'])
+    if moved.any():
+        cut = int(rows[moved][0])
+        stay = np.flatnonzero(~moved & (rows >= cut))
+        bounds = np.append(rows, end) - cut
+        with open(file_name, 'r+b') as f:
+            f.seek(cut)
+            tail = f.read(end - cut)
+            pieces = [tail[bounds[i]:bounds[i + 1]] for i in stay.tolist()]
+            f.seek(cut)
+            f.write(b''.join(pieces))
+            f.truncate()
+        rows = rows.copy()
+        rows[stay] = cut + np.cumsum([0] + [len(piece) for piece in pieces[:-1]], dtype=np.int64)[:len(stay)]
+        end = cut + sum(len(piece) for piece in pieces)
+    starts = []
+    f, file_writer = opencsv(file_name, end, headers)
+    with f:
+        lines = table.rows()
+        for k in range(0, len(lines)):
+            starts.append(f.tell())
+            file_writer.writerow(lines[k] + [column[k] for column in columns])
+        appending['kept_offset'] = f.tell()
+    history = ObservationTable.concatenate([history[~moved], table]) if len(history) != 0 else table
+    appending['history'] = history.data
+    for name, values in history.derived.items():
+        appending['derived_' + name] = values
+    appending['rows'] = np.concatenate([rows[~moved], np.array(starts, dtype=np.int64)])
+
+#Name JPL HORIZONS knows a comet by from its ICQ designation (columns 1-10), e.g. '  2' -> '2P' and '1995O1' -> 'C/1995 O1'
+#Comets without a short period number are taken to be long period comets (C/), as columns 1-10 do not tell them apart from unnumbered
+#periodic comets (P/), interstellar objects (I/) or asteroids (A/), and fragments of a split nucleus get the letter of their fragment
+#(e.g. '73P-B'). Those other objects are given their JPL HORIZONS name after their perihelion date in perihelia_file (see readperihelia).
+def horizonsname(number, designation, splitnuc):
+    if number.strip(' 0') != '':
+        name = number.strip(' 0') + 'P'
+    elif '/' in designation:
+        name = designation
+    else:
+        name = 'C/' + designation[:4] + ' ' + designation[4:]
+    if splitnuc != '':
+        name = name + '-' + splitnuc.upper()
+    return name
+
+#Splits up the input, read in once as ObservationTables (e.g., batch_size lines at a time by readbatches), by comet (columns 1-10 of ICQ data)
+#Returns a dictionary of the JPL HORIZONS name of each comet (see horizonsname) to an ObservationTable of all of its observations,
+#kept in the order they appear in the input.
+def indexcomets(tables):
+    comets = {}
+    names = ['shortperapparition', 'designation', 'splitnuc']
+    for table in tables:
+        keys, comet = np.unique(table.data[names], return_inverse=True)
+        order = np.argsort(comet, kind='stable')
+        bounds = np.searchsorted(comet[order], np.arange(len(keys) + 1))
+        for k in range(0, len(keys)):
+            name = horizonsname(*[keys[k][n].decode() for n in names])
+            comets.setdefault(name, []).append(table[order[bounds[k]:bounds[k + 1]]])
+    return {name: ObservationTable.concatenate(tables) for name, tables in comets.items()}
+
+#Reads in the perihelion of each comet from perihelia_file, one 'designation YYYY/MM/DD' per line (e.g., 'C/1995 O1 1997/04/01')
+#where designation is the name horizonsname gives the comet. The date can be followed by the name JPL HORIZONS knows the comet by,
+#for the comets horizonsname cannot name (e.g., 'C/2019 Q4 2019/12/08 2I' or 'C/2010 V1 2010/10/26 P/2010 V1'), and can be - to take the
+#perihelion of that comet from its ephemerides (e.g., 'C/2017 U1 - 1I' when only its name is given).
+#Returns a dictionary of each designation to its perihelion date ('' for -) and its JPL HORIZONS name (the designation if none is given)
+def readperihelia(file_name):
+    perihelia = {}
+    if not os.path.exists(file_name):
+        return perihelia
+    with open(file_name) as f:
+        for line in f:
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            fields = line.split()
+            dates = [k for k in range(0, len(fields)) if (fields[k] == '-') or ((fields[k].count('/') == 2) and fields[k].replace('/', '').isdigit())]
+            if len(dates) == 0:
+                print('No perihelion date (YYYY/MM/DD or -) in line of ' + file_name + ': ' + line.strip())
+                continue
+            name = ' '.join(fields[:dates[0]])
+            date = '' if fields[dates[0]] == '-' else fields[dates[0]]
+            perihelia[name] = (date, ' '.join(fields[dates[0] + 1:]) or name)
+    return perihelia
+
+#Time of every observation from its year, month and decimal day (yearobs, monthobs, and dayobs), all observations at once.
+#For example if yearobs[0] == 1996, monthobs[0] == 04, and dayobs[0] == 30.50 then times[0] == 1996-04-30T12:00:00
+#Returns the Julian Date of each observation and the same times as numpy datetime64 to the nearest second.
+#These times are then used to compare to the result of the JPL HORIZONS Ephemerides query to find the nearest time in the query
+def observationtimes(table):
+    months = (table['yearobs'].astype(np.int64) - 1970) * 12 + table['monthobs'].astype(np.int64) - 1
+    seconds = np.round((table['dayobs'] - 1.) * 86400.).astype(np.int64)
+    times = months.astype('datetime64[M]').astype('datetime64[s]') + seconds.astype('timedelta64[s]')
+    julian = times.astype(np.int64) / 86400. + 2440587.5
+    return julian, times
+
+#Quantities kept from each JPL HORIZONS query, see ephemerides, each as an array of floats
+#Epochs are kept as Julian Dates only, they are turned into numpy datetime64 (see epochminutes) only where a date is printed
+ephemeris_columns = ['datetime_jd', 'r', 'delta', 'alpha']
+
+#With ephemeris_provider = 'mock', the ephemerides of each object: its designation to a dictionary of arrays of (at least) datetime_jd, r, delta
+#and alpha, e.g. set by a test before running the pipeline. Ephemerides at other epochs are interpolated from these (see interpolateephemerides).
+mock_ephemerides = {}
+
+#Ephemerides read in so far with ephemeris_provider = 'file', file name to the dictionary of arrays read from it (see readephemerisfile)
+ephemeris_files = {}
+
+#Each Julian Date in julian as numpy datetime64 to the nearest minute
+def epochminutes(julian):
+    return np.round((julian - 2440587.5) * 1440.).astype(np.int64).astype('datetime64[m]')
+
+#Queries JPL HORIZONS for the ephemerides of small_body_designation at window, epochs as numpy datetime64 to the minute
+#Queries every step minutes from the first epoch of window to its last, or exactly the epochs in window if step is None
+#A failed query (e.g., a dropped connection) is tried again up to JPL_Retries times, waiting twice as long before each try
+#Returns a dictionary of an array of every quantity in ephemeris_columns, one entry per epoch
+def queryhorizons(window, step):
+    start, stop = [str(np.datetime_as_string(date, unit='m')).replace('T', ' ') for date in [window[0], window[-1]]]
+    for attempt in range(0, JPL_Retries + 1):
+        try:
+            small_body = callhorizons.query(small_body_designation)
+            if step is None:
+                small_body.set_discreteepochs((window.astype('datetime64[s]').astype(np.int64) / 86400. + 2440587.5).tolist())
+            else:
+                small_body.set_epochrange(start, stop, str(step) + 'm')
+            small_body.get_ephemerides(500)
+            return {name: np.asarray(small_body[name], dtype=float) for name in ephemeris_columns}
+        except Exception as error:
+            if attempt == JPL_Retries:
+                raise
+            print('JPL HORIZONS query from', start, 'to', stop, 'failed (' + str(error) + '), trying again')
+            time.sleep(2 ** attempt)
+
+#Epochs of window, every step minutes from its first epoch to its last or, if step is None, exactly the epochs in window (see queryhorizons)
+def windowepochs(window, step):
+    if step is None:
+        return window
+    return np.arange(window[0], window[-1] + np.timedelta64(1, 'm'), np.timedelta64(step, 'm'))
+
+#Ephemerides at window (see queryhorizons) interpolated with cubic splines from ephemeris, a dictionary of arrays of (at least) datetime_jd, r,
+#delta and alpha (e.g., read in from a file). Epochs outside the dates of ephemeris are left out, as JPL HORIZONS does for dates it has no data for.
+def interpolateephemerides(ephemeris, window, step):
+    known, order = np.unique(ephemeris['datetime_jd'], return_index=True)
+    julian = windowepochs(window, step).astype('datetime64[s]').astype(np.int64) / 86400. + 2440587.5
+    julian = julian[(julian >= known[0] - 1. / 86400.) & (julian <= known[-1] + 1. / 86400.)]
+    splines = ephemerissplines({name: ephemeris[name][order] for name in ephemeris_columns})
+    result = {name: splines[name](julian) for name in splines}
+    result['datetime_jd'] = julian
+    return result
+
+#Reads in ephemerides saved from JPL HORIZONS: either a text export made with 'CSV format' on (the rows between $$SOE and $$EOE, with
+#the quantities JDUT, r, delta and S-T-O among its columns), or a csv file with a header row naming columns datetime_jd, r, delta and alpha.
+#Returns a dictionary of an array of each of datetime_jd, r, delta and alpha.
+def readephemerisfile(file_name):
+    with open(file_name) as f:
+        lines = [line.strip() for line in f.read().splitlines()]
+    if '$$SOE' in lines:
+        start = lines.index('$$SOE')
+        headers = [header.strip() for header in lines[start - 2].split(',')]
+        rows = [line.split(',') for line in lines[start + 1:lines.index('$$EOE')]]
+        names = {'datetime_jd': 'Date_________JDUT', 'r': 'r', 'delta': 'delta', 'alpha': 'S-T-O'}
+    else:
+        headers = [header.strip() for header in lines[0].split(',')]
+        rows = [line.split(',') for line in lines[1:] if line != '']
+        names = {name: name for name in ephemeris_columns}
+    for name, header in names.items():
+        if header not in headers:
+            raise ValueError('No ' + header + ' column in ' + file_name)
+    return {name: np.array([float(row[headers.index(header)]) for row in rows]) for name, header in names.items()}
+
+#Ephemerides of small_body_designation at window (see queryhorizons) from the file saved for it in ephemeris_directory (see readephemerisfile)
+def fileephemerides(window, step):
+    name = small_body_designation.replace('/', '_').replace(' ', '_')
+    for file_name in [os.path.join(ephemeris_directory, name + extension) for extension in ['.txt', '.csv']]:
+        if os.path.exists(file_name):
+            if file_name not in ephemeris_files:
+                ephemeris_files[file_name] = readephemerisfile(file_name)
+            return interpolateephemerides(ephemeris_files[file_name], window, step)
+    raise FileNotFoundError('No ephemerides of ' + small_body_designation + ' in ' + ephemeris_directory + ' (' + name + '.txt or ' + name + '.csv)')
+
+#Ephemerides of small_body_designation at window (see queryhorizons) from mock_ephemerides
+def mockephemerides(window, step):
+    return interpolateephemerides(mock_ephemerides[small_body_designation], window, step)
+
+#Orbital elements of each object read in from elements_file (see readelements)
+orbital_elements = {}
+
+#Reads in the orbital elements of each object from file_name, one 'designation q e i node peri T' line per object (see elements_file)
+def readelements(file_name):
+    elements = {}
+    with open(file_name) as f:
+        for line in f:
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            fields = line.split()
+            elements[' '.join(fields[:-6])] = [float(value) for value in fields[-6:]]
+    return elements
+
+#Heliocentric position (au, ecliptic J2000, an array of x, y and z rows) and velocity (au per day) at each Julian Date in julian of a body on the
+#orbit of the osculating elements q, e, i, node, peri and T (see elements_file). Kepler's equation is solved for every epoch at once, with Newton's
+#method for elliptic (e < 1) and hyperbolic (e > 1) orbits and Barker's equation for parabolic ones. The perturbations of the planets are left out
+#(a two body orbit).
+def keplerpositions(julian, q, e, i, node, peri, T):
+    k = 0.01720209895    #Gaussian gravitational constant, au^1.5 per day
+    t = julian - T
+    if e == 1.:
+        w = 3. * k / math.sqrt(2. * q ** 3) * t
+        y = np.cbrt(w / 2. + np.sqrt((w / 2.) ** 2 + 1.))
+        s = y - 1. / y
+        rate = k / math.sqrt(2. * q ** 3) / (1. + s ** 2)
+        x, y, vx, vy = q * (1. - s ** 2), 2. * q * s, -2. * q * s * rate, 2. * q * rate
+    else:
+        a = q / abs(1. - e)
+        mean = k / a ** 1.5 * t
+        if e < 1.:
+            mean = np.remainder(mean + np.pi, 2. * np.pi) - np.pi
+            if e < 0.9:
+                anomaly = mean + 0.85 * e * np.sign(mean)
+            else:
+                #starts from the parabolic orbit through the same perihelion, far closer for nearly parabolic orbits (most comets)
+                w = 3. * k / math.sqrt(2. * q ** 3) * mean / (k / a ** 1.5)
+                y = np.cbrt(w / 2. + np.sqrt((w / 2.) ** 2 + 1.))
+                anomaly = 2. * np.arctan(math.sqrt((1. - e) / (1. + e)) * (y - 1. / y))
+            for iteration in range(0, 50):
+                sin, cos = np.sin(anomaly), np.cos(anomaly)
+                change = (anomaly - e * sin - mean) / (1. - e * cos)
+                anomaly = anomaly - change
+                if np.all(np.abs(change) < 1e-12):
+                    break
+            sin, cos = np.sin(anomaly), np.cos(anomaly)
+            rate = k / a ** 1.5 / (1. - e * cos)
+            x, y, vx, vy = a * (cos - e), a * math.sqrt(1. - e ** 2) * sin, -a * sin * rate, a * math.sqrt(1. - e ** 2) * cos * rate
+        else:
+            anomaly = np.sign(mean) * np.log(2. * np.abs(mean) / e + 1.8)
+            for iteration in range(0, 100):
+                change = (e * np.sinh(anomaly) - anomaly - mean) / (e * np.cosh(anomaly) - 1.)
+                anomaly = anomaly - change
+                if np.all(np.abs(change) < 1e-12):
+                    break
+            sinh, cosh = np.sinh(anomaly), np.cosh(anomaly)
+            rate = k / a ** 1.5 / (e * cosh - 1.)
+            x, y, vx, vy = a * (e - cosh), a * math.sqrt(e ** 2 - 1.) * sinh, -a * sinh * rate, a * math.sqrt(e ** 2 - 1.) * cosh * rate
+    i, node, peri = math.radians(i), math.radians(node), math.radians(peri)
+    p = np.array([math.cos(peri) * math.cos(node) - math.sin(peri) * math.sin(node) * math.cos(i), math.cos(peri) * math.sin(node) + math.sin(peri) * math.cos(node) * math.cos(i), math.sin(peri) * math.sin(i)])
+    q = np.array([-math.sin(peri) * math.cos(node) - math.cos(peri) * math.sin(node) * math.cos(i), -math.sin(peri) * math.sin(node) + math.cos(peri) * math.cos(node) * math.cos(i), math.cos(peri) * math.sin(i)])
+    return np.outer(p, x) + np.outer(q, y), np.outer(p, vx) + np.outer(q, vy)
+
+#Heliocentric position of the Earth (au, ecliptic J2000, as keplerpositions) at each Julian Date in julian from the low precision formulae for
+#the Sun of the Astronomical Almanac (good to about 0.01 degrees), its longitude taken back from the equinox of date to J2000
+def earthpositions(julian):
+    n = julian - 2451545.0
+    g = np.radians(357.528 + 0.9856003 * n)
+    longitude = np.radians(280.460 + 0.9856474 * n + 1.915 * np.sin(g) + 0.020 * np.sin(2. * g) - 1.3969713 * n / 36525.)
+    distance = 1.00014 - 0.01671 * np.cos(g) - 0.00014 * np.cos(2. * g)
+    return np.array([-distance * np.cos(longitude), -distance * np.sin(longitude), np.zeros(len(n))])
+
+#Ephemerides (r, delta and phase angle as from JPL HORIZONS) at each Julian Date in julian of the object on the orbit of elements, a list of
+#its q, e, i, node, peri and T (see elements_file). The object is taken where it was when the light seen at each epoch left it, as JPL HORIZONS does,
+#moving it back along its velocity for the light time (at most minutes, over which its path is straight to far better than the elements are known).
+#Returns a dictionary of an array of each of datetime_jd, r, delta and alpha
+def twobodyephemerides(julian, elements):
+    earth = earthpositions(julian)
+    body, velocity = keplerpositions(julian, *elements)
+    body = body - velocity * (np.linalg.norm(body - earth, axis=0) / 173.1446327)
+    r = np.linalg.norm(body, axis=0)
+    delta = np.linalg.norm(body - earth, axis=0)
+    sun = np.linalg.norm(earth, axis=0)
+    alpha = np.degrees(np.arccos(np.clip((r ** 2 + delta ** 2 - sun ** 2) / (2. * r * delta), -1., 1.)))
+    return {'datetime_jd': julian, 'r': r, 'delta': delta, 'alpha': alpha}
+
+#Ephemerides of small_body_designation at window (see queryhorizons) from its orbital elements in elements_file (see twobodyephemerides)
+def elementsephemerides(window, step):
+    if len(orbital_elements) == 0:
+        orbital_elements.update(readelements(elements_file))
+    if small_body_designation not in orbital_elements:
+        raise KeyError('No orbital elements of ' + small_body_designation + ' in ' + elements_file)
+    julian = windowepochs(window, step).astype('datetime64[s]').astype(np.int64) / 86400. + 2440587.5
+    return twobodyephemerides(julian, orbital_elements[small_body_designation])
+
+#Optional command line argument --benchmark: times the two body ephemerides of small_body_designation from its orbital elements in elements_file
+#(see twobodyephemerides) at a million epochs from a year before its perihelion to a year after, then compares them with the ephemerides of
+#ephemeris_provider (e.g., JPL HORIZONS or a file saved from it) every day over the same two years
+def benchmarkelements():
+    elements = readelements(elements_file)[small_body_designation]
+    julian = np.linspace(elements[5] - 365.25, elements[5] + 365.25, 1000000)
+    start = time.perf_counter()
+    twobodyephemerides(julian, elements)
+    seconds = time.perf_counter() - start
+    print('Two body ephemerides of ' + small_body_designation + ': ' + str(len(julian)) + ' epochs in %.3f s, %.1f million epochs per second' % (seconds, len(julian) / seconds / 1e6))
+    if ephemeris_provider == 'elements':
+        print("Set ephemeris_provider to 'horizons' or 'file' to compare them with the ephemerides of JPL HORIZONS")
+        return
+    first = epochminutes(np.array([elements[5] - 365.25]))[0].astype('datetime64[D]').astype('datetime64[m]')
+    try:
+        reference = ephemerides(np.arange(first, first + np.timedelta64(732, 'D'), np.timedelta64(1, 'D')), 1440)
+    except Exception as error:
+        print('Could not get the ephemerides of ' + ephemeris_provider + ' to compare with: ' + repr(error))
+        return
+    twobody = twobodyephemerides(reference['datetime_jd'], elements)
+    print('Compared with ' + ephemeris_provider + ' at ' + str(len(reference['datetime_jd'])) + ' epochs:')
+    for name, unit in [('r', 'au'), ('delta', 'au'), ('alpha', 'degrees')]:
+        difference = np.abs(twobody[name] - reference[name])
+        print('    ' + name + ': median difference %.2e, largest %.2e ' % (np.median(difference), np.max(difference)) + unit)
+    magnitudes = 5. * np.abs(np.log10(twobody['delta'] / reference['delta']))
+    print('    largest difference of the heliocentric corrections (5 log10 delta) %.2e magnitudes' % np.max(magnitudes))
+
+#Every source of ephemerides that ephemeris_provider can name. Each is a function of (window, step) that returns the ephemerides of
+#small_body_designation at window as a dictionary of an array of every quantity in ephemeris_columns (see queryhorizons).
+ephemeris_providers = {'horizons': queryhorizons, 'file': fileephemerides, 'elements': elementsephemerides, 'mock': mockephemerides}
+
+#Ephemerides at epochs, sorted epochs every step minutes from epochgrid (a whole grid, or only some of its epochs)
+#Each run of neighbouring epochs is split into windows of at most JPL_Query_Epochs epochs, so that any date range and step stay under the
+#epoch limit of JPL HORIZONS, and JPL_Connections windows are queried at once. The windows are then joined back together in order.
+#If step is None the epochs are any sorted epochs, split into windows of JPL_Discrete_Query_Epochs epochs queried exactly (see queryhorizons).
+def queryepochs(epochs, step):
+    if step is None:
+        runs, size = [epochs], JPL_Discrete_Query_Epochs
+    else:
+        runs, size = np.split(epochs, np.flatnonzero(np.diff(epochs) != np.timedelta64(step, 'm')) + 1), JPL_Query_Epochs
+    windows = [run[k:k + size] for run in runs for k in range(0, len(run), size)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, JPL_Connections)) as pool:
+        parts = list(pool.map(lambda window: ephemeris_providers[ephemeris_provider](window, step), windows))
+    return {name: np.concatenate([part[name] for part in parts]) for name in ephemeris_columns}
+
+#Every step minutes from the start of the night of the first of times (numpy datetime64) to one step past the end of the night of the last,
+#so that every time has an epoch either side of it. Epochs are counted from 1970-01-01 00:00 rather than from the first time, so that the
+#grids of any times (e.g., of each batch of observations, see prefetchephemerides) are all parts of one grid and share the ephemeris cache.
+def epochgrid(times, step):
+    step = np.timedelta64(step, 'm')
+    first = times.min().astype('datetime64[D]').astype('datetime64[m]')
+    first = first - (first - np.datetime64(0, 'm')) % step
+    last = times.max().astype('datetime64[D]').astype('datetime64[m]') + np.timedelta64(1440, 'm') + step
+    return np.arange(first, last + np.timedelta64(1, 'm'), step)
+
+#Epochs that ephemerides are first asked for at for observations at times (numpy datetime64 to the second), and their step (see ephemerides):
+#the epochgrid every JPL_Time_Increment minutes, only the epochs of it nearest to the times with JPL_Discrete_Epochs,
+#or the epochs every JPL_Spline_Increment minutes the splines start from with JPL_Spline_Increment (see splineephemerides)
+def ephemerisepochs(times):
+    if JPL_Spline_Increment:
+        step = np.timedelta64(JPL_Spline_Increment, 'm')
+        first = times.min().astype('datetime64[m]')
+        return np.arange(first - (first - np.datetime64(0, 'm')) % step, times.max().astype('datetime64[m]') + 2 * step, step), JPL_Spline_Increment
+    grid = epochgrid(times, JPL_Time_Increment)
+    if JPL_Discrete_Epochs:
+        increment = np.timedelta64(JPL_Time_Increment, 'm')
+        return np.unique(grid[0] + np.round((times - grid[0]) / increment).astype(np.int64) * increment), None
+    return grid, JPL_Time_Increment
+
+#Position in julian (sorted Julian Dates) of the Julian Date nearest to each Julian Date in wanted, found with np.searchsorted,
+#and whether it is within tolerance days of it (by default a second, i.e. the same epoch)
+def findepochs(julian, wanted, tolerance=1. / 86400.):
+    index = np.minimum(np.searchsorted(julian, wanted), max(len(julian) - 1, 0))
+    if len(julian) == 0:
+        return index, np.zeros(len(wanted), dtype=bool)
+    previous = np.maximum(index - 1, 0)
+    index = np.where(np.abs(julian[previous] - wanted) < np.abs(julian[index] - wanted), previous, index)
+    return index, np.abs(julian[index] - wanted) <= tolerance
+
+#Ephemerides of small_body_designation at epochs, sorted epochs every step minutes or, if step is None, any sorted epochs (see queryepochs)
+#Ephemerides already queried from JPL HORIZONS for the same object are kept in cache_directory, one file per object.
+#Only the epochs that are not already in that file are queried, then added to it. Each file holds one row per quantity in
+#ephemeris_columns and is memory-mapped, so that only the epochs looked up in it are read from disk.
+#Epochs that JPL HORIZONS has no ephemerides at (e.g., before the orbit of the object is known) are kept in the file too, with NaN for
+#every quantity, so that they are not queried again on every run; they are left out of the ephemerides returned, as if never queried.
+#Files are deleted along with the sorted input files once the cache grows too large (see trimcache).
+#Ephemerides from any other ephemeris_provider are not cached as they are already at hand.
+def ephemerides(epochs, step):
+    if (cache_directory == '') or (ephemeris_provider != 'horizons'):
+        return queryepochs(epochs, step)
+    key = hashlib.sha256(repr(small_body_designation).encode()).hexdigest()
+    cache_file = os.path.join(cache_directory, 'ephemerides_' + key + '.npy')
+    cached = None
+    if os.path.exists(cache_file):
+        cached = dict(zip(ephemeris_columns, np.load(cache_file, mmap_mode='r')))
+    wanted = epochs.astype('datetime64[s]').astype(np.int64) / 86400. + 2440587.5
+    found = np.zeros(len(wanted), dtype=bool)
+    if cached is not None:
+        index, found = findepochs(cached['datetime_jd'], wanted)
+    if found.all():
+        os.utime(cache_file)
+    else:
+        #queries only the epochs missing from the cache, and marks those the query has no ephemerides at
+        queried = queryepochs(epochs[~found], step)
+        unanswered = wanted[~found][~findepochs(queried['datetime_jd'], wanted[~found])[1]]
+        nodata = dict((name, np.full(len(unanswered), np.nan)) for name in ephemeris_columns)
+        nodata['datetime_jd'] = unanswered
+        parts = ([] if cached is None else [cached]) + [queried, nodata]
+        julian, unique = np.unique(np.concatenate([part['datetime_jd'] for part in parts]), return_index=True)
+        cached = {name: np.concatenate([part[name] for part in parts])[unique] for name in ephemeris_columns}
+        #closes the memory-mapped file before it is replaced
+        del parts
+        os.makedirs(cache_directory, exist_ok=True)
+        tmp_file = cache_file[:-len('.npy')] + '.tmp.' + str(os.getpid()) + '.npy'
+        np.save(tmp_file, np.array([cached[name] for name in ephemeris_columns]))
+        os.replace(tmp_file, cache_file)
+        trimcache()
+        index, found = findepochs(cached['datetime_jd'], wanted)
+    found = found & ~np.isnan(cached['r'][index])
+    return {name: cached[name][index[found]] for name in ephemeris_columns}
+
+#Cubic splines of the r, delta and phase angle of ephemeris (see ephemerides) against Julian Date
+def ephemerissplines(ephemeris):
+    return {name: CubicSpline(ephemeris['datetime_jd'], ephemeris[name]) for name in ['r', 'delta', 'alpha']}
+
+#Ephemerides of small_body_designation at times (sorted numpy datetime64 to the second, e.g. of each observation) interpolated with cubic splines
+#JPL HORIZONS is first queried every JPL_Spline_Increment minutes from the first time to past the last, then at the middle of every
+#interval where the splines through the epochs queried so far are off there by more than JPL_Spline_Tolerance magnitudes, then at the middles
+#of the halves of those intervals, and so on until the splines are nowhere off by more (or the intervals are JPL_Time_Increment minutes long).
+#This queries many epochs where r, delta and phase angle change fastest (e.g., near perihelion) and few where they barely change.
+#Times in intervals where the splines are still off by more once the intervals are that short (e.g., at perihelion of a sungrazing comet)
+#are looked up at exactly their time instead of being interpolated.
+#Returns a dictionary like ephemerides with one entry per time
+def splineephemerides(times):
+    queried = ephemerides(*ephemerisepochs(times))
+    #the epochs there are ephemerides for (all of those asked for, unless e.g. a file of ephemerides does not cover them all)
+    epochs = epochminutes(queried['datetime_jd'])
+    #whether the interval from each epoch to the next is to be split, and whether it is still off by more but too short to split
+    splitting = np.ones(len(epochs), dtype=bool)
+    unresolved = np.zeros(len(epochs), dtype=bool)
+    while True:
+        gaps = np.diff(epochs)
+        short = gaps < np.timedelta64(2 * JPL_Time_Increment, 'm')
+        unresolved[:-1] |= splitting[:-1] & short
+        splitting[:-1] &= ~short
+        splitting[-1] = False
+        if not splitting.any():
+            break
+        middles = epochs[splitting] + gaps[splitting[:-1]] // 2
+        added = ephemerides(middles, None)
+        found = np.isin(middles, epochminutes(added['datetime_jd']))
+        middles = middles[found]
+        splines = ephemerissplines(queried)
+        julian = added['datetime_jd']
+        #errors of the heliocentric corrections (5 log10 delta), of 5 log10 r, and of the phase corrections (at most about 0.04 magnitudes per degree)
+        error = np.maximum.reduce([5. * np.abs(np.log10(splines['r'](julian) / added['r'])), 5. * np.abs(np.log10(splines['delta'](julian) / added['delta'])), 0.04 * np.abs(splines['alpha'](julian) - added['alpha'])])
+        worse = np.zeros(len(found), dtype=bool)
+        worse[found] = error > JPL_Spline_Tolerance
+        splitting[splitting] = worse
+        order = np.argsort(np.concatenate([epochs, middles]), kind='stable')
+        epochs = np.concatenate([epochs, middles])[order]
+        splitting = np.concatenate([splitting, worse[found]])[order]
+        unresolved = np.concatenate([unresolved, np.zeros(len(middles), dtype=bool)])[order]
+        queried = {name: np.concatenate([queried[name], added[name]])[order] for name in ephemeris_columns}
+    #times outside the epochs queried are left out rather than extrapolated to
+    julian = times.astype(np.int64) / 86400. + 2440587.5
+    inside = (julian >= queried['datetime_jd'][0]) & (julian <= queried['datetime_jd'][-1])
+    julian = julian[inside]
+    splines = ephemerissplines(queried)
+    interpolated = {name: splines[name](julian) for name in splines}
+    interpolated['datetime_jd'] = julian
+    direct = unresolved[np.clip(np.searchsorted(queried['datetime_jd'], julian, side='right') - 1, 0, len(epochs) - 1)]
+    if direct.any():
+        exact = ephemerides(np.unique(times[inside][direct]), None)
+        index, found = findepochs(exact['datetime_jd'], julian[direct])
+        rows = np.flatnonzero(direct)[found]
+        for name in splines:
+            interpolated[name][rows] = exact[name][index[found]]
+    print (len(epochs), 'epochs queried, interpolated to', len(times), 'observation times,', np.count_nonzero(direct), 'of them looked up at their exact time')
+    return interpolated
+
+#Ephemerides being queried in the background while the input is still read and sorted, and the times of the kept points they are
+#still to be queried for, see prefetchephemerides
+prefetching = []
+prefetch_times = []
+
+#With JPL_Prefetch, starts querying the ephemerides that the kept points of table will need (see ephemerisepochs) with pool, a thread in the
+#background, as soon as table is sorted. The network time of JPL HORIZONS is then spent while the rest of the input is read and sorted and
+#removed points are written out, instead of after. The ephemerides go into the ephemeris cache, where queryJPL finds them once it has
+#waited for them. The epochs of any batches are part of those of all the kept points (see epochgrid), so no epoch is queried that is not needed.
+def prefetchephemerides(pool, table):
+    if (pool is not None) and (len(table) != 0):
+        prefetch_times.append(observationtimes(table)[1])
+        prefetching.append(pool.submit(prefetchpending))
+
+#Queries the ephemerides of every batch sorted since the last query at once, rather than one query per batch
+def prefetchpending():
+    count = len(prefetch_times)
+    if count != 0:
+        times = np.concatenate(prefetch_times[:count])
+        del prefetch_times[:count]
+        ephemerides(*ephemerisepochs(times))
 
 #This will query JPL HORIZONS and pull the ephemerides of the object inputted above.
 #The epoch range will be from the first time in your 'kept' observation (i.e., points remaining after the previous sorting) to the last time
 #at the increment range also inputted (default is every 30 minutes). 
 #That is if your first date is 1996:01:19 00:00, final date is 1996:01:19 01:00 and your increment size is every 30 minutes then it will
 #query JPL Horizons for the ephemerides of your object at 1996:01:19 00:00, 1996:01:19 00:30, and 1996:01:19 01:00
-#It then stores the required information from this query in global lists to be used later
-#
+#It then stores the required information from this query in global lists to be used later, along with the distance at perihelion
+#(and its date, if perihelion is left blank) taken from the same ephemerides
 #
 #There were two choices for this block, query JPL HORIZONS at each point in the data or query once over the entire date/time range.
 #I went with the latter as each individual query to JPL HORIZONS takes quite a bit of time, although this way
-#does require much more sorting later on. Additionally, for date ranges over long periods of time you can only
-#query JPL at 30 minute increments before running into their 100,000 epoch query limit. However, the change
-#in delta and phase angle during a 30 minute (or even 1 hour) period is insignificant to the fact that amateurs report
-#these magnitudes to one decimal place.
+#does require much more sorting later on. Date ranges over long periods of time are split into several queries that each stay under
+#the 100,000 epoch query limit of JPL HORIZONS (see queryepochs). The change in delta and phase angle during a 30 minute (or even 1 hour)
+#period is insignificant to the fact that amateurs report these magnitudes to one decimal place.
 def queryJPL():
     global OBJDelta
-    global OBJDates
     global OBJPhase
     global OBJr
     global OBJJulianDate
-    global r_at_perihelion
-    initial_date = str(metalist[3][0]) + "/" + str(metalist[4][0]) + "/" + str(math.floor(float(metalist[5][0])))
-    final_date = str(metalist[3][0]) + "/" + str(metalist[4][0]) + "/" + str(math.floor(float(metalist[5][0])))
-    place_in_list_initial = 0
-    place_in_list_final = 0
-    peri_date = datetime.strptime(perihelion,"%Y/%m/%d")
-    plus_one_day_peri = peri_date + timedelta(days=1)
-    peri_date = str(peri_date.date()).replace("-","/")
-    plus_one_day_peri = str(plus_one_day_peri.date()).replace("-","/")
-
-    print("looking for closest observation to perihelion date provided")
-    for j in range (0, len(metalist[3])):
-        check_date = str(metalist[3][j]) + "/" + str(metalist[4][j]) + "/" + str(math.floor(float(metalist[5][j])))
-        newdate1 = time.strptime(initial_date, "%Y/%m/%d")
-        newdate2 = time.strptime(check_date, "%Y/%m/%d")
-        newdate3 = time.strptime(final_date, "%Y/%m/%d")
-        peridate = time.strptime(perihelion, "%Y/%m/%d")
-        if newdate2 < newdate1:
-            initial_date = check_date
-        elif newdate2 > newdate3:
-            final_date = check_date
-        if j == 0:
-            last_newdate2 = newdate2
-            continue
-        if (peridate >= newdate2) and (last_newdate2 <= newdate2):
-            thisj = j
-    last_newdate2 = newdate2
-
-    try:
-        check_date = str(metalist[3][thisj]) + "/" + str(metalist[4][thij]) + "/" + str(math.floor(float(metalist[5][thisj])))
-        newdate1 = time.strptime(initial_date, "%Y/%m/%d")
-        newdate2 = time.strptime(check_date, "%Y/%m/%d")
-        newdate3 = time.strptime(final_date, "%Y/%m/%d")
-        peridate = time.strptime(perihelion, "%Y/%m/%d")            
-
-        if newdate2 == peridate:
-            small_body_for_peri_r = callhorizons.query(small_body_designation)
-            small_body_for_peri_r.set_epochrange(peri_date,plus_one_day_peri,str(JPL_Time_Increment) + 'm')
-            small_body_for_peri_r.get_ephemerides(500)
-            tmp_r_at_peri_date = small_body_for_peri_r['r']
-        else:
-            this_date = datetime.strptime(check_date,"%Y/%m/%d")
-            plus_one_day_this = this_date + timedelta(days=1)
-            this_date = str(this_date.date()).replace("-","/")
-            plus_one_day_this = str(plus_one_day_this.date()).replace("-","/")
-            small_body_for_peri_r = callhorizons.query(small_body_designation)
-            small_body_for_peri_r.set_epochrange(this_date,plus_one_day_this,str(JPL_Time_Increment) + 'm')
-            small_body_for_peri_r.get_ephemerides(500)
-            tmp_r_at_peri_date = small_body_for_peri_r['r']
-    
-    except:
-        for j in range (0, len(metalist[3])):
-            check_date = str(metalist[3][j]) + "/" + str(metalist[4][j]) + "/" + str(math.floor(float(metalist[5][j])))
-            newdate1 = time.strptime(initial_date, "%Y/%m/%d")
-            newdate2 = time.strptime(check_date, "%Y/%m/%d")
-            newdate3 = time.strptime(final_date, "%Y/%m/%d")
-            peridate = time.strptime(perihelion, "%Y/%m/%d")
-            if newdate2 < newdate1:
-                initial_date = check_date
-            elif newdate2 > newdate3:
-                final_date = check_date
-            if j == 0:
-                last_newdate2 = newdate2
-                continue
-            if (peridate <= newdate2) and (last_newdate2 > newdate2):
-                thisj = j
-                last_newdate2 = newdate2
-                
-        check_date = str(metalist[3][thisj]) + "/" + str(metalist[4][thisj]) + "/" + str(math.floor(float(metalist[5][thisj])))
-        newdate1 = time.strptime(initial_date, "%Y/%m/%d")
-        newdate2 = time.strptime(check_date, "%Y/%m/%d")
-        newdate3 = time.strptime(final_date, "%Y/%m/%d")
-        peridate = time.strptime(perihelion, "%Y/%m/%d")    
-        if newdate2 == peridate:
-            small_body_for_peri_r = callhorizons.query(small_body_designation)
-            small_body_for_peri_r.set_epochrange(peri_date,plus_one_day_peri,str(JPL_Time_Increment) + 'm')
-            small_body_for_peri_r.get_ephemerides(500)
-            tmp_r_at_peri_date = small_body_for_peri_r['r']
-        else:
-            this_date = datetime.strptime(check_date,"%Y/%m/%d")
-            plus_one_day_this = this_date + timedelta(days=1)
-            this_date = str(this_date.date()).replace("-","/")
-            plus_one_day_this = str(plus_one_day_this.date()).replace("-","/")
-            small_body_for_peri_r = callhorizons.query(small_body_designation)
-            small_body_for_peri_r.set_epochrange(this_date,plus_one_day_this,str(JPL_Time_Increment) + 'm')
-            small_body_for_peri_r.get_ephemerides(500)
-            tmp_r_at_peri_date = small_body_for_peri_r['r']
-
-    print('closest observation found')
-    print('Querying JPL HORIZONS')
-        
-    r_at_perihelion = float("%.1f" % tmp_r_at_peri_date[math.floor(len(tmp_r_at_peri_date)/2)])
-    initial_date = initial_date.replace("/","-") + " 00:00"
-    final_date = final_date.replace("/","-") + " 23:00"
-    #Queries JPL HORIZONS
-    small_body = callhorizons.query(small_body_designation)
-    #By default time_string = '30m' that is from initial_date to final_date at 30 minute increments
-    #Change increment at top of code for increments from every 1 to 60 minutes.
-    #Code currently does not allow for increments in time periods greater than 60 minutes
-    #TODO fix the above, will require changing the line below as well as the if statements in the optional argument blocks that compare the times.
-    time_string = str(JPL_Time_Increment) + 'm'
-    small_body.set_epochrange(initial_date, final_date , time_string)
-    print (small_body.get_ephemerides(500), 'epochs queried')
+    global date_compare_to_JPL
+    sources = {'horizons': 'JPL HORIZONS', 'file': 'the ephemerides saved in ' + ephemeris_directory, 'elements': 'the orbital elements in ' + elements_file, 'mock': 'mock_ephemerides'}
+    print('Querying ' + sources[ephemeris_provider])
+    julian, times = observationtimes(metatable)
+    date_compare_to_JPL = np.datetime_as_string(times, unit='s').tolist()
+    #waits for the ephemerides queried in the background while the input was read (see prefetchephemerides), which are then in the cache
+    for future in prefetching:
+        try:
+            future.result()
+        except Exception as error:
+            print('Querying ephemerides in the background failed (' + repr(error) + '), querying them again')
+    del prefetching[:]
+    #Queries JPL HORIZONS (or the ephemeris cache, see ephemerides, or any other ephemeris_provider)
+    #By default from the start of the night of the first observation to one increment past the end of the night of the last at 30 minute
+    #increments (see epochgrid), so that every observation has an epoch of the query either side of it
+    #Change increment at top of code for any other increment in minutes, long date ranges are split into several queries (see queryepochs)
+    #With JPL_Discrete_Epochs only at the epochs nearest to the observations
+    #With JPL_Spline_Increment interpolated to the time of each observation instead (see splineephemerides)
+    if JPL_Spline_Increment:
+        small_body = splineephemerides(np.unique(times))
+    else:
+        small_body = ephemerides(*ephemerisepochs(times))
+        print (len(small_body['r']), 'epochs queried')
     OBJDelta = small_body['delta']
-    OBJDates = small_body['datetime']
     OBJPhase = small_body['alpha']
     OBJr = small_body['r']
     OBJJulianDate = small_body['datetime_jd']
-    tmp_dates =[]
-    hours = ""
-    minutes = ""
-    seconds = ""
-    date_compare_to_JPL = decimaldate2hhmmss()
-    for k in range(0, len(OBJDates)):
-        OBJDates[k] = OBJDates[k].replace("Jan","01")
-        OBJDates[k] = OBJDates[k].replace("Feb","02")
-        OBJDates[k] = OBJDates[k].replace("Mar","03")
-        OBJDates[k] = OBJDates[k].replace("Apr","04")
-        OBJDates[k] = OBJDates[k].replace("May","05")
-        OBJDates[k] = OBJDates[k].replace("Jun","06")
-        OBJDates[k] = OBJDates[k].replace("Jul","07")
-        OBJDates[k] = OBJDates[k].replace("Aug","08")
-        OBJDates[k] = OBJDates[k].replace("Sep","09")
-        OBJDates[k] = OBJDates[k].replace("Oct","10")
-        OBJDates[k] = OBJDates[k].replace("Nov","11")
-        OBJDates[k] = OBJDates[k].replace("Dec","12")
-
-#Add headers to the columns in the output csv files.
-def add_headers(x):
-    x[0].insert(0,'col 1-3 : short period comet designation')
-    x[1].insert(0, 'col 4-9 : Standard comet designation')
-    x[2].insert(0, 'col 10 : multiple nuclei present?')
-    x[3].insert(0,'col 12-15 : year observed')
-    x[4].insert(0,'col 17-18 : month observed')
-    x[5].insert(0, 'col 20-24')
-    x[6].insert(0,'col 26 : special note / extinction note')
-    x[7].insert(0, 'col 27 : Magnitude collection method')
-    x[8].insert(0, 'col 28-32 : visual magnitude estimate')
-    x[9].insert(0, 'col 33 : poor conditions?')
-    x[10].insert(0, 'col 34 - 35 : reference catalog')
-    x[11].insert(0, 'col 36-40 : instrument aperture in centimeters')
-    x[12].insert(0, 'col 41 : instrument type')
-    x[13].insert(0, 'col 42 - 43 : focal ratio')
-    x[14].insert(0, 'col 44-47 : magnification used')
-    x[15].insert(0, 'col 49 : error estimate for coma diameter')
-    x[16].insert(0, 'col 50 - 54 : coma diameter in arcminutes')
-    x[17].insert(0, 'col 55 : special note on central condensation of comet')
-    x[18].insert(0, 'col : 56 -57 : degree of condensation (note / means estimate)')
-    x[19].insert(0, 'col 59 - 64 : error of tail approximation and tail approximation')
-    x[20].insert(0, 'col 65 - 67 : direction tail is pointed')
-    x[21].insert(0, 'col 69-74 : ICQ reference publication')
-    x[22].insert(0, 'col 75 : second special note / extinction note ')
-    x[23].insert(0, 'col 76-80 : observer name')
-                
+
+    #With --append the ephemerides of the points kept in earlier runs are looked through as well
+    r, epochs = OBJr, OBJJulianDate
+    if (appending is not None) and ('derived_r' in appending):
+        r, epochs = np.concatenate([appending['derived_r'], r]), np.concatenate([appending['derived_julian'], epochs])
+    findperihelion(r, epochs)
+
+#Perihelion is where r is smallest in the ephemerides r at epochs (or as near to it as the observations go, if it is outside their dates)
+def findperihelion(r, epochs):
+    global r_at_perihelion
+    global perihelion
+    if len(r) != 0:
+        closest = np.argmin(r)
+        r_at_perihelion = float("%.1f" % r[closest])
+        #With perihelion = '' the date of perihelion is also taken from the ephemerides
+        if perihelion == '':
+            perihelion = str(epochminutes(epochs[closest:closest + 1])[0].astype('datetime64[D]')).replace('-', '/')
+            print('perihelion found on ' + perihelion + ' at r = %.3f au' % r[closest])
+            if (epochs[closest] == epochs.min()) or (epochs[closest] == epochs.max()):
+                print('perihelion may be outside the dates observed, ' + perihelion + ' is only the closest date to it observed')
+
+#Index in the ephemerides of queryJPL (OBJJulianDate) of the epoch nearest to each observation in metatable (see findepochs)
+#Observations with no epoch within half of JPL_Time_Increment (or at their exact time with JPL_Spline_Increment) cannot be corrected:
+#they are printed and taken out of metatable and date_compare_to_JPL rather than left out of the corrections without a word.
+def matchephemerides():
+    global metatable
+    global date_compare_to_JPL
+    julian, times = observationtimes(metatable)
+    tolerance = 1. if JPL_Spline_Increment else JPL_Time_Increment * 30. + 1.
+    index, matched = findepochs(OBJJulianDate, julian, tolerance / 86400.)
+    if not matched.all():
+        print(np.count_nonzero(~matched), 'observations have no ephemerides near their time and are not corrected:')
+        for i in np.flatnonzero(~matched):
+            print('   ', metatable.text('obs')[i], date_compare_to_JPL[i])
+        metatable = metatable[matched]
+        date_compare_to_JPL = [date_compare_to_JPL[i] for i in np.flatnonzero(matched)]
+    return index[matched]
+
+#Schleicher's composite phase function as read in from phase_function_file, the phase angles it is given at (degrees) and its value at each
+#normalized to 0 degrees, by the name of the file. Each file is read in once, the first time it is needed (see schleicherphase).
+schleicher_composite = {}
+
+#Reads in phase_function_file, found from the directory of this script so that runs from any directory (e.g., with --catalogue) find it
+#Returns a dictionary of the arrays alpha (the phase angles, sorted) and normalized (the composite phase function at each)
+def readphasefunction(file_name):
+    if not os.path.isabs(file_name):
+        file_name = os.path.join(os.path.dirname(os.path.realpath(__file__)), file_name)
+    composite = np.loadtxt(file_name, usecols=(0, 1), ndmin=2)
+    composite = composite[np.argsort(composite[:, 0])]
+    return {'alpha': composite[:, 0], 'normalized': composite[:, 1]}
+
+#Schleicher's composite dust phase function at each phase angle in alpha (degrees), normalized to 0 degrees.
+#It is given at every whole degree and is interpolated linearly in between.
+def schleicherphase(alpha):
+    if phase_function_file not in schleicher_composite:
+        schleicher_composite[phase_function_file] = readphasefunction(phase_function_file)
+    composite = schleicher_composite[phase_function_file]
+    return np.interp(alpha, composite['alpha'], composite['normalized'])
+
+#Henyey-Greenstein function of asymmetry parameter g at each phase angle in alpha (degrees), i.e. at a scattering angle of 180 - alpha
+def henyeygreenstein(alpha, g):
+    return (1. - g ** 2) / (1. + g ** 2 + 2. * g * np.cos(np.radians(alpha))) ** 1.5
+
+#Marcus's compound Henyey-Greenstein dust phase function (Marcus 2007, ICQ 29, 39) at each phase angle in alpha (degrees), normalized to 0 degrees:
+#95% of the light scattered forwards with g = 0.9 and 5% backwards with g = -0.6
+def marcusphase(alpha):
+    compound = lambda alpha: 0.95 * henyeygreenstein(alpha, 0.9) + 0.05 * henyeygreenstein(alpha, -0.6)
+    return compound(alpha) / compound(0.)
+
+#Henyey-Greenstein phase function of asymmetry parameter phase_hg_g at each phase angle in alpha (degrees), normalized to 0 degrees
+def henyeygreensteinphase(alpha):
+    return henyeygreenstein(alpha, phase_hg_g) / henyeygreenstein(0., phase_hg_g)
+
+#Linear phase law of phase_linear_beta magnitudes per degree at each phase angle in alpha (degrees), normalized to 0 degrees
+def linearphase(alpha):
+    return 10. ** (-0.4 * phase_linear_beta * alpha)
+
+#Every phase function that phase_models can name. Each is a function of an array of phase angles (degrees) returning the phase function
+#at each normalized to 0 degrees, i.e. the brightness at that phase angle relative to 0 degrees (the magnitude is corrected by + 2.5 log10 of it).
+phase_functions = {'schleicher': schleicherphase, 'marcus': marcusphase, 'henyey-greenstein': henyeygreensteinphase, 'linear': linearphase}
+
+#Each phase function of phase_functions used so far, evaluated every phase_table_resolution degrees from 0 to 180 degrees, along with the
+#change from each value to the next (see phasefunction), by the model and every setting the table depends on (see phasetablekey)
+phase_tables = {}
+
+#What the table of a phase model depends on: the model, its parameters and phase_table_resolution, so that a table is made again
+#whenever any of them is changed (e.g., by a test or another comet's settings) rather than an old table being used
+def phasetablekey(model):
+    return (model, phase_function_file, phase_hg_g, phase_linear_beta, phase_table_resolution)
+
+#Phase function model (a name in phase_functions) at each phase angle in alpha (degrees), normalized to 0 degrees, all at once.
+#Each model is evaluated once on a table of phase angles every phase_table_resolution degrees, which is then interpolated linearly
+#by position in the table rather than by searching it (as np.interp does), so that every model takes the same short time per phase angle.
+def phasefunction(alpha, model):
+    key = phasetablekey(model)
+    if key not in phase_tables:
+        table = phase_functions[model](np.linspace(0., 180., int(round(180. / phase_table_resolution)) + 1))
+        phase_tables[key] = (table, np.append(np.diff(table), 0.))
+    table, slopes = phase_tables[key]
+    position = np.clip(alpha * ((len(table) - 1) / 180.), 0., len(table) - 1.)
+    index = position.astype(np.int64)
+    return table[index] + (position - index) * slopes[index]
+
+#Heliocentric and/or phase corrections of the magnitudes of table (an ObservationTable, see lightcurve), every observation at once
+#ephem - the ephemerides at each observation of table, a dictionary of arrays of (at least) delta and phase (the phase angle)
+#helio - whether to make the heliocentric correction, m - 5 log10(delta), giving mhelio
+#phase - names of the phase functions (see phase_functions) to make the phase correction with, m + 2.5 log10 of the phase function at the
+#phase angle (see phasefunction), the first giving mph and each other one mph_<name>
+#With both, the phase corrections are made to mhelio. Returns a dictionary of the magnitudes made (mhelio and/or mph...), each an array of floats.
+def apply_corrections(table, ephem, helio=False, phase=None):
+    if phase is None:
+        phase = []
+    corrected = {}
+    mags = table['mag'].astype(float)
+    if helio:
+        mags = mags - 5. * np.log10(ephem['delta'])
+        corrected['mhelio'] = mags
+    for k, model in enumerate(phase):
+        corrected['mph' if k == 0 else 'mph_' + model] = mags + 2.5 * np.log10(phasefunction(ephem['phase'], model))
+    return corrected
+
+#Writes the header row of a csv file of observations: the headers of the ICQ columns followed by headers, the headers of any extra columns
+#Returns the csv writer so that rows can be added with writerows
+def opentable(f, headers):
+    file_writer = csv.writer(f, delimiter =',')
+    file_writer.writerow(ICQ_HEADERS + headers)
+    return file_writer
+
+#Writes one row per observation in table: each of its ICQ columns followed by the extra columns
+#columns - extra columns (lists or arrays with one entry per observation), e.g. corrected magnitudes or r-values
+def writerows(file_writer, table, columns):
+    rows = table.rows()
+    for k in range (0,len(rows)):
+        file_writer.writerow(rows[k] + [column[k] for column in columns])
+
+#Writes out a csv file with a header row, then one row per observation in table (see opentable and writerows)
+def write_table(file_name, table, headers, columns):
+    with open(file_name, 'w') as f:
+        writerows(opentable(f, headers), table, columns)
+
 #Sorts r from largest to smallest while keeping track of all of ICQ metadata (listPreorPost) for each observation.
 #Used twice, first in stats_shifts function (firstpass = 0) where keeping track of metadata information is important
 #It is also used in plotting, (firstpass = 1) where we do not need the meta information so we skip this step if that is the case
+#listPreorPost is an ObservationTable, observations with the same r keep the order they had before sorting
 def sortbyr(listPreorPost,r,mags, firstpass):
     sorted_metalist = []
-    r_sorted = []
-    mag_sorted = []
-    r = np.array(r)
-    r_sorted = -np.sort(-r)
-    for i in range (0,len(r_sorted)):    #for each object in the sorted list
-        for j in range(0,len(r)):        #find its corresponding entry in unsorted list, this position is the position of all corresponding metadata
-            if firstpass == 0:
-                if (r_sorted[i] == r[j]): #and (listPreorPost[j] not in sorted_metalist):
-                    sorted_metalist.append(listPreorPost[j])
-                    mag_sorted.append(mags[j])
-                    break
-            if (r_sorted[i] == r[j]) and (firstpass == 1):
-                mag_sorted.append(mags[j])
-                break
+    r = np.array(r, dtype=float)
+    order = np.argsort(-r, kind='stable')
+    r_sorted = r[order]
+    mag_sorted = [mags[j] for j in order]
+    if firstpass == 0:
+        sorted_metalist = listPreorPost[order]
     return sorted_metalist, mag_sorted, r_sorted
     
 def getcolumn(matrix, i):
@@ -487,325 +1422,117 @@ def getcolumn(matrix, i):
         
 #Performs the procedures to iterate a polynomial to convergence of tolerance 0.0001 in given data (see file 'Statistics_method_appendix.txt' in the GitHub repository)
 #Inputs: preorpost - String stating whether this is pre-perihelion or post-perihelion data (determined later in the code)
-#listoflists - ICQ metadata
-#dateThours - date in YYYY-MM-DDTHH:MM:SS format used for submitting to NASA PDS and checking whether pre or post perihelion 
-#deltas - list of geocentric distances (from JPL)
-#phases - list of phase angles (from JPL)
-#helio_distances - list of r- values
+#table - ObservationTable of the kept observations, along with the derived quantities found by the --heliocentric and --phase corrections
+#(i.e., table['r'] the heliocentric distances from JPL, table['delta'], table['phase'], table['date'] in YYYY-MM-DDTHH:MM:SS format and table['julian'])
+#corrected_mag - Name of the last calculated magnitude in table (either 'mhelio' or 'mph' depending on which combination of the two the user used)
 #condemned_list - List of observers who have failed the stationary test, not to be used on future convergence tests
-#other_mag Last calculated magnitude (either mhelio or mphase depending on which combination of the two the user used)
-#first_pass - If 1 then this is the first time the data are having a polynomial fit to them (so that r-values do not have their natural log taken twice upon being read in). 
 #Primary Return is mshift - the magnitudes shifted by the mean of an observer's residuals between a global polynomial fit and their data (iterated to convergence)
-def stats_shifts(preorpost, listoflists, corrected_mag, dateThours, deltas, phases, helio_distances, condemned_list, other_mag, first_pass, dateJulian):
+#The returned sorted_stats is the table of the observations used, sorted by r, which can be passed back in to repeat the fit without newly condemned observers
+def stats_shifts(preorpost, table, corrected_mag, condemned_list):
     mshift = []
     obs_list = []
     sorted_stats = []
-    stats = []
     mags = []
     r = []
     new_poly_fit = []
     original_poly_fit = []
     mags_sorted_stat = []
     r_sorted_stat = []
-    stdev_per_observer = []
     resid_per_obs = []
     stdev_resid_per_observer =[]
     count_per_observer = []
     residuals = []
-    sum_resid_per_observer = []
     mean_resid_per_observer = []
     tolerance = 0.0001
 
-    #Checks data are in pre-perihelion range, sorts the data by r (large to small), and rearranges all metadata accordingly
+    #Checks data are in pre-perihelion range (or post-perihelion range) and leaves out condemned observers
     if preorpost == 'pre':
-        #Next if loop necessary in case user only supplied post-perihelion data. Read: if no data are found for pre-perihelion then
-        #fill it with blank spaces that the program will know to skip later.
-        if (len(other_mag) == 1) or (len(other_mag) == 0) or ('' in other_mag):
-            for j in range(0, len(listoflists[0])):
-                other_mag.append('')
-        #for each observer, check if it is pre-perihelion, if so take log(r and sort)
-        for j in range (0, len(listoflists[0])):
-            tmprow = []
-            newdate4 = time.strptime(perihelion, "%Y/%m/%d")
-            datetocheck = str(listoflists[3][j]) + "/" + str(listoflists[4][j]) + "/" + str(math.floor(float(listoflists[5][j])))
-            newdate5 = time.strptime(datetocheck, "%Y/%m/%d")
-            if (newdate5 <= newdate4) and (listoflists[23][j].strip() not in condemned_list):
-                for k in range (0,len(listoflists)):
-                    tmprow.append(listoflists[k][j])
-                tmprow.append(dateThours[j])
-                tmprow.append(corrected_mag[j])
-                tmprow.append(deltas[j])
-                tmprow.append(phases[j])
-                mags.append(float(corrected_mag[j]))
-                if (len(other_mag) != 1) and (len(other_mag) != 0) and ('' not in other_mag):
-                    tmprow.append(other_mag[j])
-                else:
-                    other_mag.append('')
-                    tmprow.append(other_mag[j])
-                if first_pass ==1:
-                    r.append(math.log10(float(helio_distances[j])))
-                elif first_pass == 0:
-                    r.append(float(helio_distances[j]))
-                tmprow.append(dateJulian[j])
-                stats.append(tmprow)
-  
-    #Reads in only post-perihelion data from data in input function            
+        in_range = datekeys(table) <= perihelionkey()
     if preorpost =='post':
-        #Next if loop necessary in case user only supplied pre-perihelion data. Read: if no data are found for post-perihelion then
-        #fill it with blank spaces that the program will know to skip later.
-        if (len(other_mag) == 1) or (len(other_mag) == 0) or ('' in other_mag):
-            for j in range(0, len(listoflists[0])):
-                other_mag.append('')
-        #for each observer, check if it is pre-perihelion, if so take log(r and sort)
-                
-        for j in range (0, len(listoflists[0])):
-            tmprow = []
-            newdate4 = time.strptime(perihelion, "%Y/%m/%d")
-            datetocheck = str(listoflists[3][j]) + "/" + str(listoflists[4][j]) + "/" + str(math.floor(float(listoflists[5][j])))
-            newdate5 = time.strptime(datetocheck, "%Y/%m/%d")
-            if (newdate5 > newdate4) and (listoflists[23][j].strip() not in condemned_list):
-                for k in range (0,len(listoflists)):
-                    tmprow.append(listoflists[k][j])
-                tmprow.append(dateThours[j])
-                tmprow.append(corrected_mag[j])
-                tmprow.append(deltas[j])
-                tmprow.append(phases[j])
-                mags.append(float(corrected_mag[j]))
-                if (len(other_mag) != 1) and (len(other_mag) != 0) and ('' not in other_mag):
-                    tmprow.append(other_mag[j])
-                else:
-                    other_mag.append('')
-                    tmprow.append(other_mag[j])
-                if first_pass == 1:
-                    r.append(math.log10(float(helio_distances[j])))
-                elif first_pass == 0:
-                    r.append(float(helio_distances[j]))
-                tmprow.append(dateJulian[j])
-                stats.append(tmprow)
-            
-    #stats is the "metalist" containing all of the information in the function's input arguments.
+        in_range = datekeys(table) > perihelionkey()
+    in_range = in_range & ~np.isin(np.array(table.text('obs')), condemned_list)
+    stats = table[in_range]
+    mags = stats[corrected_mag].tolist()
+    r = [math.log10(x) for x in stats['r'].tolist()]
+
+    #stats is the ObservationTable containing all of the information in the function's input arguments.
     if len(stats) != 0:
 
         sorted_stats, mags_sorted_stat, r_sorted_stat = sortbyr(stats,r,mags,0)
 
-        for i in range (0, len(sorted_stats)):
-            if sorted_stats[i][23].strip() not in obs_list:
-                obs_list.append(sorted_stats[i][23].strip())
-                                                
+        #obs_list holds each observer in the order they first appear, codes the index in obs_list of the observer of each point,
+        #so that the residuals of every observer are summed at once with np.bincount rather than looking through every point for each observer
+        observers, first, codes = np.unique(np.array(sorted_stats.text('obs')), return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        obs_list = observers[order].tolist()
+        codes = np.argsort(order)[codes.ravel()]
+        count_per_observer = np.bincount(codes)
+
+        #Vandermonde matrix of the fifth order fit (r**j in column j) for A_matrix (see Numerical Recipes), the same for every iteration
+        vandermonde = r_sorted_stat[:, np.newaxis] ** np.arange(6)
+
+        #For the first polynomial fit, all weights are set to 1.0 as we do not have standard deviations yet and b is the magnitudes themselves.
+        #For each successive iteration the rows of A and b of each observer are divided by stdev_resid_per_observer, b is mshift.
+        #Each fit is solved with a QR decomposition of A for its change from the previous fit (fit, lowest power first, zero before the first),
+        #i.e. the least squares solution of A change = b - A fit, which is also what the convergence test looks at.
+        mshift = np.array(mags_sorted_stat, dtype=float)
+        stdevs = np.ones(len(mshift))
+        fit = np.zeros(6)
+        solve_time = 0.
+        converged = False
         #Beginning iterating polynomial fits to convergance
         for k in range (0, 21):
-        
-            # if first_pass == 1:
-                # file_name = preorpost +'.'+str(k)+'.'+'out'
-                # file_writer = csv.writer(open(file_name, 'w'), delimiter =',')
-            
-            # if first_pass != 1:
-                # file_name = preorpost +'.'+str(k)+'.'+'With_Dropped_Obs'
-                # file_writer = csv.writer(open(file_name, 'w'), delimiter =',')
-            
-            #for the first polynomial fit, all weights are set to 1.0 as we do not have standard deviations yet
-            if k == 0:
-                #initializing lists needed through routine
-                for i in range(0,len(obs_list)):
-                    sum_resid_per_observer.append(0)
-                    stdev_per_observer.append(0)
-                    stdev_resid_per_observer.append(0)
-                    count_per_observer.append(0)
-                    mean_resid_per_observer.append(0)
-                    resid_per_obs.append(0)
-                
-                A = np.zeros((len(mags_sorted_stat), 6))
-                b = np.zeros((len(mags_sorted_stat), 1))
-                
-                #Inputing A_matrix and b_vector (see Numerical Recipes)
-                for i in range (0, len(mags_sorted_stat)):
-                    for j in range(0,6):
-                        A[i,j] = (r_sorted_stat[i]**j) / 1.0
-                    
-                    b[i,0] = (mags_sorted_stat[i] / 1.0)
-                                
-                U, S, Vh = np.linalg.svd(A, full_matrices = False)
-                
-                S_matrix = np.zeros((6,6))
-                for i in range(0, len(S)):
-                    S_matrix[i,i] = S[i]
-                                    
-                tmp = np.zeros((6,1))
-                tmp = np.matmul(np.matmul(np.matrix.transpose(Vh), linalg.inv(S_matrix)) , np.matmul( np.matrix.transpose(U), b))
-
-                #new_poly_fit is a vector of the coeffeficients of fifth order fit, p is correpsonding function
-                tmp = np.matrix.transpose(tmp)[0]    #current polynomial fit
-                new_poly_fit = []
-                for i in range(len(tmp)-1, -1, -1):
-                    new_poly_fit.append(tmp[i])
-                p = np.poly1d(new_poly_fit)
-                
-                #print(preorpost, k, new_poly_fit)
+            if k != 0:
+                if count_per_observer.min() < 2:
+                    raise statistics.StatisticsError('stdev requires at least two data points')
+                deviations = residuals - mean_resid_per_observer[codes]
+                stdev_resid_per_observer = np.sqrt(np.bincount(codes, weights=deviations ** 2) / (count_per_observer - 1))
+                stdevs = stdev_resid_per_observer[codes]
+
+            start = time.perf_counter()
+            A = vandermonde / stdevs[:, np.newaxis]
+            #Q^T (b - A fit) is found while decomposing A, without forming Q itself
+            b = (mshift - np.matmul(vandermonde, fit)) / stdevs
+            Qb, R = linalg.qr_multiply(A, b[np.newaxis, :], mode='right')
+            change = linalg.solve_triangular(R, Qb[0])
+            fit = fit + change
+            solve_time = solve_time + time.perf_counter() - start
+
+            #new_poly_fit is a vector of the coeffeficients of fifth order fit (highest power first, as for np.poly1d)
+            new_poly_fit = fit[::-1].tolist()
+
+            #calculating residuals between polynomial fit and data point, then for each observer's data the mean of their residuals
+            #For each observer mshift = mshift + mean_resid_per_observer
+            #For instance, on first iteration: mshift = mph + mean_resid_per_observer
+            residuals = np.polyval(new_poly_fit, r_sorted_stat) - mshift
+            mean_resid_per_observer = np.bincount(codes, weights=residuals) / count_per_observer
+            mshift = mshift + mean_resid_per_observer[codes]
+
+            #Compares coefficients between the k_th and k_th - 1 polynomial fits
+            #if each of the coefficients are within 0.0001 then we say the polynomial has converged and are done calculating mshift
+            if (k != 0) and np.all(np.abs(change) < tolerance):
+                converged = True
+                break
+
+        print(preorpost + '-perihelion polynomial fit ' + ('converged' if converged else 'did not converge') + ' to within ' + str(tolerance) + ' after ' + str(k + 1) + ' iterations, %.1f ms solving the fits' % (solve_time * 1000.))
+
+        #the residuals of each observer, in the order of obs_list
+        resid_per_obs = np.split(residuals[np.argsort(codes, kind='stable')], np.cumsum(count_per_observer)[:-1])
+        mshift = mshift.tolist()
+        residuals = residuals.tolist()
+        stdev_resid_per_observer = list(stdev_resid_per_observer)
+        mean_resid_per_observer = mean_resid_per_observer.tolist()
+        count_per_observer = count_per_observer.tolist()
 
-                #calculating residuals between polynomial fit and data point
-                for i in range(0,len(mags_sorted_stat)):
-                    residuals.append(p(r_sorted_stat[i]) - mags_sorted_stat[i])
-                
-                #For each observer's data, calculate the mean and stdev of their residuals
-                #For each observer mshift = mags_sorted_stat + mean_resid_per_observer
-                #For instance, on first iteration: mshift = mph + mean_resid_per_observer
-                for o in range (0, len(obs_list)):
-                    tmp_list = []
-                    for h in range(0,len(mags_sorted_stat)):
-                        if sorted_stats[h][23] == obs_list[o]:
-                            count_per_observer[o] = count_per_observer[o] + 1
-                            tmp_list.append(residuals[h])
-                            resid_per_obs.append(residuals[h])
-                    mean_resid_per_observer[o] = statistics.mean(tmp_list)
-                for h in range(0, len(mags_sorted_stat)):
-                    for o in range (0, len(obs_list)):
-                        if sorted_stats[h][23] == obs_list[o]:
-                            mshift.append(mags_sorted_stat[h] + mean_resid_per_observer[o])
-                            break
-                
-                # if first_pass ==1:
-                    # for h in range(0, len(mags_sorted_stat)):
-                        # file_writer.writerow([str(10**(r_sorted_stat[h])), str(sorted_stats[h][23]), str(mags_sorted_stat[h]),str(mags_sorted_stat[h]), str(0), str(0), str(1)])    
-
-                # if first_pass !=1:
-                    # for h in range(0, len(mags_sorted_stat)):
-                        # file_writer.writerow([str(10**(r_sorted_stat[h])), str(sorted_stats[h][23]), str(mags_sorted_stat[h]),str(mags_sorted_stat[h]), str(0), str(0), str(1)])    
-                            
-            #For each successive iteration we repeat the same things
-            #Except we use stdev_resid_per_observer accordingly in calculating A and b
-            if k!=0:
-                for o in range (0, len(obs_list)):
-                    tmp_list = []
-                    stdev_resid_per_observer[o] = 0
-                    mean_resid_per_observer[o] = 0
-                    sum_resid_per_observer[o] = 0
-                    resid_per_obs[o] = 0
-                    for h in range(0, len(mags_sorted_stat)):
-                        if sorted_stats[h][23] == obs_list[o]:
-                            tmp_list.append(residuals[h])
-                            resid_per_obs.append(residuals[h])
-                    stdev_resid_per_observer[o] = statistics.stdev(tmp_list)
-                    mean_resid_per_observer[o] = statistics.mean(tmp_list)
-                    
-                A = np.zeros((len(mshift), 6))
-                b = np.zeros((len(mshift),1))
-                
-                for i in range (0, len(mshift)):
-                    for j in range(0,6):
-                        for o in range (0, len(stdev_resid_per_observer)):
-                            if sorted_stats[i][23] == obs_list[o]:
-                                A[i,j] = (r_sorted_stat[i]**j) / stdev_resid_per_observer[o]
-                    
-                    for o in range(0,len(stdev_resid_per_observer)):
-                        if sorted_stats[i][23] == obs_list[o]:
-                            b[i,0] = (mshift[i] / stdev_resid_per_observer[o])
-                                
-                U, S, Vh = np.linalg.svd(A, full_matrices = False)
-                
-                S_matrix = np.zeros((6,6))
-                for i in range(0, len(S)):
-                    S_matrix[i,i] = S[i]
-                
-                tmp = np.zeros((6,1))
-                tmp = np.matmul(np.matmul(np.matrix.transpose(Vh), linalg.inv(S_matrix)) , np.matmul( np.matrix.transpose(U), b))
-                        
-                old_poly_fit = new_poly_fit                    #previous polynomial fit
-                tmp = np.matrix.transpose(tmp)[0]            #current polynomial fit
-                new_poly_fit = []
-                for i in range(len(tmp)-1, -1, -1):
-                    new_poly_fit.append(tmp[i])
-                p = np.poly1d(new_poly_fit)
-
-                #Compares coefficients between the k_th and k_th - 1 polynomial fits
-                converge_test = []
-                for i in range(0,len(old_poly_fit)):
-                    converge_test.append(old_poly_fit[i] - new_poly_fit[i])
-                
-                for i in range(0,len(mshift)):
-                    residuals[i] = p(r_sorted_stat[i]) - mshift[i]
-                                    
-                for o in range (0, len(obs_list)):
-                    tmp_list = []
-                    for h in range(0,len(mshift)):
-                        if sorted_stats[h][23] == obs_list[o]:
-                            tmp_list.append(residuals[h])
-                            resid_per_obs.append(residuals[h])
-                            #tmp_list.append(mshift[h])
-                    mean_resid_per_observer[o] = statistics.mean(tmp_list)
-                for h in range(0, len(mshift)):
-                    for o in range (0, len(obs_list)):
-                        if sorted_stats[h][23] == obs_list[o]:
-                            # if first_pass !=1:
-                                # file_writer.writerow([str(10**(r_sorted_stat[h])), str(sorted_stats[h][23]), str(mags_sorted_stat[h]),str(mshift[h]), str(p(r_sorted_stat[h])), str(residuals[h]), str(stdev_resid_per_observer[o])])    
-                            # if first_pass ==1:
-                                # file_writer.writerow([str(10**(r_sorted_stat[h])), str(sorted_stats[h][23]), str(mags_sorted_stat[h]),str(mshift[h]), str(p(r_sorted_stat[h])), str(residuals[h]), str(stdev_resid_per_observer[o])])    
-                            mshift[h] = mshift[h] + mean_resid_per_observer[o]
-                            break
-                            
-                #print(preorpost, k, new_poly_fit)
-                
-                #for h in range(0, len(mags_sorted_stat)):
-                #    file_writer.writerow([str(r_sorted_stat[h]), str(sorted_stats[h][23]), str(mags_sorted_stat[h]),str(mshift[h]), str(p(r_sorted_stat[h]), str(mshift[h]-p(r_sorted_stat[h]), str(1)])    
-
-                        
-                #if each of the coefficients are within 0.0001 then we say the polynomial has converged and are done calculating mshift
-                if (abs(converge_test[0]) < tolerance) and (abs(converge_test[1])< tolerance) and (abs(converge_test[2])< tolerance) and (abs(converge_test[3])< tolerance) and (abs(converge_test[4])< tolerance) and (abs(converge_test[5])< tolerance):
-                    #print(preorpost,': The polynomail fit converged to within tolerance of ', tolerance, ' after ', k, ' iterations')
-                    #print('The final poly_fit is ', new_poly_fit)
-                    break
-                    
-    
-    #for i in range(0,len(sorted_stats)):
-    #    print(i)
-    #    print(sorted_stats[i])
-    
     if len(mshift) == 0 :
-        for i in range (0,30):
-            sorted_stats.append(0)
+        sorted_stats = table[np.zeros(len(table), dtype=bool)]
+
+    return mshift, obs_list, sorted_stats, r_sorted_stat, new_poly_fit, original_poly_fit, stdev_resid_per_observer, mean_resid_per_observer, count_per_observer, residuals, mags_sorted_stat, resid_per_obs, condemned_list
+
+#Headers for the columns written out to the stats files after the ICQ columns
+def stats_headers(inputpreorpost, other, lastmag):
+    return ['Date YYYY-MM-DDTHH:MM:SS', 'r (au)', other + ' (BLANK if you did not ask to calculate this value)', lastmag, inputpreorpost, 'mshift with dropped observers', 'Delta (au)', 'Phase Angle', 'residual of mshift from polyfit', 'Julian Date']
 
-    return_this_other_mag=[]
-    
-    if (sorted_stats[0] == 0) and (sorted_stats[1] ==0) and (sorted_stats[3]==0) and (sorted_stats[4]==0):
-        return_this_other_mag.append(0)
-    else:
-        for i in range(0,len(sorted_stats)):
-            return_this_other_mag.append(sorted_stats[i][28])
-        
-    return mshift, obs_list, sorted_stats, r_sorted_stat, new_poly_fit, original_poly_fit, stdev_resid_per_observer, mean_resid_per_observer, count_per_observer, residuals,  return_this_other_mag, mags_sorted_stat, resid_per_obs, condemned_list #return_this_other_mag used to be sorted_stats[28]
-
-#Assigns headers for output stats files
-def add_headers_stats(inputlist, inputpreorpost,other):
-    inputlist.insert(0, ['col 1-3 : short period comet designation'])
-    inputlist[0].append('col 4-9 : Standard comet designation')
-    inputlist[0].append('col 10 : multiple nuclei present?')
-    inputlist[0].append('col 12-15 : year observed')
-    inputlist[0].append('col 17-18 : month observed')
-    inputlist[0].append('col 20-24')
-    inputlist[0].append('col 26 : special note / extinction note')
-    inputlist[0].append('col 27 : Magnitude collection method')
-    inputlist[0].append('col 28-32 : visual magnitude estimate')
-    inputlist[0].append('col 33 : poor conditions?')
-    inputlist[0].append('col 34 - 35 : reference catalog')
-    inputlist[0].append('col 36-40 : instrument aperture in centimeters')
-    inputlist[0].append('col 41 : instrument type')
-    inputlist[0].append('col 42 - 43 : focal ratio')
-    inputlist[0].append('col 44-47 : magnification used')
-    inputlist[0].append('col 49 : error estimate for coma diameter')
-    inputlist[0].append('col 50 - 54 : coma diameter in arcminutes')
-    inputlist[0].append('col 55 : special note on central condensation of comet')
-    inputlist[0].append('col : 56 -57 : degree of condensation (note / means estimate)')
-    inputlist[0].append('col 59 - 64 : error of tail approximation and tail approximation')
-    inputlist[0].append('col 65 - 67 : direction tail is pointed')
-    inputlist[0].append('col 69-74 : ICQ reference publication')
-    inputlist[0].append('col 75 : second special note / extinction note ')
-    inputlist[0].append('col 76-80 : observer name')
-    inputlist[0].append('Date YYYY-MM-DDTHH:MM:SS')
-    inputlist[0].append(inputpreorpost)
-    inputlist[0].append('Delta (au)')
-    inputlist[0].append('Phase Angle')
-    inputlist[0].append(other)
-    inputlist[0].append('Julian Date')
-   
 class MultipleOffsetLocator(tickers.MultipleLocator):
 
     def __init__(self, base=1.0, offset=0.):
@@ -821,365 +1548,155 @@ class MultipleOffsetLocator(tickers.MultipleLocator):
         locs = self._offset + vmin - base + np.arange(n + 3) * base
         return self.raise_if_exceeds(locs)
    
-def main():
-    global metalist
-    global list_of_reasons_removed
-    global removed_metalist
-    global reasonForDelete
-    global to_report_r
-    global heliocentric_corrected_magnitudes
-    global phase_corrected_magnitudes
-    global dates_pds_format
-    global to_report_delta
-    global to_report_phase
-    global to_report_Julian
-    global dates_pds_format
-    global last_mag_calculated_sans_condemned_pre
-    global last_mag_calculated_sans_condemned_post
-    last_mag_calculated_sans_condemned_pre = []
-    last_mag_calculated_sans_condemned_post =[]
-    dates_pds_format = []
-    #Instantiates each element of metalist (i.e., each column in the input data).
-    metalist = []
-    shortperapparition = []        #metalist[0]
-    designation = []            #metalist[1]
-    splitnuc = []                #metalist[2]
-    yearobs = []                #metalist[3]
-    monthobs = []                #metalist[4]
-    dayobs = []                    #metalist[5]
-    speicalnotes = []            #metalist[6]
-    magmethod = []                #metalist[7]
-    mag = []                    #metalist[8]
-    poorconditions = []            #metalist[9]
-    referencecat = []            #metalist[10]
-    instaperture = []            #metalist[11]
-    insttype = []                #metalist[12]
-    focalratio = []                #metalist[13]
-    magnification = []            #metalist[14]
-    comadiamestimate = []        #metalist[15]
-    comadiameter = []            #metalist[16]
-    centralcondensation = []    #metalist[17]
-    degreeofcondensation = []    #metalist[18]
-    taillength = []                #metalist[19]
-    positionangleoftail = []    #metalist[20]
-    ICQPublication = []            #metalist[21]
-    specialnotestwo = []        #metalist[22]
-    obs = []                    #metalist[23]
-    removed = []
-    removed_reason = []
-    reasonForDelete = 0
-
-    list_of_reasons_removed = ["Two entries on the same date by same observer", "No magnitude reported", "Used reverse binocular observing method", "Poor Weather Reported", "Used a tier 3 or 4 Source Catalog", "Used a telescope under 5.5 magnitude", "Used binoculars under 3.3 magnitude", "Did not use a magnitude method reported by Green (i.e. column 27 not being S, B, M, I, or E), prioritizing S then M", "Bad Extinction Correction used", "Observer used SC Catalog for object dimmer than 8.1"]
-
-    #Reads in the 80 column format from ICQ or COBS data
-    for line in open(input_file, encoding='utf8').readlines():
-        shortperapparition.append(line[0:3].strip(' '))
-        designation.append(line[3:9].strip(' '))
-        splitnuc.append(line[9].strip(' '))
-        yearobs.append(line[11:15].strip(' '))
-        monthobs.append(line[16:18].strip(' '))
-        dayobs.append(line[19:24].strip(' '))
-        speicalnotes.append(line[25].strip(' '))
-        magmethod.append(line[26].strip(' '))
-        mag.append(line[28:32].strip(' '))
-        poorconditions.append(line[32].strip(' '))
-        referencecat.append(line[33:35].strip(' '))
-        instaperture.append(line[35:40].strip(' '))
-        insttype.append(line[40].strip(' '))
-        focalratio.append(line[41:43].strip(' '))
-        magnification.append(line[43:47].strip(' '))
-        comadiamestimate.append(line[48].strip(' '))
-        comadiameter.append(line[49:54].strip(' '))
-        centralcondensation.append(line[54].strip(' '))
-        degreeofcondensation.append(line[55:57].strip(' '))
-        taillength.append(line[58:63].strip(' '))
-        positionangleoftail.append(line[64:67].strip(' '))
-        ICQPublication.append(line[68:74].strip(' '))
-        specialnotestwo.append(line[74].strip(' '))
-        obs.append(line[75:80].strip(' '))
-
-    #Places each of the lists into one list for organization
-    metalist = [shortperapparition,designation,splitnuc,yearobs,monthobs,dayobs,speicalnotes,
-           magmethod,mag,poorconditions,referencecat,instaperture,insttype,focalratio,magnification,
-           comadiamestimate,comadiameter,centralcondensation,degreeofcondensation,
-           taillength,positionangleoftail,ICQPublication,specialnotestwo,obs]
-
-    removed_metalist = [[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[]]
 
-    #Total number of initial datapoints
-    print('initial number of points ', len(metalist[0]))
-          
-    #Removes data from metalist based on specific criteria
-    numdeltefornomagreported =0
-    reasonForDelete = 1
-    nomagreported(numdeltefornomagreported)
-
-    numdeletedforreversebinocmethod =0
-    reasonForDelete = 2
-    reversebinocular(numdeletedforreversebinocmethod)
-
-    numdeletedforpoorweather = 0
-    reasonForDelete = 3
-    poorweather(numdeletedforpoorweather)
-    
-    numdeletedforbadextinctioncorrection = 0
-    reasonForDelete = 8
-    badExtinctionCorrection(numdeletedforbadextinctioncorrection)
+#Runs the whole pipeline (sorting, then any corrections, statistics and plots asked for on the command line) on the observations
+#of one comet. sorted_batches are the kept observations, removed observations and reasons they were removed of each batch
+#of the input file (see filterbatches and cachedbatches), sorted with rules.
+def lightcurve(sorted_batches, rules):
+    global metatable
+
+    #Reads in the 80 column format from ICQ or COBS data and removes data based on specific criteria, batch_size lines at a time.
+    #Kept and removed points of each batch are written out right away, unless the kept points still need to be corrected.
+    #metatable holds every column of the kept data, see ICQ_COLUMNS for the name of each column (e.g., metatable['obs'] == observer for each observation)
+    #With --append the counts carry on from the last run and the output files are added to (see appendrun)
+    number_of_points = 0
+    number_kept = 0
+    removed_per_reason = np.zeros(len(list_of_reasons_removed), dtype=np.int64)
+    removed_offset = -1
+    if appending is not None:
+        number_of_points = int(appending['number_of_points'])
+        number_kept = int(appending['number_kept'])
+        removed_per_reason = appending['removed_per_reason']
+        removed_offset = int(appending['removed_offset'])
+    kept_batches = []
+    correcting = ("--heliocentric" in sys.argv) or ('--phase' in sys.argv)
+    prefetcher = None
+    if correcting and JPL_Prefetch and (cache_directory != '') and (ephemeris_provider == 'horizons'):
+        prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    with contextlib.ExitStack() as files:
+        #Outputs removed data points in separate csv along with reason it was deleted.
+        removed_file, removed_writer = opencsv(os.path.join(output_directory, output_file_rejected_points), removed_offset, ['Point removed', 'Reason Point was Removed'])
+        files.enter_context(removed_file)
+        #If you are not doing any further corrections to data then output "kept" points as is (with --append see write_keepers)
+        if (not correcting) and (appending is None):
+            kept_file, kept_writer = opencsv(os.path.join(output_directory, ouput_file_kept_points), -1, [])
+            files.enter_context(kept_file)
+        for kept, removed, reasons in sorted_batches:
+            number_of_points = number_of_points + len(kept) + len(removed)
+            number_kept = number_kept + len(kept)
+            removed_per_reason = removed_per_reason + np.bincount(reasons, minlength=len(list_of_reasons_removed))
+            prefetchephemerides(prefetcher, kept)
+            writerows(removed_writer, removed, [["REMOVED POINT"] * len(removed), [list_of_reasons_removed[y] for y in reasons.tolist()]])
+            if correcting or (appending is not None):
+                kept_batches.append(kept)
+            else:
+                writerows(kept_writer, kept, [])
+        #With --append the points kept by earlier runs that a new point of the same observer and night replaced are removed as well
+        if appending is not None:
+            winners = appending['pending'][0]
+            history = appendhistory()
+            moved = history[~np.isin(history['position'], winners['position'])]
+            reason = [reason for rule, reason, message in rules if rule is deleteForDuplicatedDates]
+            writerows(removed_writer, moved, [["REMOVED POINT"] * len(moved), [list_of_reasons_removed[reason[0]] if reason else ''] * len(moved)])
+            if reason:
+                removed_per_reason[reason[0]] = removed_per_reason[reason[0]] + number_kept - len(winners)
+            number_kept = len(winners)
+            appending['winners'] = winners
+            appending['removed_offset'] = removed_file.tell()
+    if prefetcher is not None:
+        prefetcher.shutdown(wait=False)
+    metatable = ObservationTable.concatenate(kept_batches)
+    if appending is not None:
+        metatable = metatable.with_columns(position=winners['position'][len(winners) - len(metatable):])
+        appending['number_of_points'] = number_of_points
+        appending['number_kept'] = number_kept
+        appending['removed_per_reason'] = removed_per_reason
+        if not correcting:
+            write_keepers(metatable, [], [])
 
-    numberremovedfortelescopeunder5_4 = 0
-    numberremovedforbinocularunder1_4 = 0
-    checkTelescopesandBinocMethods(numberremovedfortelescopeunder5_4, numberremovedforbinocularunder1_4)
+    #Total number of initial datapoints
+    print('initial number of points ', number_of_points)
+    for rule, reason, message in rules:
+        print(message + str(removed_per_reason[reason]))
 
-    numberremovedfornotspecifiedmagmethod = 0
-    if CCD_Bool == 1:
-        reasonForDelete = 7
-        removeForMagMethod(numberremovedfornotspecifiedmagmethod)
+    #How many points are left in our data after sorting out 'rejected' points
+    print("final remaining points " + str(number_kept))
+    #With --append and no new points to correct the statistics and plots are made again from the points corrected by earlier runs
+    if correcting and (len(metatable) == 0) and (appending is not None) and ('derived_r' in appending) and (len(appending['history']) != 0):
+        print('No new points to correct')
+        findperihelion(appending['derived_r'], appending['derived_julian'])
+        correcting = False
+    elif correcting and (len(metatable) == 0):
+        print('No points remaining to correct')
+        return
+
+    #Optional command line arguments --heliocentric and --phase to perform heliocentric corrections, phase corrections, or both to 'kept' data
+    #queryJPL will report an r, delta, and phase angle at every 30 minute increment in the ephemerides
+    #matchephemerides will then find the nearest 30 minute increment in the ephemerides to each point in the observation,
+    #and apply_corrections uses the delta and phase angle there to correct the magnitude of every point at once.
+    #With both, the phase correction is applied to the heliocentric corrected magnitudes.
+    if correcting:
+        helio = '--heliocentric' in sys.argv
+        phase = phase_models if '--phase' in sys.argv else []
+        if helio and phase:
+            print('Performing heliocentric and Phase Angle Corrections to the Data')
+            magnitude_headers = ['heliocentric corrected magnitudes (mhelio)', 'magnitudes with heliocentric and phase corrections applied (mph)']
+            magnitude_headers += ['magnitudes with heliocentric and ' + model + ' phase corrections applied (mph_' + model + ')' for model in phase[1:]]
+        elif helio:
+            print('Performing Heliocentric Corrections to the Data')
+            magnitude_headers = ['magnitdues with only geocentric correction (mhelio)']
+        else:
+            print('Performing Phase Angle Corrections to the Data')
+            magnitude_headers = ['magnitudes with only phase correction (mph*)']
+            magnitude_headers += ['magnitudes with only ' + model + ' phase correction (mph_' + model + '*)' for model in phase[1:]]
+        queryJPL()
+        nearest = matchephemerides()
+        ephem = {'r': OBJr[nearest], 'delta': OBJDelta[nearest], 'phase': OBJPhase[nearest], 'julian': OBJJulianDate[nearest]}
+        corrected = apply_corrections(metatable, ephem, helio=helio, phase=phase)
 
-    numberremovedforSCcatalog = 0
-    if CCD_Bool == 1:
-        reasonForDelete = 9
-        checkSCcatalog(numberremovedforSCcatalog)
+        #writes out the corrected data
+        metatable = metatable.with_columns(date=date_compare_to_JPL, **ephem, **corrected)
+        write_keepers(metatable, ['Heliocentric Distance (au)'] + magnitude_headers + ['Dates YYYY:MM:DDTHH:MM:SS', 'Delta (au)', 'Phase angle', 'Julian Date'], [ephem['r']] + list(corrected.values()) + [date_compare_to_JPL, ephem['delta'], ephem['phase'], ephem['julian']])
 
-    numdelforduplicatedate = 0
-    reasonForDelete = 0
-    deleteForDuplicatedDates(numdelforduplicatedate)
+    #With --append the statistics and plots are made from every point kept so far, not just the points of this run (see write_keepers)
+    if (appending is not None) and ('derived_r' in appending):
+        metatable = appendhistory()
 
-    #How many points are left in our data after sorting out 'rejected' points
-    print("final remaining points " + str(len(metalist[2])))        
-
-    #If you are not doing any further corrections to data then output "kept" points as is
-    if "--heliocentric" not in sys.argv and '--phase' not in sys.argv:
-        add_headers(metalist)
-        file_writer = csv.writer(open(ouput_file_kept_points, 'w'), delimiter =',')
-        for k in range (0,len(metalist[2])):
-            file_writer.writerow([metalist[0][k],metalist[1][k],metalist[2][k],metalist[3][k],metalist[4][k],metalist[5][k],metalist[6][k],metalist[7][k],metalist[8][k],metalist[9][k],metalist[10][k],metalist[11][k],metalist[12][k],metalist[13][k],metalist[14][k],metalist[15][k],metalist[16][k],metalist[17][k],metalist[18][k],metalist[19][k],metalist[20][k],metalist[21][k],metalist[22][k],metalist[23][k]])
-
-    #Outputs removed data points in separate csv along with reason it was deleted.
-    add_headers(removed_metalist)
-    removed_metalist[24].insert(0, 'Point removed')
-    removed_metalist[25].insert(0, 'Reason Point was Removed')
-        
-    file_writer = csv.writer(open(output_file_rejected_points, 'w'), delimiter =',')
-    for k in range (0,len(removed_metalist[2])):
-        file_writer.writerow([removed_metalist[0][k],removed_metalist[1][k],removed_metalist[2][k],removed_metalist[3][k],removed_metalist[4][k],removed_metalist[5][k],removed_metalist[6][k],removed_metalist[7][k],removed_metalist[8][k],removed_metalist[9][k],removed_metalist[10][k],removed_metalist[11][k],removed_metalist[12][k],removed_metalist[13][k],removed_metalist[14][k],removed_metalist[15][k],removed_metalist[16][k],removed_metalist[17][k],removed_metalist[18][k],removed_metalist[19][k],removed_metalist[20][k],removed_metalist[21][k],removed_metalist[22][k],removed_metalist[23][k], removed_metalist[24][k], removed_metalist[25][k]])    
-        
-    #Optional command line argument --heliocentric to perform just heliocentric corrections to 'kept' data
-    if "--heliocentric" in sys.argv and '--phase' not in sys.argv:
-        print('Performing Heliocentric Corrections to the Data')
-        queryJPL()
-        heliocentric_corrected_magnitudes = []
-        to_report_delta = []
-        to_report_r = []
-        to_report_phase = []
-        to_report_Julian = []
-        #queryJPL will report an r, delta, and phase angle at every 30 minute increment in the ephemerides
-        #It will also take each date/time of an observation in the dataset and convert it to YYYY:MM:DD HH:MM:SS format.
-        #The next few lines will compare the date/time of each point in the observation and find the nearest 30 minute increment in the ephemerides
-        #It will then take the delta at that nearest increment and use it to apply a heliocentric correction to the magnitude,
-        #and repeat this for each point in the data.
-        for i in range (0, len(date_compare_to_JPL)):
-            for j in range(0, len(OBJDates)):
-                if (date_compare_to_JPL[i][0:4] == OBJDates[j][0:4]) and (date_compare_to_JPL[i][5:7] == OBJDates[j][5:7]) and (date_compare_to_JPL[i][8:10] == OBJDates[j][8:10]) and (date_compare_to_JPL[i][11:13] == OBJDates[j][11:13]) and ((JPL_Time_Increment*round(float(date_compare_to_JPL[i][14:16])/JPL_Time_Increment))%60 == float(OBJDates[j][14:16])):
-                    heliocentric_corrected_magnitudes.append(str(float(metalist[8][i]) - 5 * float(math.log10(OBJDelta[j]))))
-                    to_report_r.append(OBJr[j])
-                    to_report_delta.append(OBJDelta[j])
-                    to_report_phase.append(OBJPhase[j])
-                    to_report_Julian.append(OBJJulianDate[j])
-                    continue
-        for k in range(0,len(date_compare_to_JPL)):
-            dates_pds_format.append(date_compare_to_JPL[k].replace(" ","T"))
-            
-        #writes out final heliocentric corrected data.
-        add_headers(metalist)
-        to_report_r.insert(0, 'Heliocentric Distance (au)')
-        dates_pds_format.insert(0, 'Dates YYYY:MM:DDTHH:MM:SS')
-        to_report_delta.insert(0, 'Delta (au)')
-        to_report_phase.insert(0, 'Phase angle')
-        to_report_Julian.insert(0, 'Julian Date')
-        heliocentric_corrected_magnitudes.insert(0, 'magnitdues with only geocentric correction (mhelio)')
-        file_writer = csv.writer(open(ouput_file_kept_points, 'w'), delimiter =',')
-        for k in range (0,len(metalist[2])):
-            file_writer.writerow([metalist[0][k],metalist[1][k],metalist[2][k],metalist[3][k],metalist[4][k],metalist[5][k],metalist[6][k],metalist[7][k],metalist[8][k],metalist[9][k],metalist[10][k],metalist[11][k],metalist[12][k],metalist[13][k],metalist[14][k],metalist[15][k],metalist[16][k],metalist[17][k],metalist[18][k],metalist[19][k],metalist[20][k],metalist[21][k],metalist[22][k],metalist[23][k], to_report_r[k], heliocentric_corrected_magnitudes[k], dates_pds_format[k], to_report_delta[k], to_report_phase[k], to_report_Julian[k]])
-
-    #Optional command line argument --phase to perform just phase corrections to 'kept' data
-    if '--phase' in sys.argv and '--heliocentric' not in sys.argv:
-        print('Performing Phase Angle Corrections to the Data')
-        queryJPL()
-        phase_corrected_magnitudes = []
-        to_report_delta = []
-        to_report_r = []
-        to_report_phase = []
-        to_report_Julian = []
-        #queryJPL will report an r, delta, and phase angle at every 30 minute increment in the ephemerides
-        #It will also take each date/time of an observation in the dataset and convert it to YYYY:MM:DD HH:MM:SS format.
-        #The next few lines will compare the date/time of each point in the observation and find the nearest 30 minute increment in the ephemerides
-        #It will also read in Schleicher's composite phse function which has inputs at every whole number degree.
-        #It will then take the phase at that nearest increment, round it to the nearest whole number, compare that to Shcleicher's data to get the
-        #composite phase function normalized to 0 degrees, and use that to calculate the phase corrected magnitudes.
-        #This is repeated for each point in the data.
-        with open('Schleicher_Composite_Phase_Function.txt') as f:
-            lines1 = f.readlines()
-            phase_angles = [line.split()[0] for line in lines1]
-            deg_0_normalized = [float(line.split()[1]) for line in lines1]
-        for i in range(0, len(date_compare_to_JPL)):
-            for j in range(0, len(OBJPhase)):
-                if (date_compare_to_JPL[i][0:4] == OBJDates[j][0:4]) and (date_compare_to_JPL[i][5:7] == OBJDates[j][5:7]) and (date_compare_to_JPL[i][8:10] == OBJDates[j][8:10]) and (date_compare_to_JPL[i][11:13] == OBJDates[j][11:13]) and ((JPL_Time_Increment*round(float(date_compare_to_JPL[i][14:16])/JPL_Time_Increment))%60 == float(OBJDates[j][14:16])):
-                    to_report_r.append(OBJr[j])
-                    to_report_delta.append(OBJDelta[j])
-                    to_report_phase.append(OBJPhase[j])
-                    to_report_Julian.append(OBJJulianDate[j])
-                    for l in range (0, len(phase_angles)):
-                        if (round(float(OBJPhase[j])) == float(phase_angles[l])):
-                            phase_corrected_magnitudes.append(str(float(metalist[8][i]) + 2.5 * float(math.log10(deg_0_normalized[l]))))
-                            continue
-                
-        for k in range(0,len(date_compare_to_JPL)):
-            dates_pds_format.append(date_compare_to_JPL[k].replace(" ","T"))
-                
-        #writes out final phase corrected data
-        add_headers(metalist)
-        to_report_r.insert(0, 'Heliocentric Distance (au)')
-        dates_pds_format.insert(0, 'Dates YYYY:MM:DDTHH:MM:SS')
-        to_report_delta.insert(0, 'Delta (au)')
-        to_report_phase.insert(0, 'Phase angle')
-        to_report_Julian.insert(0, 'Julian Date')
-        phase_corrected_magnitudes.insert(0, 'magnitudes with only phase correction (mph*)')
-        file_writer = csv.writer(open(ouput_file_kept_points, 'w'), delimiter =',')
-        for k in range (0,len(metalist[2])):
-            file_writer.writerow([metalist[0][k],metalist[1][k],metalist[2][k],metalist[3][k],metalist[4][k],metalist[5][k],metalist[6][k],metalist[7][k],metalist[8][k],metalist[9][k],metalist[10][k],metalist[11][k],metalist[12][k],metalist[13][k],metalist[14][k],metalist[15][k],metalist[16][k],metalist[17][k],metalist[18][k],metalist[19][k],metalist[20][k],metalist[21][k],metalist[22][k],metalist[23][k], to_report_r[k], phase_corrected_magnitudes[k], dates_pds_format[k], to_report_delta[k], to_report_phase[k], to_report_Julian[k]])
-    
-    #Performs a heliocentric correction to the raw data and then a phase correction to the heliocentric corrected data
-    #See the above two blocks to understand how the heliocentric and phase corrections work
-    if '--heliocentric' in sys.argv and '--phase' in sys.argv:
-        print('Performing heliocentric and Phase Angle Corrections to the Data')
-        queryJPL()
-        heliocentric_corrected_magnitudes = []
-        phase_corrected_magnitudes = []
-        to_report_r = []
-        to_report_delta = []
-        to_report_phase = []
-        to_report_Julian = []
-        with open('Schleicher_Composite_Phase_Function.txt') as f:
-            lines1 = f.readlines()
-            phase_angles = [line.split()[0] for line in lines1]
-            deg_0_normalized = [float(line.split()[1]) for line in lines1]
-        for i in range (0, len(date_compare_to_JPL)):
-            for j in range(0, len(OBJDates)):
-                if (date_compare_to_JPL[i][0:4] == OBJDates[j][0:4]) and (date_compare_to_JPL[i][5:7] == OBJDates[j][5:7]) and (date_compare_to_JPL[i][8:10] == OBJDates[j][8:10]) and (date_compare_to_JPL[i][11:13] == OBJDates[j][11:13]) and ((JPL_Time_Increment*round(float(date_compare_to_JPL[i][14:16])/JPL_Time_Increment))%60 == float(OBJDates[j][14:16])):
-                    to_report_r.append(OBJr[j])
-                    to_report_delta.append(OBJDelta[j])
-                    to_report_phase.append(OBJPhase[j])
-                    to_report_Julian.append(OBJJulianDate[j])
-                    heliocentric_corrected_magnitudes.append(str(float(metalist[8][i]) - 5. * float(math.log10(OBJDelta[j]))))
-                    for l in range (0, len(phase_angles)):
-                        if (round(float(OBJPhase[j])) == float(phase_angles[l])):
-                            phase_corrected_magnitudes.append(str(float(heliocentric_corrected_magnitudes[i]) + 2.5 * float(math.log10(deg_0_normalized[l]))))
-
-        for k in range(0,len(date_compare_to_JPL)):
-            dates_pds_format.append(date_compare_to_JPL[k].replace(" ","T"))
-        #writes out the heliocentric and phase corrected magnitudes
-        add_headers(metalist)
-        to_report_r.insert(0, 'Heliocentric Distance (au)')
-        heliocentric_corrected_magnitudes.insert(0, 'heliocentric corrected magnitudes (mhelio)')
-        phase_corrected_magnitudes.insert(0, 'magnitudes with heliocentric and phase corrections applied (mph)')
-        dates_pds_format.insert(0, 'Dates YYYY:MM:DDTHH:MM:SS')
-        to_report_delta.insert(0, 'Delta (au)')
-        to_report_phase.insert(0, 'Phase angle')
-        to_report_Julian.insert(0, 'Julian Date')
-        file_writer = csv.writer(open(ouput_file_kept_points, 'w'), delimiter =',')
-        for k in range (0,len(metalist[2])):
-            file_writer.writerow([metalist[0][k],metalist[1][k],metalist[2][k],metalist[3][k],metalist[4][k],metalist[5][k],metalist[6][k],metalist[7][k],metalist[8][k],metalist[9][k],metalist[10][k],metalist[11][k],metalist[12][k],metalist[13][k],metalist[14][k],metalist[15][k],metalist[16][k],metalist[17][k],metalist[18][k],metalist[19][k],metalist[20][k],metalist[21][k],metalist[22][k],metalist[23][k], to_report_r[k], heliocentric_corrected_magnitudes[k], phase_corrected_magnitudes[k], dates_pds_format[k], to_report_delta[k], to_report_phase[k], to_report_Julian[k]])
-        
     #Performs all statistical corrections outlined in 'Statistics_method_appendix.txt' in GitHub repository
-    #All TRY-EXCEPT blocks are case scenarios depending on whether the user calculated mph, mehlio, or both.
+    #The corrected magnitudes are looked up in metatable depending on whether the user calculated mph, mehlio, or both.
     if '--stats' in sys.argv:
-        last_mag_calculated = []
         pre_condemned_obs = []
         post_condemned_obs = []
-        other_mag = []
         magsfound = 0     #checks what was last magnitude calculated (either mph or mhelio depending on if user calculated one, neither, or both)
-        first_pass = 1
         other = ''
-        try:
-            if magsfound == 0:
-                last_mag_calculated = phase_corrected_magnitudes
-                print('Will perform statistical corrections on Phase Corrected Magnitudes')
-                magsfound = 'mph'
-                try:
-                    other = 'mhelio'
-                    other_mag = heliocentric_corrected_magnitudes
-                    try:
-                        float(other_mag[0])
-                    except:
-                        del other_mag[0]
-                except:
-                    pass
-        except:
+        if 'mph' in metatable:
+            print('Will perform statistical corrections on Phase Corrected Magnitudes')
+            magsfound = 'mph'
+            other = 'mhelio'
+        else:
             print('Searching for heliocentric corrected magnitudes...')
-            
-        try:
-            if magsfound == 0:
-                last_mag_calculated = heliocentric_corrected_magnitudes
-                print('Will perform statistical corrections on Heliocentric Corrected Magnitudes')
-                magsfound = 'mhelio'
-                try:
-                    other = 'mph'
-                    other_mag = phase_corrected_magnitudes
-                    try:
-                        float(other_mag[0])
-                    except:
-                        del other_mag[0]
-                except:
-                    pass
-        except:
+
+        if (magsfound == 0) and ('mhelio' in metatable):
+            print('Will perform statistical corrections on Heliocentric Corrected Magnitudes')
+            magsfound = 'mhelio'
+            other = 'mph'
+        elif magsfound == 0:
             print('Searching for raw magnitudes...')
-            
+
         if magsfound == 0:
             print('Please run either --heliocentric or --phase or both to perform statistical corrections')
-            
-        #deleting headers now so we dont have to worry about them in the stats function
-        del last_mag_calculated[0]
-        del to_report_r[0]
-        del to_report_delta[0]
-        del to_report_phase[0]
-        del to_report_Julian[0]
-        del dates_pds_format[0]
-        deletearow(0)
-        
-        #print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')    
-        
-        
-        peridate = time.strptime(perihelion, "%Y/%m/%d")
-        tmp_obs_pre = []
-        count_pre = []
-        tmp_obs_post = []
-        count_post = []
-        
-        for j in range(0,len(metalist[0])):
-            check_date = str(metalist[3][j]) + "/" + str(metalist[4][j]) + "/" + str(math.floor(float(metalist[5][j])))
-            newdate2 = time.strptime(check_date, "%Y/%m/%d")
-            if newdate2 <= peridate:
-                if metalist[23][j] not in tmp_obs_pre:
-                    tmp_obs_pre.append(metalist[23][j].strip())
-                    count_pre.append(0)
-            if newdate2 > peridate:
-                if metalist[23][j] not in tmp_obs_post:
-                    tmp_obs_post.append(metalist[23][j].strip())
-                    count_post.append(0)
-                    
-        for j in range(0,len(metalist[0])):
-            check_date = str(metalist[3][j]) + "/" + str(metalist[4][j]) + "/" + str(math.floor(float(metalist[5][j])))
-            newdate2 = time.strptime(check_date, "%Y/%m/%d")
-            for o in range(0,len(tmp_obs_pre)):
-                if (metalist[23][j] == tmp_obs_pre[o]) and (newdate2 < peridate):
-                    count_pre[o] = count_pre[o] + 1
-                    continue
-        for j in range(0,len(metalist[0])):
-            check_date = str(metalist[3][j]) + "/" + str(metalist[4][j]) + "/" + str(math.floor(float(metalist[5][j])))
-            newdate2 = time.strptime(check_date, "%Y/%m/%d")
-            for o in range(0,len(tmp_obs_post)):
-                if(metalist[23][j] == tmp_obs_post[o]) and (newdate2 >= peridate):
-                    count_post[o] = count_post[o] + 1
+            sys.exit()
+
+        #print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
+
+        #Observers with fewer than 20 points before (or after) perihelion are condemned before any polynomial fits are made
+        peridate = perihelionkey()
+        obs_dates = datekeys(metatable)
+        observers = np.array(metatable.text('obs'))
+        tmp_obs_pre = list(dict.fromkeys(observers[obs_dates <= peridate].tolist()))
+        tmp_obs_post = list(dict.fromkeys(observers[obs_dates > peridate].tolist()))
+        count_pre = [np.count_nonzero((observers == o) & (obs_dates < peridate)) for o in tmp_obs_pre]
+        count_post = [np.count_nonzero((observers == o) & (obs_dates >= peridate)) for o in tmp_obs_post]
         for o in range(0, len(count_pre)):
             if count_pre[o] < 20:
                 pre_condemned_obs.append(tmp_obs_pre[o])
@@ -1187,31 +1704,26 @@ def main():
             if count_post[o] < 20:
                 post_condemned_obs.append(tmp_obs_post[o])
 
-        # ind_obs = []
-        # for q in range(0,len(metalist[23])):
-            # if metalist[23][q] not in ind_obs:
-                # ind_obs.append(metalist[23][q])
         #print(post_condemned_obs, len(post_condemned_obs))
         #print(pre_condemned_obs, len(pre_condemned_obs))
         #print(tmp_obs_post,len(tmp_obs_post))
         #print(tmp_obs_pre,len(tmp_obs_pre))
-        
+
         #Initializes and defines pre-perihelion statistical outputs
-        pre_mshift = []  
-        pre_r = []        
-        pre_meta = []   
-        pre_final_polyfit = [] 
-        pre_final_stdevs = []    
-        pre_last_mag_correction = []    
-        pre_original_polyfit = []    
-        pre_obs_list = []   
-        pre_final_mean_resid = []    
+        pre_mshift = []
+        pre_r = []
+        pre_meta = []
+        pre_final_polyfit = []
+        pre_final_stdevs = []
+        pre_last_mag_correction = []
+        pre_original_polyfit = []
+        pre_obs_list = []
+        pre_final_mean_resid = []
         pre_count_per_obs = []
-        pre_other_mag = []
         pre_last_mag_calculated = []
-        pre_mshift, pre_obs_list, pre_meta, pre_r,  pre_final_polyfit, pre_original_polyfit, pre_final_stdevs, pre_final_mean_resid, pre_count_per_obs, pre_last_mag_correction, pre_other_mag, pre_last_mag_calculated, pre_resid_per_obs, pre_condemned_obs= stats_shifts('pre', metalist, last_mag_calculated, dates_pds_format, to_report_delta, to_report_phase, to_report_r,pre_condemned_obs, other_mag, first_pass, to_report_Julian)
+        pre_mshift, pre_obs_list, pre_meta, pre_r,  pre_final_polyfit, pre_original_polyfit, pre_final_stdevs, pre_final_mean_resid, pre_count_per_obs, pre_last_mag_correction, pre_last_mag_calculated, pre_resid_per_obs, pre_condemned_obs= stats_shifts('pre', metatable, magsfound, pre_condemned_obs)
         #print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
-        
+
         #Initializes and defines post-perihelion statistical outputs
         post_mshift = []
         post_r = []
@@ -1223,13 +1735,9 @@ def main():
         post_final_mean_resid = []
         post_obs_list = []
         post_count_per_obs = []
-        post_other_mag = []
         post_last_mag_calculated =[]
-        post_mshift, post_obs_list, post_meta, post_r,  post_final_polyfit, post_original_polyfit, post_final_stdevs, post_final_mean_resid, post_count_per_obs, post_last_mag_correction, post_other_mag, post_last_mag_calculated, post_resid_per_obs, post_condemned_obs= stats_shifts('post',  metalist, last_mag_calculated, dates_pds_format, to_report_delta, to_report_phase, to_report_r,post_condemned_obs, other_mag,first_pass, to_report_Julian)    
-        
-        #sets this to 0 so that if we need to run stats_shifts again then we wont accidentally log the r-values again
-        first_pass = 0
-        
+        post_mshift, post_obs_list, post_meta, post_r,  post_final_polyfit, post_original_polyfit, post_final_stdevs, post_final_mean_resid, post_count_per_obs, post_last_mag_correction, post_last_mag_calculated, post_resid_per_obs, post_condemned_obs= stats_shifts('post', metatable, magsfound, post_condemned_obs)
+
         #Block begins to perform stationary t-test and two tail probability test. This block is for pre-perihelion t-test
         #terminate iterations = 0 means at least one observer failed the t-test, so we must reconverge a polynomial fit (i.e., run stats_shifts) with their data removed
         #number_t_pre keeps track of how many times we have at least one observer fail a t-test on a given iteration
@@ -1239,20 +1747,17 @@ def main():
             drop_observers = 0
             thismagsfound = magsfound
             p_func = np.poly1d(pre_final_polyfit)
+            pre_observers = pre_meta.text('obs')
             for o in range (0, len(pre_obs_list)):
                 N1 = []
                 N2 = []
-                mean_1 = 0
-                mean_2 = 0
-                sum_1 = 0
-                sum_2 = 0
                 for i in range (0, len(pre_r)):
-                    if pre_meta[i][23] == pre_obs_list[o]:
+                    if pre_observers[i] == pre_obs_list[o]:
                         if len(N1) < math.floor(pre_count_per_obs[o] /2):
                             N1.append(p_func(pre_r[i]) - pre_mshift[i])
                         else:
                             N2.append(p_func(pre_r[i]) - pre_mshift[i])
-                
+
                 #returns t-statistic and corresponding p-statistics
                 t2, p2 = stats.ttest_ind(N1, N2, equal_var = False)
                 #print(pre_obs_list[o], ' t = ',t2,' p = ', p2)
@@ -1260,49 +1765,25 @@ def main():
                 if p2 < 0.05:
                     drop_observers = 1
                     pre_condemned_obs.append(pre_obs_list[o].strip())
-            #If we did deleted one observer, prepare their data to be in write format for stats_shifts and then rerun stats_shifts
+            #If we did deleted one observer, rerun stats_shifts on the same (sorted) observations
             #i.e., one observer failed the stationary test so we reconverge the polynomial fit / mshift values without the bias from their data present
             if drop_observers ==1:
-                tmp = []
-                last_mag_calculated_sans_condemned_pre = []
-                for z in range(0,len(pre_last_mag_calculated)):
-                    last_mag_calculated_sans_condemned_pre.append(pre_last_mag_calculated[z])
-                #print(len(last_mag_calculated_sans_condemned_pre))
-                for h in range (len(pre_last_mag_calculated)-1, -1, -1):
-                    if pre_meta[h][23] in pre_condemned_obs:
-                        del pre_last_mag_calculated[h]
-                for i in range(0,len(pre_meta[1])):
-                    for j in range(0,len(pre_meta)):
-                        if j == 0:
-                            tmp.append([])
-                        tmp[i].append(pre_meta[j][i])
-                tmp_dates = tmp[24]
-                tmp_deltas = tmp[26]
-                tmp_phase = tmp[27]
-                tmp_other_mags = tmp[28]
-                tmp_julian = tmp[29]
-                del tmp[29]
-                del tmp[28]
-                del tmp[27]
-                del tmp[26]
-                del tmp[25]
-                del tmp[24]
                 number_t_pre = number_t_pre +1
                 #print('###########################################################################################')
                 #print('PRE: THE FOLLOWING OBSERVERS WERE REJECTED BY T-TEST: ')
                 #print(pre_condemned_obs)
                 #print('DROPPING THESE OBSERVERS AND REPEATING THE ITERATIVE PROCESS')
                 #print('###########################################################################################')
-                
+
                 if(len(pre_condemned_obs) == len(tmp_obs_pre)):
                     kicked_all_obs_pre = 1
                 if(len(post_condemned_obs) == len(tmp_obs_post)):
                     kicked_all_obs_post = 1
-                    
-                pre_mshift, pre_obs_list, pre_meta, pre_r,  pre_final_polyfit, pre_original_polyfit, pre_final_stdevs, pre_final_mean_resid, pre_count_per_obs, pre_last_mag_correction,pre_other_mag, tmp, pre_resid_per_obs, pre_condemned_obs = stats_shifts('pre', tmp, last_mag_calculated_sans_condemned_pre, tmp_dates, tmp_deltas, tmp_phase, pre_r, pre_condemned_obs, tmp_other_mags, first_pass, tmp_julian)
+
+                pre_mshift, pre_obs_list, pre_meta, pre_r,  pre_final_polyfit, pre_original_polyfit, pre_final_stdevs, pre_final_mean_resid, pre_count_per_obs, pre_last_mag_correction, pre_last_mag_calculated, pre_resid_per_obs, pre_condemned_obs = stats_shifts('pre', pre_meta, magsfound, pre_condemned_obs)
             else:
                 terminate_iterations = 1
-        
+
         #Repeats the above t- and p-tests for Post-perihelion data
         terminate_iterations = 0
         number_t_post = 0
@@ -1311,111 +1792,64 @@ def main():
             drop_observers = 0
             thismagsfound = magsfound
             p_func = np.poly1d(post_final_polyfit)
+            post_observers = post_meta.text('obs')
             for o in range (0, len(post_obs_list)):
                 N1 = []
                 N2 = []
-                mean_1 = 0
-                mean_2 = 0
-                sum_1 = 0
-                sum_2 = 0
                 for i in range (0, len(post_r)):
-                    if post_meta[i][23] == post_obs_list[o]:
+                    if post_observers[i] == post_obs_list[o]:
                         if len(N1) < math.floor(post_count_per_obs[o] /2):
                             N1.append(p_func(post_r[i]) - post_mshift[i])
                         else:
                             N2.append(p_func(post_r[i]) - post_mshift[i])
-            
+
                 t2, p2 = stats.ttest_ind(N1, N2, equal_var = False)
                 #print(post_obs_list[o], ' t = ', t2,' p = ', p2) #t1, 2*p1)
                 if p2 < 0.05:
                     drop_observers = 1
                     post_condemned_obs.append(post_obs_list[o].strip())
             if drop_observers ==1:
-                last_mag_calculated_sans_condemned_post = []
-                for z in range(0,len(post_last_mag_calculated)):
-                    last_mag_calculated_sans_condemned_post.append(post_last_mag_calculated[z])
-                #print(len(last_mag_calculated_sans_condemned_post))
-                for h in range (len(post_last_mag_calculated)-1, -1, -1):
-                    if post_meta[h][23] in post_condemned_obs:
-                        del post_last_mag_calculated[h]
-                tmp = []
-                for i in range(0,len(post_meta[1])):
-                    for j in range(0,len(post_meta)):
-                        if j == 0:
-                            tmp.append([])
-                        tmp[i].append(post_meta[j][i])
-                tmp_dates = tmp[24]
-                tmp_deltas = tmp[26]
-                tmp_phase = tmp[27]
-                tmp_other_mags = tmp[28]
-                tmp_julian = tmp[29]
-                del tmp[29]
-                del tmp[28]
-                del tmp[27]
-                del tmp[26]
-                del tmp[25]
-                del tmp[24]
-                last_mag_calculated_sans_condemned = []
+                number_t_post = number_t_post +1
                 #print('#################################################################################')
                 #print('POST: THE FOLLOWING OBSERVERS WERE REJECTED BY T-TEST: ')
                 #print(post_condemned_obs)
                 #print('DROPPING THESE OBSERVERS AND REPEATING THE ITERATIVE PROCESS FOR POSTPERIHELION')
                 #print('#################################################################################')
-                
+
                 if(len(pre_condemned_obs) == len(tmp_obs_pre)):
                     kicked_all_obs_pre = 1
                 if(len(post_condemned_obs) == len(tmp_obs_post)):
                     kicked_all_obs_post = 1
-                post_mshift, post_obs_list, post_meta, post_r,  post_final_polyfit, post_original_polyfit, post_final_stdevs, post_final_mean_resid, post_count_per_obs, post_last_mag_correction,post_other_mag, tmp, post_resid_per_obs, post_condemned_obs = stats_shifts('post', tmp, last_mag_calculated_sans_condemned_post, tmp_dates, tmp_deltas, tmp_phase, post_r, post_condemned_obs, tmp_other_mags, first_pass, tmp_julian)
+                post_mshift, post_obs_list, post_meta, post_r,  post_final_polyfit, post_original_polyfit, post_final_stdevs, post_final_mean_resid, post_count_per_obs, post_last_mag_correction, post_last_mag_calculated, post_resid_per_obs, post_condemned_obs = stats_shifts('post', post_meta, magsfound, post_condemned_obs)
             else:
                 terminate_iterations = 1
-                
-                
+
+
         #print(number_t_pre, 'pre t tests', number_t_post, 'post t tests')
         #print('PRE: observers who failed t-test and were removed: ', pre_condemned_obs)
-        #print('POST: observers who failed t-test and were removed: ', post_condemned_obs)                
-    
-        #Adds headers and writes out pre-perihelion data to file 'pre-stats.csv'
-        if (len(pre_meta) != 0) and (pre_meta[0] != 0):
+        #print('POST: observers who failed t-test and were removed: ', post_condemned_obs)
+
+        #Writes out pre-perihelion data to file 'pre-stats.csv', pre-perihelion r-values are written as negative numbers
+        if len(pre_meta) != 0:
             magsfound = 'mshift (no dropped observers)'
-            add_headers_stats(pre_meta, magsfound,other)
-            if type(pre_r) != list:
-                pre_r = pre_r.tolist()
-            pre_r.insert(0, 'r (au)')
-            pre_last_mag_calculated.insert(0, thismagsfound)
-            pre_last_mag_correction.insert(0, 'residual of mshift from polyfit')
-            pre_meta[0][28] = other + ' (BLANK if you did not ask to calculate this value)'
-            pre_mshift.insert(0, 'mshift with dropped observers')
-            file_writer = csv.writer(open('pre-stats.csv', 'w'), delimiter =',')
-            for m in range (1, len(pre_r)):
-                pre_r[m] = str((-1.0)*10**(float(pre_r[m])))
-            for k in range (0,len(pre_meta)):
-                file_writer.writerow([pre_meta[k][0],pre_meta[k][1],pre_meta[k][2],pre_meta[k][3],pre_meta[k][4],pre_meta[k][5],pre_meta[k][6],pre_meta[k][7],pre_meta[k][8],pre_meta[k][9],pre_meta[k][10],pre_meta[k][11],pre_meta[k][12],pre_meta[k][13],pre_meta[k][14],pre_meta[k][15],pre_meta[k][16],pre_meta[k][17],pre_meta[k][18],pre_meta[k][19],pre_meta[k][20],pre_meta[k][21],pre_meta[k][22],pre_meta[k][23], pre_meta[k][24],pre_r[k],pre_meta[k][28], pre_last_mag_calculated[k], pre_meta[k][25], pre_mshift[k], pre_meta[k][26], pre_meta[k][27], pre_last_mag_correction[k], pre_meta[k][29]])    
+            pre_other_mag = pre_meta[other] if other in pre_meta else [''] * len(pre_meta)
+            pre_r_au = [str((-1.0)*10**(float(x))) for x in pre_r]
+            write_table(os.path.join(output_directory, 'pre-stats.csv'), pre_meta, stats_headers(magsfound, other, thismagsfound), [pre_meta['date'], pre_r_au, pre_other_mag, pre_last_mag_calculated, pre_meta[thismagsfound], pre_mshift, pre_meta['delta'], pre_meta['phase'], pre_last_mag_correction, pre_meta['julian']])
         else:
             print('No preperihelion data to perform statistics on')
             #print('##########################################################################################')
 
-        #Adds headers and writes out post-perihelion data to file 'post-stats.csv'
-        if (len(post_meta) != 0) and (post_meta[0] != 0):
+        #Writes out post-perihelion data to file 'post-stats.csv'
+        if len(post_meta) != 0:
             magsfound = 'mshift (no dropped observers)'
-            add_headers_stats(post_meta, magsfound,other)
-            if type(post_r) != list:
-                post_r = post_r.tolist()
-            post_r.insert(0, 'r (au)')
-            post_last_mag_calculated.insert(0, thismagsfound)
-            post_last_mag_correction.insert(0, 'residual of mshift from polyfit')
-            post_meta[0][28] = other + ' (BLANK if you did not ask to calculate this value)'
-            post_mshift.insert(0, 'mshift with dropped observers')
-            file_writer = csv.writer(open('post-stats.csv', 'w'), delimiter =',')
-            for m in range (1, len(post_r)):
-                post_r[m] = str(10**(float(post_r[m])))
-            for k in range (0,len(post_meta)):
-                file_writer.writerow([post_meta[k][0],post_meta[k][1],post_meta[k][2],post_meta[k][3],post_meta[k][4],post_meta[k][5],post_meta[k][6],post_meta[k][7],post_meta[k][8],post_meta[k][9],post_meta[k][10],post_meta[k][11],post_meta[k][12],post_meta[k][13],post_meta[k][14],post_meta[k][15],post_meta[k][16],post_meta[k][17],post_meta[k][18],post_meta[k][19],post_meta[k][20],post_meta[k][21],post_meta[k][22],post_meta[k][23], post_meta[k][24],post_r[k],post_meta[k][28],post_last_mag_calculated[k], post_meta[k][25], post_mshift[k], post_meta[k][26], post_meta[k][27], post_last_mag_correction[k], post_meta[k][29]])    
+            post_other_mag = post_meta[other] if other in post_meta else [''] * len(post_meta)
+            post_r_au = [str(10**(float(x))) for x in post_r]
+            write_table(os.path.join(output_directory, 'post-stats.csv'), post_meta, stats_headers(magsfound, other, thismagsfound), [post_meta['date'], post_r_au, post_other_mag, post_last_mag_calculated, post_meta[thismagsfound], post_mshift, post_meta['delta'], post_meta['phase'], post_last_mag_correction, post_meta['julian']])
         else:
             print('No postperihelion data to perform statistics on')
             #print('###########################################################################################')
 
-    #Plots all available data. That is, any combination of mraw, mhelio, mph, and mshifts depending on 
+    #Plots all available data. That is, any combination of mraw, mhelio, mph, and mshifts depending on
     #which combination of those the user has calculated (i.e., running --heliocentric --shifts will only plot mraw, mhelio, and mshift).
     #All if statements and TRY - EXCEPT blocks are checks
     #for each possible scenario.
@@ -1424,7 +1858,7 @@ def main():
         if ('--heliocentric' not in sys.argv) and ('--phase' not in sys.argv):
             print('Please perform --heliocentric, --phase, or both before attempting to plot')
             sys.exit()
-            
+
         mags_to_plot_meta = []
         max_x_values = []
         min_x_values = []
@@ -1435,19 +1869,13 @@ def main():
         titles = []
         axis = []
         count = 0
-                
-        if '--stats' not in sys.argv:
-            deletearow(0)
-            del to_report_r[0]
-        for j in range(0, len(to_report_r)):
-            newdate4 = time.strptime(perihelion, "%Y/%m/%d")
-            datetocheck = str(metalist[3][j]) + "/" + str(metalist[4][j]) + "/" + str(math.floor(float(metalist[5][j])))
-            newdate5 = time.strptime(datetocheck, "%Y/%m/%d")
-            if (newdate5 <= newdate4):
-                to_report_r[j] = float(-1. * to_report_r[j])
-            
+
+        #pre-perihelion r-values are plotted as negative numbers
+        signed_r = np.array(metatable['r'], dtype=float)
+        signed_r[datekeys(metatable) <= perihelionkey()] *= -1.
+
         try:
-            tmpmeta, tmp_mags, tmp_r = sortbyr(metalist,to_report_r,metalist[8],1)
+            tmpmeta, tmp_mags, tmp_r = sortbyr(metatable,signed_r,metatable['mag'],1)
             for i in range (0, len(tmp_mags)):
                 tmp_mags[i] = float(tmp_mags[i])
                 tmp_r[i] = float(tmp_r[i])
@@ -1459,13 +1887,9 @@ def main():
             axis.append('mraw')
         except:
             print('Please perform --heliocentric, --phase, or both before plotting')
-            
+
         try:
-            try:
-                float(heliocentric_corrected_magnitudes[0])
-            except:
-                del heliocentric_corrected_magnitudes[0]
-            tmpmeta, tmp_mags, tmp_r = sortbyr(metalist,to_report_r,heliocentric_corrected_magnitudes,1)
+            tmpmeta, tmp_mags, tmp_r = sortbyr(metatable,signed_r,metatable['mhelio'],1)
             for i in range (0, len(tmp_mags)):
                 tmp_mags[i] = float(tmp_mags[i])
                 tmp_r[i] = float(tmp_r[i])
@@ -1477,13 +1901,9 @@ def main():
             count = count + 1
         except:
             print('mhelio not found, looking for other magnitudes to plot...')
-            
+
         try:
-            try:
-                float(phase_corrected_magnitudes[0])
-            except:
-                del phase_corrected_magnitudes[0]
-            tmpmeta, tmp_mags, tmp_r = sortbyr(metalist,to_report_r,phase_corrected_magnitudes,1)
+            tmpmeta, tmp_mags, tmp_r = sortbyr(metatable,signed_r,metatable['mph'],1)
             for i in range (0, len(tmp_mags)):
                 tmp_mags[i] = float(tmp_mags[i])
                 tmp_r[i] = float(tmp_r[i])
@@ -1498,26 +1918,10 @@ def main():
             axis.append('mph')
         except:
             print('mph not found, looking for other magnitudes to plot...')
-            
+
         try:
-            try:
-                del pre_mshift[0]
-            except:
-                pass
-            try:
-                del post_mshift[0]
-            except:
-                pass
-            try:
-                del pre_r[0]
-            except:
-                pass
-            try:
-                del post_r[0]
-            except:
-                pass
             pre_and_post_shift_mags = pre_mshift + post_mshift
-            pre_and_post_shift_r = pre_r + post_r
+            pre_and_post_shift_r = [(-1.0)*10**(float(x)) for x in pre_r] + [10**(float(x)) for x in post_r]
             mags_to_plot_meta.append(pre_and_post_shift_mags)
             mags_to_plot_meta.append(pre_and_post_shift_r)
             for i in range(0,len(pre_and_post_shift_mags)):
@@ -1534,7 +1938,6 @@ def main():
                 titles.append('Phase and Statistically Corrected Magnitudes')
         except:
             print('No statistical corrections found, now plotting...')
-            
         for i in range(0, len(mags_to_plot_meta)):
             if len(mags_to_plot_meta[i]) < len(mags_to_plot_meta[0]):
                 continue
@@ -1577,10 +1980,90 @@ def main():
             ax.grid(linestyle='--', lw=0.8)
             ax.plot(mags_to_plot_meta[i+1], mags_to_plot_meta[i], '+', mew=1.1, ms=13, color='blue')
 
-            dir_path = os.path.dirname(os.path.realpath(__file__))
-            title = dir_path + '\_' +append_title +"_"+ target_nickname + '_graph_'+str(int(i/2)) + ".png"
+            title = os.path.join(output_directory, append_title +"_"+ target_nickname + '_graph_'+str(int(i/2)) + ".png")
             plt.savefig(title, bbox_inches='tight')
-            ax.cla()
+            plt.close(fig)
             
+#Runs the pipeline (see lightcurve) on the observations of one comet of a catalogue in a directory of its own.
+#Everything the pipeline prints is written to log.txt in that directory, as many comets are processed at once.
+#Returns the name of the comet and, if the pipeline could not be finished for this comet, the reason why.
+def processcomet(name, table, comet_perihelion):
+    global small_body_designation
+    global target_nickname
+    global perihelion
+    global output_directory
+    small_body_designation = name
+    target_nickname = name.replace('/', '_').replace(' ', '_')
+    perihelion = comet_perihelion
+    output_directory = os.path.join(catalogue_directory, target_nickname)
+    os.makedirs(output_directory, exist_ok=True)
+    with open(os.path.join(output_directory, 'log.txt'), 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            rules = sortingrules()
+            lightcurve(filterbatches(lambda: [table], rules), rules)
+        except (Exception, SystemExit) as error:
+            print('Stopped early: ' + repr(error))
+            return name, repr(error)
+    return name, ''
+
+#Optional command line argument --catalogue for an input file with observations of many comets (e.g., a whole COBS export).
+#The input file is read through once and split up by comet (see indexcomets), then every comet is run through the whole
+#pipeline (sorting, any corrections, statistics and plots asked for) on its own, several comets at a time in separate processes.
+#Outputs of each comet are written to catalogue_directory/<comet>/, named after its JPL HORIZONS name (see readperihelia).
+#The corrections need the perihelion of each comet, so when correcting only the comets listed in perihelia_file are processed.
+def catalogue(file_names):
+    correcting = ("--heliocentric" in sys.argv) or ('--phase' in sys.argv)
+    perihelia = readperihelia(perihelia_file)
+    if len(file_names) == 1:
+        comets = indexcomets(readbatches(file_names[0], batch_size))
+    else:
+        comets = indexcomets([readinputs(file_names)])
+    print(len(comets), 'comets found in', input_file)
+    jobs = []
+    for name in sorted(comets):
+        if correcting and (name not in perihelia) and (perihelion != ''):
+            print('No perihelion for ' + name + ' in ' + perihelia_file + ', skipping')
+            continue
+        comet_perihelion, horizons = perihelia.get(name, (perihelion, name))
+        jobs.append((horizons, comets[name], comet_perihelion))
+    os.makedirs(catalogue_directory, exist_ok=True)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=(processes or None)) as pool:
+        futures = [pool.submit(processcomet, *job) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            name, error = future.result()
+            if error != '':
+                print(name + ' could not be finished: ' + error)
+            else:
+                print(name + ' done')
+
+def main():
+    if ephemeris_provider not in ephemeris_providers:
+        print('ephemeris_provider must be one of ' + ', '.join(ephemeris_providers))
+        sys.exit()
+    if (len(phase_models) == 0) or any(model not in phase_functions for model in phase_models):
+        print('phase_models must be one or more of ' + ', '.join(phase_functions))
+        sys.exit()
+    if '--benchmark' in sys.argv:
+        benchmarkelements()
+        return
+    file_names = inputfiles(input_file)
+    if len(file_names) == 0:
+        print('No input files found in ' + input_file)
+        sys.exit()
+    if '--catalogue' in sys.argv:
+        catalogue(file_names)
+    elif '--append' in sys.argv:
+        if len(file_names) != 1:
+            print('Please give a single input file with --append')
+            sys.exit()
+        appendrun(file_names[0], sortingrules())
+    elif len(file_names) == 1:
+        rules = sortingrules()
+        lightcurve(cachedbatches(file_names[0], rules), rules)
+    else:
+        rules = sortingrules()
+        table = readinputs(file_names)
+        lightcurve(filterbatches(lambda: [table], rules), rules)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,6 @@
+#Lets the tests import ICQSplitter.py from the directory above, without a display for matplotlib
+import os
+import sys
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
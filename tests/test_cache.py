@@ -0,0 +1,59 @@
+import os
+import shutil
+
+import numpy as np
+
+import ICQSplitter
+
+GREENE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'GreeneWithBiver.txt')
+
+#Kept observations, removed observations and their reasons of every batch yielded by batches, each joined together
+def joined(batches):
+    batches = list(batches)
+    kept = ICQSplitter.ObservationTable.concatenate([batch[0] for batch in batches])
+    removed = ICQSplitter.ObservationTable.concatenate([batch[1] for batch in batches])
+    return kept.data.tobytes(), removed.data.tobytes(), np.concatenate([batch[2] for batch in batches]).tolist()
+
+#A file sorted and cached with one batch_size is read back from the cache with another, giving the same points as sorting it again
+#without the cache, so batch_size does not need to be part of the name of the cache file (see cachefile)
+def test_cache_does_not_depend_on_batch_size(tmp_path, monkeypatch):
+    file_name = str(tmp_path / 'GreeneWithBiver.txt')
+    shutil.copy(GREENE, file_name)
+    rules = ICQSplitter.sortingrules()
+    monkeypatch.setattr(ICQSplitter, 'cache_directory', str(tmp_path / 'cache'))
+    monkeypatch.setattr(ICQSplitter, 'batch_size', 50)
+    written = joined(ICQSplitter.cachedbatches(file_name, rules))
+    assert os.path.exists(ICQSplitter.cachefile(file_name, rules))
+    monkeypatch.setattr(ICQSplitter, 'batch_size', 100000)
+    assert joined(ICQSplitter.cachedbatches(file_name, rules)) == written
+    assert joined(ICQSplitter.filterbatches(lambda: ICQSplitter.readbatches(file_name, 100000), rules)) == written
+
+#Once the cache grows past cache_size the least recently used files are deleted first, reading a file from the cache counts as using it,
+#and files still being written are left alone
+def test_cache_deletes_least_recently_used_first(tmp_path, monkeypatch):
+    with open(GREENE, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    rules = ICQSplitter.sortingrules()
+    monkeypatch.setattr(ICQSplitter, 'cache_directory', str(tmp_path / 'cache'))
+    names = []
+    for k in range(0, 5):
+        names.append(str(tmp_path / ('input' + str(k) + '.txt')))
+        with open(names[-1], 'wb') as f:
+            f.writelines(lines[k * 400:k * 400 + 400])
+    for k in range(0, 3):
+        joined(ICQSplitter.cachedbatches(names[k], rules))
+        os.utime(ICQSplitter.cachefile(names[k], rules), (1e9 + k * 10, 1e9 + k * 10))
+    sizes = [os.path.getsize(ICQSplitter.cachefile(name, rules)) for name in names[:3]]
+    writing = str(tmp_path / 'cache' / 'sorted.tmp.1.npz')
+    with open(writing, 'wb') as f:
+        f.write(b'\0' * 1000)
+    os.utime(writing, (1e8, 1e8))
+    #room for three files (they are all about the same size), and names[0] is used again so that names[1] is now the least recently used
+    monkeypatch.setattr(ICQSplitter, 'cache_size', (sum(sizes) + max(sizes) // 2) / 2 ** 20)
+    joined(ICQSplitter.cachedbatches(names[0], rules))
+    joined(ICQSplitter.cachedbatches(names[3], rules))
+    cached = lambda: [os.path.exists(ICQSplitter.cachefile(name, rules)) for name in names]
+    assert cached() == [True, False, True, True, False]
+    joined(ICQSplitter.cachedbatches(names[4], rules))
+    assert cached() == [True, False, False, True, True]
+    assert os.path.exists(writing)
@@ -0,0 +1,45 @@
+import ICQSplitter
+
+#Comets are named from their ICQ designation, as long period comets unless they have a short period number
+def test_horizonsname():
+    assert ICQSplitter.horizonsname('  2', '', '') == '2P'
+    assert ICQSplitter.horizonsname('', '1995O1', '') == 'C/1995 O1'
+    assert ICQSplitter.horizonsname(' 73', '', 'b') == '73P-B'
+
+#Lines of perihelia_file give a perihelion date (or - for none) and, optionally after it, the name JPL HORIZONS knows the comet by
+def test_readperihelia(tmp_path):
+    file_name = tmp_path / 'perihelia.txt'
+    file_name.write_text('#designation, perihelion and JPL HORIZONS name\nC/1995 O1 1997/04/01\n\nC/2010 V1 2010/10/26 P/2010 V1\nC/2017 U1 - 1I\nC/2020 F3\n')
+    perihelia = ICQSplitter.readperihelia(str(file_name))
+    assert perihelia == {'C/1995 O1': ('1997/04/01', 'C/1995 O1'), 'C/2010 V1': ('2010/10/26', 'P/2010 V1'), 'C/2017 U1': ('', '1I')}
+
+#With --catalogue, comets named in perihelia_file are run under their JPL HORIZONS name
+def test_catalogue_uses_horizons_names(tmp_path, monkeypatch):
+    (tmp_path / 'perihelia.txt').write_text('C/1995 O1 1997/04/01 Hale-Bopp\n')
+    lines = [' ' * 3 + '1995O1' + ' ' * 2 + '1997 03 01.00  S  1.0 AA  5.0B         ICQ 97 OBS01', ' ' * 3 + '1996B2' + ' ' * 2 + '1996 03 01.00  S  1.0 AA  5.0B         ICQ 96 OBS01']
+    (tmp_path / 'input.txt').write_text('\n'.join(lines) + '\n')
+    jobs = []
+    monkeypatch.setattr(ICQSplitter, 'perihelia_file', str(tmp_path / 'perihelia.txt'))
+    monkeypatch.setattr(ICQSplitter, 'catalogue_directory', str(tmp_path / 'catalogue'))
+    monkeypatch.setattr(ICQSplitter.sys, 'argv', ['ICQSplitter.py', '--catalogue'])
+    monkeypatch.setattr(ICQSplitter.concurrent.futures, 'ProcessPoolExecutor', lambda max_workers: Pool(jobs))
+    ICQSplitter.catalogue([str(tmp_path / 'input.txt')])
+    assert sorted((job[0], job[2]) for job in jobs) == [('C/1996 B2', ICQSplitter.perihelion), ('Hale-Bopp', '1997/04/01')]
+
+#Stands in for the process pool of catalogue, recording each job rather than running it
+class Pool:
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+    def submit(self, function, *job):
+        self.jobs.append(job)
+        future = ICQSplitter.concurrent.futures.Future()
+        future.set_result((job[0], ''))
+        return future
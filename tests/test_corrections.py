@@ -0,0 +1,96 @@
+import math
+import os
+
+import numpy as np
+
+import ICQSplitter
+
+PHASE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Schleicher_Composite_Phase_Function.txt')
+
+#Henyey-Greenstein function of g at a scattering angle of 180 - alpha degrees, written out for one phase angle at a time
+def henyeygreenstein(alpha, g):
+    theta = math.radians(180. - alpha)
+    return (1. - g * g) / (1. + g * g - 2. * g * math.cos(theta)) ** 1.5
+
+#Each phase model at a phase angle (degrees) in closed form, normalized to 0 degrees
+def closedform(model, alpha):
+    if model == 'marcus':
+        compound = lambda alpha: 0.95 * henyeygreenstein(alpha, 0.9) + 0.05 * henyeygreenstein(alpha, -0.6)
+        return compound(alpha) / compound(0.)
+    if model == 'henyey-greenstein':
+        return henyeygreenstein(alpha, ICQSplitter.phase_hg_g) / henyeygreenstein(0., ICQSplitter.phase_hg_g)
+    if model == 'linear':
+        return 10. ** (-0.4 * ICQSplitter.phase_linear_beta * alpha)
+    with open(PHASE_FILE) as f:
+        composite = dict((float(line.split()[0]), float(line.split()[1])) for line in f if line.strip() != '')
+    low = math.floor(alpha)
+    return composite[low] + (alpha - low) * (composite.get(low + 1., composite[low]) - composite[low])
+
+#Every phase model is its closed form at any phase angle, to within the error of interpolating its table linearly
+def test_phase_models_match_closed_forms():
+    alpha = np.random.default_rng(4).uniform(0., 180., 2000)
+    alpha[:4] = [0., 1., 90.5, 180.]
+    for model in ICQSplitter.phase_functions:
+        values = ICQSplitter.phasefunction(alpha, model)
+        expected = np.array([closedform(model, a) for a in alpha.tolist()])
+        assert np.abs(values / expected - 1.).max() < 2e-6, model
+
+#Linear interpolation of a table every h degrees is within h^2 / 8 times the largest second derivative of the model (on the two steps
+#either side) of the model itself, at the default resolution and at a coarse one. Changing the resolution makes a new table.
+def test_phase_table_interpolation_error(monkeypatch):
+    alpha = np.random.default_rng(5).uniform(0., 180., 5000)
+    for resolution in [ICQSplitter.phase_table_resolution, 1.]:
+        monkeypatch.setattr(ICQSplitter, 'phase_table_resolution', resolution)
+        for model, function in ICQSplitter.phase_functions.items():
+            if model == 'schleicher':
+                continue    #the composite is itself interpolated linearly between whole degrees
+            nodes = np.linspace(0., 180., int(round(180. / resolution)) + 1)
+            fine = function(np.concatenate([nodes[:1] - resolution, nodes, nodes[-1:] + resolution]))
+            curvature = np.abs(fine[2:] - 2. * fine[1:-1] + fine[:-2]) / resolution ** 2
+            index = np.minimum((alpha / resolution).astype(np.int64), len(nodes) - 2)
+            largest = np.max([curvature[np.clip(index + k, 0, len(nodes) - 1)] for k in [-1, 0, 1, 2]], axis=0)
+            error = np.abs(ICQSplitter.phasefunction(alpha, model) - function(alpha))
+            assert len(ICQSplitter.phase_tables[ICQSplitter.phasetablekey(model)][0]) == len(nodes)
+            assert (error <= 1.05 * resolution ** 2 / 8. * largest + 1e-12).all(), (model, resolution)
+
+#A table is made again when a parameter of its model changes rather than the table of the old parameter being used
+def test_phase_tables_follow_parameters(monkeypatch):
+    alpha = np.array([30., 120.])
+    for g in [0.9, 0.5]:
+        monkeypatch.setattr(ICQSplitter, 'phase_hg_g', g)
+        expected = np.array([closedform('henyey-greenstein', a) for a in alpha.tolist()])
+        assert np.allclose(ICQSplitter.phasefunction(alpha, 'henyey-greenstein'), expected, rtol=1e-6)
+    for beta in [0.035, 0.02]:
+        monkeypatch.setattr(ICQSplitter, 'phase_linear_beta', beta)
+        assert np.allclose(ICQSplitter.phasefunction(alpha, 'linear'), 10. ** (-0.4 * beta * alpha), rtol=1e-6)
+
+#apply_corrections makes mhelio = m - 5 log10(delta), mph from the first phase model and mph_<name> from each other one, on mhelio when
+#both corrections are made, as floats for every observation at once
+def test_apply_corrections():
+    table = ICQSplitter.ObservationTable(np.zeros(3, dtype=ICQSplitter.ICQ_DTYPE))
+    table.data['mag'] = [5.0, 7.5, float('nan')]
+    ephem = {'delta': np.array([0.5, 2.0, 1.0]), 'phase': np.array([10., 45.5, 90.])}
+    helio = ICQSplitter.apply_corrections(table, ephem, helio=True)
+    assert list(helio) == ['mhelio'] and helio['mhelio'].dtype == np.float64
+    assert np.allclose(helio['mhelio'][:2], [5.0 - 5. * math.log10(0.5), 7.5 - 5. * math.log10(2.0)]) and np.isnan(helio['mhelio'][2])
+    both = ICQSplitter.apply_corrections(table, ephem, helio=True, phase=['linear', 'marcus'])
+    assert list(both) == ['mhelio', 'mph', 'mph_marcus']
+    for name, model in [('mph', 'linear'), ('mph_marcus', 'marcus')]:
+        expected = [helio['mhelio'][k] + 2.5 * math.log10(closedform(model, ephem['phase'][k])) for k in range(2)]
+        assert np.allclose(both[name][:2], expected, atol=1e-5)
+    phase = ICQSplitter.apply_corrections(table, ephem, phase=['schleicher'])
+    assert list(phase) == ['mph'] and np.allclose(phase['mph'][:2], [5.0 + 2.5 * math.log10(closedform('schleicher', 10.)), 7.5 + 2.5 * math.log10(closedform('schleicher', 45.5))])
+    assert ICQSplitter.apply_corrections(table, ephem) == {}
+
+#phase_function_file is found from the directory of ICQSplitter.py whatever the current directory, read in once, and the composite
+#is interpolated linearly at fractional phase angles rather than rounded to whole degrees
+def test_schleicher_composite_read_once_from_any_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ICQSplitter, 'schleicher_composite', {})
+    composite = ICQSplitter.readphasefunction('Schleicher_Composite_Phase_Function.txt')
+    assert composite['alpha'][:3].tolist() == [0., 1., 2.] and composite['normalized'][:3].tolist() == [1.0, 0.9596, 0.9217]
+    reads = []
+    monkeypatch.setattr(ICQSplitter, 'readphasefunction', lambda file_name: reads.append(file_name) or composite)
+    assert np.allclose(ICQSplitter.schleicherphase(np.array([0.25, 1.5, 2.])), [1.0 - 0.25 * 0.0404, (0.9596 + 0.9217) / 2., 0.9217])
+    ICQSplitter.schleicherphase(np.array([3.]))
+    assert reads == [ICQSplitter.phase_function_file]
@@ -0,0 +1,244 @@
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+
+import ICQSplitter
+
+#time.sleep, kept before the tests stop ICQSplitter from waiting between tries
+sleep = time.sleep
+
+#Julian Date of each epoch in epochs (numpy datetime64)
+def juliandates(epochs):
+    return epochs.astype('datetime64[s]').astype(np.int64) / 86400. + 2440587.5
+
+#r, delta and phase angle made up from the Julian Date, so that where every value came from can be checked
+def madeup(julian):
+    return {'datetime_jd': julian, 'r': 1. + (julian - 2450000.) / 1000., 'delta': 2. + (julian - 2450000.) / 1000., 'alpha': (julian - 2450000.) % 90.}
+
+#Stand-in for the callhorizons package, answering queries from madeup rather than JPL HORIZONS.
+#Every query is recorded as (epochs asked for, step) in the order they finish, the first failures queries of each window raise an error
+#and each query takes delay(first epoch of the query) seconds. Epochs before first have no ephemerides and are left out of the answer.
+class StandIn:
+
+    def __init__(self, failures=0):
+        self.queries = []
+        self.failures = failures
+        self.failed = {}
+        self.delay = lambda epoch: 0.
+        self.first = np.datetime64('1900-01-01T00:00')
+        self.lock = threading.Lock()
+        self.module = types.SimpleNamespace(query=self.query)
+
+    def query(self, target):
+        standin = self
+
+        class Query:
+            def set_epochrange(self, start, stop, step):
+                assert step.endswith('m')
+                self.step = int(step[:-1])
+                self.epochs = np.arange(np.datetime64(start.replace(' ', 'T')), np.datetime64(stop.replace(' ', 'T')) + np.timedelta64(1, 'm'), np.timedelta64(self.step, 'm'))
+
+            def set_discreteepochs(self, julian):
+                self.step = None
+                self.epochs = np.round((np.array(julian) - 2440587.5) * 1440.).astype(np.int64).astype('datetime64[m]')
+
+            def get_ephemerides(self, observatory):
+                sleep(standin.delay(self.epochs[0]))
+                with standin.lock:
+                    key = (str(self.epochs[0]), len(self.epochs))
+                    standin.failed[key] = standin.failed.get(key, 0) + 1
+                    if standin.failed[key] <= standin.failures:
+                        raise IOError('connection dropped')
+                    standin.queries.append((self.epochs, self.step))
+                self.data = madeup(juliandates(self.epochs[self.epochs >= standin.first]))
+                return len(self.epochs)
+
+            def __getitem__(self, name):
+                return self.data[name]
+
+        return Query()
+
+@pytest.fixture
+def standin(monkeypatch):
+    standin = StandIn()
+    monkeypatch.setattr(ICQSplitter, 'callhorizons', standin.module, raising=False)
+    monkeypatch.setattr(ICQSplitter, 'ephemeris_provider', 'horizons')
+    monkeypatch.setattr(ICQSplitter, 'small_body_designation', 'C/1995 O1')
+    monkeypatch.setattr(ICQSplitter, 'cache_directory', '')
+    monkeypatch.setattr(ICQSplitter, 'JPL_Query_Epochs', 100)
+    monkeypatch.setattr(ICQSplitter, 'JPL_Connections', 4)
+    monkeypatch.setattr(ICQSplitter.time, 'sleep', lambda seconds: None)
+    return standin
+
+#Observation times (numpy datetime64 to the second) over days days from 1997-01-01
+def times(days):
+    return np.datetime64('1997-01-01T00:00:00') + np.arange(0, days * 86400, 8191).astype('timedelta64[s]')
+
+#A date range of more than JPL_Query_Epochs epochs is split into windows of at most JPL_Query_Epochs epochs, one query each,
+#which are joined back together in order of date however the queries made at once finish
+def test_windows_are_split_and_joined_in_order(standin):
+    epochs, step = ICQSplitter.ephemerisepochs(times(40))
+    assert step == 30
+    #the earliest windows take the longest, so that they finish last
+    standin.delay = lambda epoch: float((epochs[-1] - epoch) / np.timedelta64(1, 'D')) * 0.005
+    result = ICQSplitter.queryepochs(epochs, step)
+    finished = [query[0][0] for query in standin.queries]
+    assert finished != sorted(finished)
+    assert len(standin.queries) == -(-len(epochs) // 100)
+    assert max(len(query[0]) for query in standin.queries) == 100
+    assert sorted(str(epoch) for query in standin.queries for epoch in query[0]) == sorted(str(epoch) for epoch in epochs)
+    np.testing.assert_allclose(result['datetime_jd'], juliandates(epochs), rtol=0, atol=1e-8)
+    for name in ICQSplitter.ephemeris_columns:
+        np.testing.assert_allclose(result[name], madeup(juliandates(epochs))[name], rtol=0, atol=1e-8)
+
+#Failed queries are tried again after waiting 1, 2, 4, ... seconds, up to JPL_Retries times, before giving up
+def test_failed_queries_are_tried_again(standin, monkeypatch):
+    waits = []
+    monkeypatch.setattr(ICQSplitter.time, 'sleep', waits.append)
+    monkeypatch.setattr(ICQSplitter, 'JPL_Retries', 3)
+    standin.failures = 2
+    epochs, step = ICQSplitter.ephemerisepochs(times(3))
+    result = ICQSplitter.queryepochs(epochs, step)
+    windows = -(-len(epochs) // 100)
+    assert len(standin.queries) == windows
+    assert sorted(waits) == [1] * windows + [2] * windows
+    np.testing.assert_allclose(result['datetime_jd'], juliandates(epochs), rtol=0, atol=1e-8)
+    standin.failures = 10
+    standin.failed.clear()
+    with pytest.raises(IOError):
+        ICQSplitter.queryepochs(epochs, step)
+
+#Steps longer than an hour are asked of JPL HORIZONS as they are, and every observation still has an epoch on either side of it
+def test_steps_over_an_hour(standin, monkeypatch):
+    monkeypatch.setattr(ICQSplitter, 'JPL_Time_Increment', 180)
+    observed = times(40)
+    epochs, step = ICQSplitter.ephemerisepochs(observed)
+    assert step == 180
+    assert np.all(np.diff(epochs) == np.timedelta64(180, 'm'))
+    assert (epochs[0] <= observed.min()) and (epochs[-1] >= observed.max())
+    result = ICQSplitter.queryepochs(epochs, step)
+    assert set(query[1] for query in standin.queries) == {180}
+    np.testing.assert_allclose(result['datetime_jd'], juliandates(epochs), rtol=0, atol=1e-8)
+
+#With the ephemeris cache, only the epochs that are not in it yet are queried and the ephemerides returned are those of every epoch asked for
+def test_only_missing_epochs_are_queried(standin, monkeypatch, tmp_path):
+    monkeypatch.setattr(ICQSplitter, 'cache_directory', str(tmp_path))
+    first, step = ICQSplitter.ephemerisepochs(times(10))
+    ICQSplitter.ephemerides(first, step)
+    assert sum(len(query[0]) for query in standin.queries) == len(first)
+    del standin.queries[:]
+    second, step = ICQSplitter.ephemerisepochs(times(20))
+    result = ICQSplitter.ephemerides(second, step)
+    queried = np.concatenate([query[0] for query in standin.queries])
+    assert sorted(str(epoch) for epoch in queried) == sorted(str(epoch) for epoch in second[~np.isin(second, first)])
+    np.testing.assert_allclose(result['datetime_jd'], juliandates(second), rtol=0, atol=1e-8)
+    np.testing.assert_allclose(result['r'], madeup(juliandates(second))['r'], rtol=0, atol=1e-8)
+    del standin.queries[:]
+    ICQSplitter.ephemerides(second[5:50], step)
+    assert standin.queries == []
+
+#Epochs that JPL HORIZONS has no ephemerides at are left out of the ephemerides returned, and are recorded in the cache so that they
+#are not queried again
+def test_epochs_without_ephemerides_are_queried_once(standin, monkeypatch, tmp_path):
+    monkeypatch.setattr(ICQSplitter, 'cache_directory', str(tmp_path))
+    standin.first = np.datetime64('1997-01-04T00:00')
+    epochs, step = ICQSplitter.ephemerisepochs(times(10))
+    answered = epochs[epochs >= standin.first]
+    for run in range(2):
+        result = ICQSplitter.ephemerides(epochs, step)
+        np.testing.assert_allclose(result['datetime_jd'], juliandates(answered), rtol=0, atol=1e-8)
+        np.testing.assert_allclose(result['r'], madeup(juliandates(answered))['r'], rtol=0, atol=1e-8)
+        assert sum(len(query[0]) for query in standin.queries) == len(epochs)
+    standin.first = np.datetime64('1900-01-01T00:00')
+    assert len(ICQSplitter.ephemerides(epochs[:20], step)['r']) == 0 and sum(len(query[0]) for query in standin.queries) == len(epochs)
+
+#The mock ephemeris provider interpolates the ephemerides set in mock_ephemerides to the epochs asked for, split into windows the same way
+def test_mock_provider(monkeypatch):
+    monkeypatch.setattr(ICQSplitter, 'ephemeris_provider', 'mock')
+    monkeypatch.setattr(ICQSplitter, 'small_body_designation', 'C/1995 O1')
+    monkeypatch.setattr(ICQSplitter, 'JPL_Query_Epochs', 100)
+    known = np.datetime64('1996-12-30T00:00') + np.arange(0, 20 * 1440, 360).astype('timedelta64[m]')
+    monkeypatch.setitem(ICQSplitter.mock_ephemerides, 'C/1995 O1', madeup(juliandates(known)))
+    epochs, step = ICQSplitter.ephemerisepochs(times(10))
+    result = ICQSplitter.ephemerides(epochs, step)
+    np.testing.assert_allclose(result['datetime_jd'], juliandates(epochs), rtol=0, atol=1e-8)
+    np.testing.assert_allclose(result['r'], madeup(juliandates(epochs))['r'], rtol=0, atol=1e-9)
+
+#With JPL_Spline_Increment the splines through the two body ephemerides of a sungrazing comet (C/2011 W3, Lovejoy) are within
+#JPL_Spline_Tolerance magnitudes of the exact ephemerides at every observation time. The epochs queried are hours apart more than 5 days from
+#perihelion and under an hour apart within a day of it, and the times right at perihelion, where even epochs JPL_Time_Increment apart are too far apart, are looked up exactly.
+def test_splines_within_tolerance_and_exact_near_perihelion(monkeypatch):
+    elements = [0.005553, 0.999929, 134.355, 326.36, 53.55, 2455911.5]
+    monkeypatch.setattr(ICQSplitter, 'ephemeris_provider', 'elements')
+    monkeypatch.setattr(ICQSplitter, 'small_body_designation', 'C/2011 W3')
+    monkeypatch.setattr(ICQSplitter, 'orbital_elements', {'C/2011 W3': elements})
+    monkeypatch.setattr(ICQSplitter, 'JPL_Spline_Increment', 1440)
+    monkeypatch.setattr(ICQSplitter, 'JPL_Time_Increment', 30)
+    queries = []
+    elementsephemerides = ICQSplitter.ephemeris_providers['elements']
+    monkeypatch.setitem(ICQSplitter.ephemeris_providers, 'elements', lambda window, step: queries.append((ICQSplitter.windowepochs(window, step), step)) or elementsephemerides(window, step))
+    perihelion = np.datetime64('2011-12-16T00:00:00')
+    observed = np.sort(perihelion + (np.random.default_rng(7).uniform(-10., 10., 500) * 86400.).astype('timedelta64[s]'))
+    result = ICQSplitter.splineephemerides(observed)
+    exact = ICQSplitter.twobodyephemerides(juliandates(observed), elements)
+    np.testing.assert_allclose(result['datetime_jd'], juliandates(observed), rtol=0, atol=1e-8)
+    error = np.maximum.reduce([5. * np.abs(np.log10(result['r'] / exact['r'])), 5. * np.abs(np.log10(result['delta'] / exact['delta'])), 0.04 * np.abs(result['alpha'] - exact['alpha'])])
+    assert error.max() <= ICQSplitter.JPL_Spline_Tolerance
+    looked_up = np.concatenate([epochs for epochs, step in queries if step is None and epochs.dtype == np.dtype('datetime64[s]')])
+    assert len(looked_up) != 0 and np.all(np.abs(looked_up - perihelion) < np.timedelta64(1, 'D'))
+    gridded = np.unique(np.concatenate([epochs.astype('datetime64[m]') for epochs, step in queries if not (step is None and epochs.dtype == np.dtype('datetime64[s]'))]))
+    middles, gaps = gridded[:-1] + np.diff(gridded) // 2, np.diff(gridded)
+    assert gaps[np.abs(middles - perihelion) > np.timedelta64(5, 'D')].min() >= np.timedelta64(360, 'm')
+    assert gaps[np.abs(middles - perihelion) < np.timedelta64(1, 'D')].min() < np.timedelta64(2 * 30, 'm')
+
+#Each observation is matched to the nearest epoch of the ephemerides, and observations with no epoch within half of JPL_Time_Increment
+#are printed and taken out of metatable rather than corrected with the ephemerides of another time
+def test_unmatched_observations_are_reported(monkeypatch, capsys):
+    data = np.zeros(4, dtype=ICQSplitter.ICQ_DTYPE)
+    data['obs'] = [b'AAA01', b'BBB02', b'CCC03', b'DDD04']
+    data['yearobs'] = 1997
+    data['monthobs'] = 1
+    data['dayobs'] = [1.5, 1.51, 3.0, 1.0]
+    table = ICQSplitter.ObservationTable(data)
+    julian, times = ICQSplitter.observationtimes(table)
+    #every 30 minutes over the first day of 1997 only
+    epochs = np.arange(np.datetime64('1997-01-01T00:00'), np.datetime64('1997-01-02T00:00'), np.timedelta64(30, 'm'))
+    monkeypatch.setattr(ICQSplitter, 'JPL_Time_Increment', 30)
+    monkeypatch.setattr(ICQSplitter, 'JPL_Spline_Increment', 0)
+    monkeypatch.setattr(ICQSplitter, 'OBJJulianDate', juliandates(epochs), raising=False)
+    monkeypatch.setattr(ICQSplitter, 'metatable', table, raising=False)
+    monkeypatch.setattr(ICQSplitter, 'date_compare_to_JPL', np.datetime_as_string(times, unit='s').tolist(), raising=False)
+    nearest = ICQSplitter.matchephemerides()
+    assert nearest.tolist() == [24, 24, 0]
+    assert ICQSplitter.metatable.text('obs') == ['AAA01', 'BBB02', 'DDD04']
+    assert ICQSplitter.date_compare_to_JPL == ['1997-01-01T12:00:00', '1997-01-01T12:14:24', '1997-01-01T00:00:00']
+    printed = capsys.readouterr().out
+    assert '1 observations have no ephemerides near their time' in printed and 'CCC03 1997-01-03T00:00:00' in printed
+
+#With perihelion = '' the date of perihelion and r there are taken from where r is smallest in the ephemerides queried for the observations,
+#with a warning when that is at the first or last of them (perihelion is then outside the dates observed)
+def test_perihelion_found_from_ephemerides(monkeypatch, capsys):
+    julian = 2450539.5 + np.arange(-60., 60.01, 0.25)
+    monkeypatch.setattr(ICQSplitter, 'mock_ephemerides', {'C/1995 O1': {'datetime_jd': julian, 'r': 0.914 + ((julian - 2450530.5) / 100.) ** 2, 'delta': np.ones(len(julian)), 'alpha': np.ones(len(julian))}})
+    monkeypatch.setattr(ICQSplitter, 'ephemeris_provider', 'mock')
+    monkeypatch.setattr(ICQSplitter, 'small_body_designation', 'C/1995 O1')
+    monkeypatch.setattr(ICQSplitter, 'JPL_Spline_Increment', 0)
+    monkeypatch.setattr(ICQSplitter, 'JPL_Discrete_Epochs', 0)
+    monkeypatch.setattr(ICQSplitter, 'appending', None)
+    monkeypatch.setattr(ICQSplitter, 'r_at_perihelion', None, raising=False)
+    for days, expected in [([20, 25, 31], '1997/03/23'), ([1, 5, 10], '1997/03/11')]:
+        data = np.zeros(len(days), dtype=ICQSplitter.ICQ_DTYPE)
+        data['yearobs'] = 1997
+        data['monthobs'] = 3
+        data['dayobs'] = days
+        monkeypatch.setattr(ICQSplitter, 'metatable', ICQSplitter.ObservationTable(data), raising=False)
+        monkeypatch.setattr(ICQSplitter, 'perihelion', '')
+        ICQSplitter.queryJPL()
+        assert ICQSplitter.perihelion == expected
+        printed = capsys.readouterr().out
+        assert 'Querying mock_ephemerides' in printed and 'JPL HORIZONS' not in printed
+        assert ('perihelion may be outside the dates observed' in printed) == (expected == '1997/03/11')
+        assert ICQSplitter.r_at_perihelion == 0.9
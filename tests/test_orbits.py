@@ -0,0 +1,47 @@
+import numpy as np
+
+import ICQSplitter
+
+#Gaussian gravitational constant, au^1.5 per day
+K = 0.01720209895
+
+#Epochs from 400 days before perihelion to 400 days after, perihelion itself included
+def epochs(T):
+    return T + np.concatenate([np.linspace(-400., 400., 801), [0.]])
+
+#Every orbit of keplerpositions, elliptic, nearly parabolic, parabolic and hyperbolic, keeps its energy (-k^2 / 2a, 0 or k^2 / 2a per unit mass)
+#and angular momentum (k sqrt(q (1 + e)), always in the same direction), its velocity is the rate of change of its position and it is q from
+#the Sun at perihelion
+def test_kepler_orbits_keep_energy_and_angular_momentum():
+    T = 2450539.63
+    for q, e in [(1.2, 0.3), (0.9141, 0.9951), (0.5, 1.), (2.0, 1.4)]:
+        julian = epochs(T)
+        position, velocity = ICQSplitter.keplerpositions(julian, q, e, 89.43, 282.47, 130.59, T)
+        r = np.linalg.norm(position, axis=0)
+        energy = (velocity ** 2).sum(axis=0) / 2. - K ** 2 / r
+        expected = 0. if e == 1. else K ** 2 * (e - 1.) / (2. * q)
+        assert np.allclose(energy, expected, rtol=0., atol=1e-12), (q, e)
+        momentum = np.cross(position.T, velocity.T)
+        assert np.allclose(momentum, momentum[0], rtol=1e-9, atol=0.), (q, e)
+        assert np.allclose(np.linalg.norm(momentum[0]), K * np.sqrt(q * (1. + e)), rtol=1e-10), (q, e)
+        assert abs(r[-1] - q) < 1e-12 and r.min() >= q - 1e-12, (q, e)
+        step = 1e-2
+        ahead, behind = [ICQSplitter.keplerpositions(julian + change, q, e, 89.43, 282.47, 130.59, T)[0] for change in [step, -step]]
+        assert np.allclose((ahead - behind) / (2. * step), velocity, rtol=0., atol=1e-8), (q, e)
+
+#The Earth stays between its perihelion and aphelion distances, and is where it was at J2000 (JPL DE ephemerides, ecliptic J2000)
+def test_earth_positions():
+    earth = ICQSplitter.earthpositions(np.array([2451545.0]))[:, 0]
+    assert np.allclose(earth, [-0.17713, 0.96724, 0.], atol=5e-4)
+    distance = np.linalg.norm(ICQSplitter.earthpositions(np.linspace(2451545.0, 2451545.0 + 365.25, 1000)), axis=0)
+    assert (distance > 0.9832).all() and (distance < 1.0168).all()
+
+#The two body ephemerides of C/2020 F3 (NEOWISE) from its osculating elements match the JPL HORIZONS ephemerides in
+#example_data/NEOWISE/keepers.csv, as the planets hardly move it over the week from its perihelion
+def test_twobody_ephemerides_match_horizons():
+    elements = [0.29470, 0.99918, 128.937, 61.010, 37.279, 2459034.18]
+    horizons = {'datetime_jd': np.array([2459040.916666667, 2459040.729166667]), 'r': np.array([0.361382051194, 0.358148695033]), 'delta': np.array([0.91690425830808, 0.92306257538769]), 'alpha': np.array([95.3764, 94.606])}
+    twobody = ICQSplitter.twobodyephemerides(horizons['datetime_jd'], elements)
+    assert np.allclose(twobody['r'], horizons['r'], rtol=0., atol=1e-4)
+    assert np.allclose(twobody['delta'], horizons['delta'], rtol=0., atol=1e-4)
+    assert np.allclose(twobody['alpha'], horizons['alpha'], rtol=0., atol=0.02)
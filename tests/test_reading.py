@@ -0,0 +1,111 @@
+import datetime
+import os
+import random
+
+import numpy as np
+
+import ICQSplitter
+
+GREENE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'GreeneWithBiver.txt')
+
+#The first lines of GreeneWithBiver.txt without their line endings
+def greenelines(count):
+    with open(GREENE, 'rb') as f:
+        return f.read().splitlines()[:count]
+
+#Every ICQ column of file_name read batch_size lines at a time, along with the width of each line
+def readfile(file_name, batch_size):
+    table = ICQSplitter.ObservationTable.concatenate(list(ICQSplitter.readbatches(file_name, batch_size)))
+    return table.rows(), table['linewidth'].tolist()
+
+def writefile(file_name, lines, ending):
+    with open(file_name, 'wb') as f:
+        f.write(ending.join(lines) + ending)
+
+#LF and CRLF line endings, lines longer than 80 columns of different lengths and empty lines between the lines all read the same
+def test_line_endings_ragged_and_blank_lines(tmp_path):
+    lines = [line[:ICQSplitter.ICQ_WIDTH] for line in greenelines(200)]
+    writefile(str(tmp_path / 'lf.txt'), lines, b'\n')
+    expected = readfile(str(tmp_path / 'lf.txt'), 1000)
+    assert expected[1] == [ICQSplitter.ICQ_WIDTH] * len(lines)
+    writefile(str(tmp_path / 'crlf.txt'), lines, b'\r\n')
+    ragged = [line + b' extra' * (k % 3) for k, line in enumerate(lines)]
+    writefile(str(tmp_path / 'ragged.txt'), ragged, b'\n')
+    blank = sum([[line, b''] if k % 7 == 0 else [line] for k, line in enumerate(lines)], [b''])
+    writefile(str(tmp_path / 'blank.txt'), blank, b'\r\n')
+    for name in ['lf.txt', 'crlf.txt', 'blank.txt']:
+        for batch_size in [1, 13, 1000]:
+            assert readfile(str(tmp_path / name), batch_size) == expected
+    for batch_size in [1, 13, 1000]:
+        rows, widths = readfile(str(tmp_path / 'ragged.txt'), batch_size)
+        assert rows == expected[0]
+        assert widths == [len(line) for line in ragged]
+
+#Lines shorter than 80 columns are read with their missing columns blank and removed as incomplete lines, as are lines without an observer
+def test_short_lines_are_removed(tmp_path):
+    lines = [line[:ICQSplitter.ICQ_WIDTH] for line in greenelines(50)]
+    lines[5] = lines[5][:60]
+    lines[9] = lines[9][:ICQSplitter.ICQ_WIDTH - 1]
+    lines[20] = lines[20][:75] + b'     '
+    lines[30] = lines[30][:24]
+    file_name = str(tmp_path / 'short.txt')
+    writefile(file_name, lines, b'\n')
+    table = ICQSplitter.ObservationTable.concatenate(list(ICQSplitter.readbatches(file_name, 1000)))
+    assert table['linewidth'][[5, 9, 20, 30]].tolist() == [60, 79, 80, 24]
+    assert table.text('obs')[5] == '' and np.isnan(table['mag'][30])
+    reasons = ICQSplitter.rulereasons(table, ICQSplitter.sortingrules())
+    assert np.flatnonzero(reasons == 11).tolist() == [5, 9, 20, 30]
+
+#parsenumbers reads every field exactly as float() does, and gives NaN for every field float() cannot read
+def test_parsenumbers_matches_float():
+    randomly = random.Random(3)
+    fields = ['', '-', '.', '1.2.3', '1-2', '1 2', 'a', '-.', '--1', '.5', '5.', '-.5', '0', '-0.0', '00012.50']
+    for k in range(2000):
+        digits = ''.join(randomly.choice('0123456789') for i in range(randomly.randint(1, 6)))
+        point = randomly.randint(0, len(digits))
+        field = randomly.choice(['', '-']) + digits[:point] + randomly.choice(['.', '']) + digits[point:]
+        fields.append(field)
+    width = max(len(field) for field in fields) + 2
+    for align in [str.rjust, str.ljust, str.center]:
+        chars = np.array([list(align(field, width).encode()) for field in fields], dtype=np.uint8)
+        values = ICQSplitter.parsenumbers(chars)
+        for field, value in zip(fields, values.tolist()):
+            try:
+                expected = float(field)
+            except ValueError:
+                assert np.isnan(value), field
+            else:
+                assert value == expected, field
+
+#Records sent in more than once across the input files of a directory are read in only once, even when one copy has different line endings
+#or trailing blanks, and the merged observations are in order of night
+def test_duplicate_records_across_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(ICQSplitter, 'processes', 2)
+    lines = [line[:ICQSplitter.ICQ_WIDTH] for line in greenelines(300)]
+    directory = tmp_path / 'submissions'
+    directory.mkdir()
+    writefile(str(directory / 'a.txt'), lines[:200], b'\n')
+    writefile(str(directory / 'b.txt'), lines[150:], b'\r\n')
+    writefile(str(directory / 'c.txt'), [line + b'   ' for line in lines[100:120]] + [lines[0][:60]], b'\n')
+    table = ICQSplitter.readinputs(ICQSplitter.inputfiles(str(directory)))
+    assert len(table) == 301
+    assert sorted(table.rows()) == sorted(readfile(str(directory / 'a.txt'), 1000)[0] + readfile(str(directory / 'b.txt'), 1000)[0][50:] + readfile(str(directory / 'c.txt'), 1000)[0][-1:])
+    assert (np.diff(ICQSplitter.datekeys(table)) >= 0).all()
+
+#observationtimes gives the UT of every decimal day to the nearest second and its Julian Date, before and after 1970, on leap days and
+#where rounding carries into the next day, as datetime and the Julian Date of J2000 (2000 January 1.5 = 2451545.0) give them
+def test_observation_times():
+    randomly = random.Random(7)
+    dates = [(2000, 1, 1.5), (1996, 4, 30.5), (1997, 3, 9.35), (1961, 12, 31.999999), (2020, 2, 29.04166), (1858, 11, 17.0), (2100, 1, 1.00001)]
+    for k in range(500):
+        dates.append((randomly.randint(1850, 2150), randomly.randint(1, 12), round(randomly.uniform(1., 29.), randomly.randint(0, 5))))
+    data = np.zeros(len(dates), dtype=ICQSplitter.ICQ_DTYPE)
+    data['yearobs'], data['monthobs'], data['dayobs'] = zip(*dates)
+    julian, times = ICQSplitter.observationtimes(ICQSplitter.ObservationTable(data))
+    j2000 = datetime.datetime(2000, 1, 1, 12)
+    for (year, month, day), jd, time in zip(dates, julian.tolist(), times.tolist()):
+        expected = datetime.datetime(year, month, 1) + datetime.timedelta(seconds=round((day - 1.) * 86400.))
+        assert time == expected, (year, month, day)
+        assert jd == 2451545.0 + (expected - j2000).total_seconds() / 86400., (year, month, day)
+    assert julian[:2].tolist() == [2451545.0, 2450204.0] and str(times[2]) == '1997-03-09T08:24:00'
+    assert str(times[3]) == '1962-01-01T00:00:00' and julian[5] == 2400000.5
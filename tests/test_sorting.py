@@ -0,0 +1,105 @@
+import os
+import random
+
+import numpy as np
+
+import ICQSplitter
+
+GREENE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'GreeneWithBiver.txt')
+
+#Lines of GreeneWithBiver.txt, the observations of C/1995 O1 (Hale-Bopp) in observer order
+def greenelines():
+    with open(GREENE, 'rb') as f:
+        return [line for line in f.read().splitlines(keepends=True) if line.strip() != b'']
+
+#Every row of table as bytes, so that rows can be compared and sorted
+def rowbytes(table):
+    return np.ascontiguousarray(table.data).view(np.dtype((np.void, table.data.dtype.itemsize))).tolist()
+
+#Kept rows, and removed rows with their reasons, of file_name sorted batch_size lines at a time, each in order of their bytes
+#so that they can be compared whatever order the rows come out in
+def sortfile(file_name, batch_size):
+    batches = list(ICQSplitter.filterbatches(lambda: ICQSplitter.readbatches(file_name, batch_size), ICQSplitter.sortingrules()))
+    kept = ICQSplitter.ObservationTable.concatenate([batch[0] for batch in batches])
+    removed = ICQSplitter.ObservationTable.concatenate([batch[1] for batch in batches])
+    reasons = np.concatenate([batch[2] for batch in batches])
+    return sorted(rowbytes(kept)), sorted(zip(rowbytes(removed), reasons.tolist()))
+
+#Shuffled and date ordered (newest first, as COBS exports are) copies of GreeneWithBiver.txt give the same kept and removed points
+#at every batch_size as when the whole file is sorted at once. Which of two equally preferred reports is kept depends on their
+#order in the file (see deleteForDuplicatedDates), so each copy is compared with itself.
+def test_sorting_does_not_depend_on_batch_size(tmp_path):
+    lines = greenelines()
+    shuffled = list(lines)
+    random.Random(1).shuffle(shuffled)
+    table = ICQSplitter.ObservationTable.concatenate(list(ICQSplitter.readbatches(GREENE, len(lines))))
+    julian, times = ICQSplitter.observationtimes(table)
+    by_date = [lines[k] for k in np.argsort(-julian, kind='stable')]
+    for name, ordered in [('shuffled.txt', shuffled), ('by_date.txt', by_date)]:
+        file_name = str(tmp_path / name)
+        with open(file_name, 'wb') as f:
+            f.writelines(ordered)
+        expected = sortfile(file_name, len(lines))
+        assert sum(reason == 0 for row, reason in expected[1]) == 290
+        for batch_size in [50, 500, 100000]:
+            assert sortfile(file_name, batch_size) == expected
+
+#Three reports by the same observer on the same night, wherever they are in the table, leave only the most preferred one
+def test_duplicates_of_three_keep_one(tmp_path):
+    table = ICQSplitter.ObservationTable.concatenate(list(ICQSplitter.readbatches(GREENE, 100)))[:30]
+    rows = table.data.copy()
+    for k, aperture, method in [(3, 20.0, b'M'), (17, 10.0, b'M'), (26, 10.0, b'S')]:
+        rows[k] = rows[0]
+        rows[k]['instaperture'] = aperture
+        rows[k]['magmethod'] = method
+    rows[0]['obs'] = b'XXX01'
+    table = ICQSplitter.ObservationTable(rows)
+    removed = ICQSplitter.deleteForDuplicatedDates(table, np.ones(len(table), dtype=bool))
+    same_night = [3, 17, 26]
+    assert removed[same_night].tolist() == [True, True, False]
+
+#Sorting the lines of a file in two parts, the second compared with the points kept from the first (as --append does, see appendrun),
+#keeps the same points as sorting the whole file at once, taking out the points of the first part that the second part replaces
+def test_sorting_in_parts_keeps_the_same_points(tmp_path):
+    lines = greenelines()
+    random.Random(2).shuffle(lines)
+    rules = ICQSplitter.sortingrules()
+    parts = []
+    for name, part in [('first.txt', lines[:1200]), ('second.txt', lines[1200:])]:
+        parts.append(str(tmp_path / name))
+        with open(parts[-1], 'wb') as f:
+            f.writelines(part)
+    pending = []
+    first = [batch[0] for batch in ICQSplitter.filterbatches(lambda: ICQSplitter.readbatches(parts[0], 500), rules, pending)]
+    first = ICQSplitter.ObservationTable.concatenate(first)
+    earlier = pending[0]
+    second = [batch[0] for batch in ICQSplitter.filterbatches(lambda: ICQSplitter.readbatches(parts[1], 500), rules, pending, earlier)]
+    winners = pending[1]
+    assert len(winners) < len(earlier) + sum(len(batch) for batch in second)
+    still = first[np.isin(earlier['position'], winners['position'])]
+    kept = ICQSplitter.ObservationTable.concatenate([still] + second)
+    whole = str(tmp_path / 'whole.txt')
+    with open(whole, 'wb') as f:
+        f.writelines(lines)
+    assert sorted(rowbytes(kept)) == sortfile(whole, 500)[0]
+
+#Each rule gives the points failing it its own reason code (the place of its reason in list_of_reasons_removed), a point failing several rules
+#gets the code of the first of them, and GreeneWithBiver.txt loses as many points to each rule as the original row by row filters removed
+def test_rule_reasons():
+    table = ICQSplitter.ObservationTable.concatenate(list(ICQSplitter.readbatches(GREENE, 100000)))
+    rules = ICQSplitter.sortingrules()
+    reasons = ICQSplitter.rulereasons(table, rules)
+    assert np.bincount(reasons[reasons != -1], minlength=len(ICQSplitter.list_of_reasons_removed)).tolist() == [290, 31, 13, 93, 0, 94, 77, 144, 5, 4, 0, 0]
+    rows = np.repeat(table.data[:1], 12)
+    rows['obs'] = [('OBS%02d' % k).encode() for k in range(0, 12)]
+    rows['insttype'] = b'L'
+    rows['mag'] = 10.3
+    changes = [('mag', float('nan')), ('speicalnotes', b'r'), ('poorconditions', b':'), ('speicalnotes', b'&'), ('mag', 5.0), ('insttype', b'B'), ('magmethod', b'X'), ('referencecat', b'SC'), ('yearobs', 0), ('linewidth', 60), ('specialnotestwo', b'r')]
+    for k, (name, value) in enumerate(changes):
+        rows[k + 1][name] = value
+    rows[6]['mag'] = 1.0
+    rows[8]['mag'] = 9.0
+    reasons = ICQSplitter.rulereasons(ICQSplitter.ObservationTable(rows), rules)
+    assert reasons.tolist() == [-1, 1, 2, 3, 8, 5, 6, 7, 9, 10, 11, 2]
+    rows[1]['speicalnotes'] = b'r'
+    assert ICQSplitter.rulereasons(ICQSplitter.ObservationTable(rows), rules)[1] == 1
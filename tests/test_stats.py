@@ -0,0 +1,58 @@
+import statistics
+
+import numpy as np
+
+import ICQSplitter
+
+#The iterated polynomial fit of stats_shifts as it was first written: a loop over every observer and point, each weighted fit solved
+#with the singular value decomposition of A. r and mags are sorted as stats_shifts sorts them, observers is the observer of each point.
+#Returns mshift, the list of observers and the coefficients of the last fit (highest power first)
+def svdshifts(r, mags, observers):
+    obs_list = []
+    for observer in observers:
+        if observer not in obs_list:
+            obs_list.append(observer)
+    stdevs = dict((observer, 1.) for observer in obs_list)
+    mshift = list(mags)
+    fit = None
+    for k in range(0, 21):
+        if k != 0:
+            for observer in obs_list:
+                stdevs[observer] = statistics.stdev([residuals[h] for h in range(len(r)) if observers[h] == observer])
+        A = np.array([[r[i] ** j / stdevs[observers[i]] for j in range(0, 6)] for i in range(len(r))])
+        b = np.array([[mshift[i] / stdevs[observers[i]]] for i in range(len(r))])
+        U, S, Vh = np.linalg.svd(A, full_matrices=False)
+        coefficients = np.matmul(np.matmul(Vh.T, np.diag(1. / S)), np.matmul(U.T, b))[:, 0][::-1]
+        residuals = [np.polyval(coefficients, r[i]) - mshift[i] for i in range(len(r))]
+        for observer in obs_list:
+            mean = statistics.mean([residuals[h] for h in range(len(r)) if observers[h] == observer])
+            mshift = [mshift[h] + mean if observers[h] == observer else mshift[h] for h in range(len(r))]
+        converged = (fit is not None) and np.all(np.abs(fit - coefficients) < 0.0001)
+        fit = coefficients
+        if converged:
+            break
+    return mshift, obs_list, fit.tolist()
+
+#stats_shifts gives the same mshift, observers and polynomial fit as the fit solved by singular value decomposition, on points of four
+#observers a few tenths of a magnitude apart with a little scatter about the same lightcurve
+def test_stats_shifts_match_svd_solution(monkeypatch):
+    monkeypatch.setattr(ICQSplitter, 'perihelion', '1997/04/01')
+    randomly = np.random.default_rng(6)
+    count = 60
+    data = np.zeros(count, dtype=ICQSplitter.ICQ_DTYPE)
+    data['obs'] = np.array([b'AAA01', b'BBB02', b'CCC03', b'DDD04'])[randomly.integers(0, 4, count)]
+    data['yearobs'] = 1996
+    data['monthobs'] = randomly.integers(1, 13, count)
+    data['dayobs'] = randomly.uniform(1., 28., count)
+    r = randomly.uniform(1., 4., count)
+    offsets = dict(zip([b'AAA01', b'BBB02', b'CCC03', b'DDD04'], [0., 0.3, -0.2, 0.5]))
+    mph = -1. + 10. * np.log10(r) + np.array([offsets[observer] for observer in data['obs'].tolist()]) + randomly.normal(0., 0.1, count)
+    table = ICQSplitter.ObservationTable(data, {'r': r, 'mph': mph})
+    shifts = ICQSplitter.stats_shifts('pre', table, 'mph', [])
+    mshift, obs_list, sorted_stats, r_sorted_stat, new_poly_fit = shifts[:5]
+    mags_sorted_stat = shifts[10]
+    expected = svdshifts(list(r_sorted_stat), list(mags_sorted_stat), sorted_stats.text('obs'))
+    assert obs_list == expected[1]
+    assert np.allclose(mshift, expected[0], rtol=0., atol=1e-9)
+    assert np.allclose(new_poly_fit, expected[2], rtol=1e-7, atol=1e-9)
+    assert sorted(mags_sorted_stat) == sorted(mph.tolist())